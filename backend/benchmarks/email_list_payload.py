@@ -0,0 +1,114 @@
+"""
+Benchmark: GET /emails/ payload and latency for one category of 5k emails, before and
+after the summary projection.
+
+Before, the list loaded whole emails through get_emails_by_user_and_category and
+serialized full Email models, body and headers included (read from email_contents
+since bodies moved there). After, list_session_emails loads only the EmailSummary
+columns (load_only) and the body is left to the detail route. Both sides run against a scratch schema in the configured Postgres database
+and are timed from query to JSON bytes, the work the route does per request.
+
+    cd backend && python benchmarks/email_list_payload.py [emails] [iterations]
+"""
+import os
+import statistics
+import sys
+import time
+import uuid
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from pydantic import TypeAdapter  # noqa: E402
+from sqlalchemy import create_engine, text  # noqa: E402
+from sqlalchemy.dialects.postgresql import insert  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+from database.db import DATABASE_URL  # noqa: E402
+from database.migrations import run_migrations  # noqa: E402
+from database.models import EmailContent, compress_body  # noqa: E402
+from models.email import Email, EmailSummary  # noqa: E402
+from services.session_db import get_emails_by_user_and_category, list_session_emails  # noqa: E402
+
+SCHEMA = "email_list_payload"
+SESSION_ID = "sess-bench"
+ACCOUNT = "bench@example.com"
+BODY_BYTES = 8000  # a typical HTML newsletter after text extraction
+HEADER_COUNT = 30
+
+
+def load(db, emails):
+    category_id = uuid.uuid4()
+    db.execute(text("INSERT INTO sessions (id, primary_account) VALUES (:s, :a)"), {"s": SESSION_ID, "a": ACCOUNT})
+    db.execute(
+        text("INSERT INTO session_accounts (id, session_id, email, access_token) VALUES (:id, :s, :a, 'token')"),
+        {"id": uuid.uuid4(), "s": SESSION_ID, "a": ACCOUNT},
+    )
+    db.execute(
+        text("INSERT INTO categories (id, name, description, session_id) VALUES (:id, 'Newsletters', 'bench', :s)"),
+        {"id": category_id, "s": SESSION_ID},
+    )
+    ids = db.execute(text(
+        "INSERT INTO emails (id, subject, from_email, category_id, summary, user_email, gmail_id) "
+        "SELECT md5('email-' || i)::uuid, 'Weekly digest #' || i, 'news@example.com', :category_id, "
+        "'A short AI summary of the newsletter, one or two sentences long.', :account, to_hex(i) "
+        "FROM generate_series(1, :emails) i RETURNING id"
+    ), {"category_id": category_id, "account": ACCOUNT, "emails": emails}).scalars().all()
+    body = compress_body(("lorem ipsum " * (BODY_BYTES // 12)))
+    headers = {f"X-Header-{i}": "v" * 40 for i in range(HEADER_COUNT)}
+    for start in range(0, len(ids), 1000):
+        db.execute(insert(EmailContent).values([
+            {"email_id": email_id, "body": body, "headers": headers} for email_id in ids[start:start + 1000]
+        ]))
+    db.commit()
+    return str(category_id)
+
+
+def list_before(db, category_id, emails):
+    rows = get_emails_by_user_and_category(ACCOUNT, category_id, db=db)
+    return TypeAdapter(List[Email]).dump_json(rows)
+
+
+def list_after(db, category_id, emails):
+    rows, _ = list_session_emails(SESSION_ID, category_id, limit=emails, db=db)
+    return TypeAdapter(List[EmailSummary]).dump_json(rows)
+
+
+def measure(fn, db, category_id, emails, iterations):
+    payload = fn(db, category_id, emails)  # warm up
+    samples = []
+    for _ in range(iterations):
+        db.expunge_all()
+        start = time.perf_counter()
+        payload = fn(db, category_id, emails)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return len(payload), statistics.mean(samples), samples[len(samples) // 2]
+
+
+def main():
+    emails = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    admin = create_engine(DATABASE_URL)
+    with admin.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+    bench = create_engine(DATABASE_URL, connect_args={"options": f"-csearch_path={SCHEMA}"})
+    db = sessionmaker(bind=bench)()
+    try:
+        run_migrations(bench)
+        category_id = load(db, emails)
+        print(f"{emails} emails in one category\n")
+        print(f"{'list':<8}{'payload KB':>12}{'mean ms':>10}{'p50 ms':>10}")
+        for name, fn in (("before", list_before), ("after", list_after)):
+            size, mean, p50 = measure(fn, db, category_id, emails, iterations)
+            print(f"{name:<8}{size / 1024:>12.1f}{mean:>10.1f}{p50:>10.1f}")
+    finally:
+        db.close()
+        bench.dispose()
+        with admin.begin() as conn:
+            conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        admin.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+EXPLAIN check: the hot lookups of session_db against a large synthetic dataset.
+
+Creates a scratch schema in the configured Postgres database, applies the
+migrations there, loads `rows` synthetic emails (1M by default, 100 per account,
+5 categories per session, the first named Uncategorized, every 50th email an
+orphan without a category), ANALYZEs, then runs EXPLAIN ANALYZE on each query the
+app issues constantly, including the email list and count statements of
+session_db for a normal category and for Uncategorized, on the first page and a
+later one, and prints which scan the planner picked. Exits non-zero
+if any of them falls back to a sequential scan (with only a few thousand rows the
+planner rightly prefers one for the small tables). The schema is dropped afterwards.
+
+    cd backend && python benchmarks/explain_hot_queries.py [rows]
+"""
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import create_engine, text  # noqa: E402
+from database.db import DATABASE_URL  # noqa: E402
+from database.migrations import run_migrations  # noqa: E402
+from services.session_db import session_email_count_query, session_email_page_query  # noqa: E402
+
+SCHEMA = "explain_hot_queries"
+EMAILS_PER_ACCOUNT = 100
+CATEGORIES_PER_SESSION = 5
+
+# (name, SQL) - the same filters session_db and the routes use
+HOT_QUERIES = [
+    ("emails by account", "SELECT * FROM emails WHERE user_email = :email"),
+    ("emails by account and category", "SELECT * FROM emails WHERE user_email = :email AND category_id = :category_id"),
+    ("stored gmail ids", "SELECT gmail_id FROM emails WHERE user_email = :email AND gmail_id IN ('1', '2', '3', 'ffff')"),
+    ("account by email", "SELECT * FROM session_accounts WHERE email = :email LIMIT 1"),
+    ("account in session", "SELECT * FROM session_accounts WHERE session_id = :session_id AND email = :email LIMIT 1"),
+    ("accounts of session", "SELECT * FROM session_accounts WHERE session_id = :session_id"),
+    ("categories of session", "SELECT * FROM categories WHERE session_id = :session_id"),
+]
+
+
+def load(conn, rows):
+    accounts = max(1, rows // EMAILS_PER_ACCOUNT)
+    params = {"accounts": accounts, "categories": CATEGORIES_PER_SESSION, "rows": rows}
+    conn.execute(text(
+        "INSERT INTO sessions (id, primary_account) "
+        "SELECT 'sess-' || s, 'user' || s || '@example.com' FROM generate_series(1, :accounts) s"
+    ), params)
+    conn.execute(text(
+        "INSERT INTO session_accounts (id, session_id, email, access_token) "
+        "SELECT md5('acc-' || s)::uuid, 'sess-' || s, 'user' || s || '@example.com', 'token' "
+        "FROM generate_series(1, :accounts) s"
+    ), params)
+    conn.execute(text(
+        "INSERT INTO categories (id, name, description, session_id) "
+        "SELECT md5('cat-' || s || '-' || c)::uuid, CASE WHEN c = 1 THEN 'Uncategorized' ELSE 'Category ' || c END, "
+        "'synthetic', 'sess-' || s "
+        "FROM generate_series(1, :accounts) s, generate_series(1, :categories) c"
+    ), params)
+    conn.execute(text(
+        "INSERT INTO emails (id, subject, from_email, category_id, summary, user_email, gmail_id) "
+        "SELECT md5('email-' || i)::uuid, 'Subject ' || i, 'sender@example.com', "
+        "CASE WHEN i / :accounts % 50 = 0 THEN NULL "
+        "ELSE md5('cat-' || (i % :accounts + 1) || '-' || (i / :accounts % :categories + 1))::uuid END, 'summary', "
+        "'user' || (i % :accounts + 1) || '@example.com', to_hex(i) "
+        "FROM generate_series(1, :rows) i"
+    ), params)
+    conn.execute(text("ANALYZE"))
+    return accounts
+
+
+def list_queries(conn, params):
+    """(name, compiled statement) for the list and count statements of session_db, as the routes run them."""
+    categories = dict(conn.execute(
+        text("SELECT name, id FROM categories WHERE session_id = :session_id"), params
+    ).all())
+    statements = []
+    for label, name in (("category", "Category 2"), ("uncategorized", "Uncategorized")):
+        category_id = categories[name]
+        first = session_email_page_query(params["session_id"], category_id, limit=10)
+        key = conn.execute(first).all()[-1]
+        statements += [
+            (f"list {label}", first),
+            (f"list {label}, later page", session_email_page_query(
+                params["session_id"], category_id, limit=10, after=(key.created_at, key.id))),
+            (f"count {label}", session_email_count_query(params["session_id"], category_id)),
+        ]
+    return [(name, stmt.compile(dialect=conn.dialect)) for name, stmt in statements]
+
+
+def explain(conn, sql, params):
+    if isinstance(sql, str):
+        return conn.execute(text(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}"), params).scalar()
+    # A compiled statement: driver-level placeholders, with UUIDs passed as text
+    values = {k: str(v) if isinstance(v, uuid.UUID) else v for k, v in sql.params.items()}
+    return conn.exec_driver_sql(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}", values).scalar()
+
+
+def scans(plan):
+    """(node type, relation, index) for every scan node of an EXPLAIN (FORMAT JSON) plan."""
+    found = []
+    if "Scan" in plan["Node Type"]:
+        found.append((plan["Node Type"], plan.get("Relation Name"), plan.get("Index Name")))
+    for child in plan.get("Plans", []):
+        found.extend(scans(child))
+    return found
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    admin = create_engine(DATABASE_URL)
+    with admin.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+    bench = create_engine(DATABASE_URL, connect_args={"options": f"-csearch_path={SCHEMA}"})
+    sequential = []
+    try:
+        run_migrations(bench)
+        start = time.perf_counter()
+        with bench.begin() as conn:
+            accounts = load(conn, rows)
+        print(f"Loaded {rows} emails for {accounts} accounts in {time.perf_counter() - start:.1f}s\n")
+
+        account = accounts // 2 + 1
+        params = {
+            "email": f"user{account}@example.com",
+            "session_id": f"sess-{account}",
+            "category_id": None,
+        }
+        with bench.connect() as conn:
+            params["category_id"] = conn.execute(
+                text("SELECT id FROM categories WHERE session_id = :session_id LIMIT 1"), params
+            ).scalar()
+            print(f"{'query':<32}{'ms':>9}  plan")
+            for name, sql in HOT_QUERIES + list_queries(conn, params):
+                plan = explain(conn, sql, params)[0]
+                nodes = scans(plan["Plan"])
+                described = ", ".join(
+                    node + (f" on {relation}" if relation else "") + (f" using {index}" if index else "")
+                    for node, relation, index in nodes
+                )
+                print(f"{name:<32}{plan['Execution Time']:>9.3f}  {described}")
+                if any(node == "Seq Scan" for node, _, _ in nodes):
+                    sequential.append(name)
+    finally:
+        bench.dispose()
+        with admin.begin() as conn:
+            conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        admin.dispose()
+
+    if sequential:
+        print(f"\nSequential scans: {', '.join(sequential)}")
+        sys.exit(1)
+    print("\nEvery hot query uses an index.")
+
+
+if __name__ == "__main__":
+    main()
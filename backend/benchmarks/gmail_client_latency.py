@@ -0,0 +1,60 @@
+"""
+Microbenchmark: Gmail client setup cost on the webhook path, before and after the
+shared client factory.
+
+Before, one webhook built two clients with build('gmail', 'v1', ...): one inside
+process_user_emails and one to read the latest historyId. After, both go through
+services.gmail_client.get_gmail_service, which parses the discovery document once
+and reuses the cached service for the account's token.
+
+Only client construction and request preparation are timed; no network traffic.
+
+    cd backend && python benchmarks/gmail_client_latency.py [iterations]
+"""
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from googleapiclient.discovery import build  # noqa: E402
+from services.gmail_client import get_gmail_service, make_credentials  # noqa: E402
+
+
+def webhook_before(creds):
+    for _ in range(2):
+        service = build("gmail", "v1", credentials=creds)
+        service.users().history().list(userId="me", startHistoryId="1", historyTypes=["messageAdded"])
+    service.users().getProfile(userId="me")
+
+
+def webhook_after(creds):
+    for _ in range(2):
+        service = get_gmail_service(creds)
+        service.users().history().list(userId="me", startHistoryId="1", historyTypes=["messageAdded"])
+    service.users().getProfile(userId="me")
+
+
+def measure(fn, creds, iterations):
+    fn(creds)  # warm up imports and, for the factory, the cache
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn(creds)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.mean(samples), samples[len(samples) // 2], samples[int(len(samples) * 0.95) - 1]
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    creds = make_credentials("benchmark-token", "benchmark-refresh")
+    print(f"{'path':<8}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for name, fn in (("before", webhook_before), ("after", webhook_after)):
+        mean, p50, p95 = measure(fn, creds, iterations)
+        print(f"{name:<8}{mean:>10.3f}{p50:>10.3f}{p95:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""
+Versioned schema migrations.
+
+Every process calls run_migrations() at startup. Pending migrations are applied in
+order inside one transaction and recorded in schema_migrations; a Postgres advisory
+lock makes processes that start together wait for the first one instead of racing
+on the same DDL.
+
+The first migration creates the schema as it stood when migrations were introduced,
+and every later one brings it forward, so a new database ends up with the models'
+schema by the same path as an old one. Databases created by create_all() before
+migrations existed can be ahead of some of them, so migrations stay idempotent
+(IF NOT EXISTS, IF EXISTS).
+"""
+import json
+from email.parser import HeaderParser
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+
+from database.db import engine
+
+# Advisory lock key, next to the namespace services.account_lock uses for accounts
+MIGRATION_LOCK_KEY = 7211
+
+
+# The schema as it stood when migrations were introduced. Frozen: model changes belong in
+# new migrations, never here. IF NOT EXISTS lets databases created by create_all() before
+# that pass through.
+BASELINE_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS sessions (
+        id VARCHAR NOT NULL,
+        primary_account VARCHAR NOT NULL,
+        PRIMARY KEY (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS session_accounts (
+        id UUID NOT NULL,
+        session_id VARCHAR NOT NULL,
+        email VARCHAR NOT NULL,
+        access_token VARCHAR NOT NULL,
+        refresh_token VARCHAR,
+        history_id VARCHAR,
+        PRIMARY KEY (id),
+        FOREIGN KEY (session_id) REFERENCES sessions (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS categories (
+        id UUID NOT NULL,
+        name VARCHAR NOT NULL,
+        description TEXT,
+        session_id VARCHAR NOT NULL,
+        PRIMARY KEY (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS emails (
+        id UUID NOT NULL,
+        subject VARCHAR NOT NULL,
+        from_email VARCHAR NOT NULL,
+        category_id UUID,
+        summary TEXT,
+        raw TEXT,
+        user_email VARCHAR NOT NULL,
+        gmail_id VARCHAR NOT NULL,
+        headers TEXT,
+        PRIMARY KEY (id),
+        FOREIGN KEY (category_id) REFERENCES categories (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS llm_cache (
+        key VARCHAR(64) NOT NULL,
+        value TEXT NOT NULL,
+        session_id VARCHAR,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+        PRIMARY KEY (key)
+    )""",
+    "CREATE INDEX IF NOT EXISTS ix_llm_cache_session_id ON llm_cache (session_id)",
+    """CREATE TABLE IF NOT EXISTS mailbox_resyncs (
+        email VARCHAR NOT NULL,
+        status VARCHAR NOT NULL,
+        history_id VARCHAR,
+        page_token VARCHAR,
+        scanned INTEGER NOT NULL,
+        skipped INTEGER NOT NULL,
+        processed INTEGER NOT NULL,
+        last_error TEXT,
+        started_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+        updated_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+        PRIMARY KEY (email)
+    )""",
+    """CREATE TABLE IF NOT EXISTS processing_jobs (
+        id UUID NOT NULL,
+        account_email VARCHAR NOT NULL,
+        history_id VARCHAR,
+        status VARCHAR NOT NULL,
+        attempts INTEGER NOT NULL,
+        run_after TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+        locked_until TIMESTAMP WITH TIME ZONE,
+        locked_by VARCHAR,
+        last_error TEXT,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+        PRIMARY KEY (id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS ix_processing_jobs_account_email ON processing_jobs (account_email)",
+    "CREATE INDEX IF NOT EXISTS ix_processing_jobs_claim ON processing_jobs (status, run_after)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_processing_jobs_queued_account ON processing_jobs (account_email) WHERE status = 'queued'",
+    """CREATE TABLE IF NOT EXISTS account_locks (
+        email VARCHAR NOT NULL,
+        dirty BOOLEAN NOT NULL,
+        updated_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+        PRIMARY KEY (email)
+    )""",
+]
+
+
+def _create_tables(conn):
+    for statement in BASELINE_SCHEMA:
+        conn.execute(text(statement))
+
+
+def _hot_query_indexes(conn):
+    # Duplicates would block the unique indexes. Of duplicate emails the first copy stays; of
+    # duplicate accounts the one with the newest tokens: a refresh token if any has one, then
+    # the highest history id (moved forward by every run), then the most recently written row
+    deleted = conn.execute(text(
+        """DELETE FROM emails a USING emails b
+           WHERE a.user_email = b.user_email AND a.gmail_id = b.gmail_id AND a.ctid > b.ctid"""
+    )).rowcount
+    print(f"[MIGRATIONS] Deleted {deleted} duplicate emails rows")
+    deleted = conn.execute(text(
+        """DELETE FROM session_accounts WHERE ctid IN (
+               SELECT ctid FROM (
+                   SELECT ctid, row_number() OVER (
+                       PARTITION BY session_id, email
+                       ORDER BY refresh_token IS NOT NULL DESC,
+                                CASE WHEN history_id ~ '^[0-9]+$' THEN history_id::numeric END DESC NULLS LAST,
+                                ctid DESC
+                   ) AS copy
+                   FROM session_accounts
+               ) ranked
+               WHERE copy > 1
+           )"""
+    )).rowcount
+    print(f"[MIGRATIONS] Deleted {deleted} duplicate session_accounts rows")
+    statements = [
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_emails_user_email_gmail_id ON emails (user_email, gmail_id)",
+        "CREATE INDEX IF NOT EXISTS ix_emails_user_email_category_id ON emails (user_email, category_id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_session_accounts_session_id_email ON session_accounts (session_id, email)",
+        "CREATE INDEX IF NOT EXISTS ix_session_accounts_email ON session_accounts (email)",
+        "CREATE INDEX IF NOT EXISTS ix_categories_session_id ON categories (session_id)",
+        # Primary keys are indexed already; these copies only slowed down writes
+        "DROP INDEX IF EXISTS ix_emails_id",
+        "DROP INDEX IF EXISTS ix_categories_id",
+        "DROP INDEX IF EXISTS ix_sessions_id",
+        "DROP INDEX IF EXISTS ix_session_accounts_id",
+    ]
+    for statement in statements:
+        conn.execute(text(statement))
+
+
+def _email_arrival_order(conn):
+    statements = [
+        # A constant default is a metadata-only change; existing rows all get the migration time
+        "ALTER TABLE emails ADD COLUMN IF NOT EXISTS created_at TIMESTAMPTZ NOT NULL DEFAULT now()",
+        "ALTER TABLE emails ALTER COLUMN created_at SET DEFAULT clock_timestamp()",
+        "CREATE INDEX IF NOT EXISTS ix_emails_category_id_created_at ON emails (category_id, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS ix_emails_user_email_created_at ON emails (user_email, created_at, id)",
+    ]
+    for statement in statements:
+        conn.execute(text(statement))
+
+
+CONTENT_MIGRATION_BATCH_SIZE = 1000
+
+
+def _parse_stored_headers(value):
+    """Headers as stored in the old emails.headers text column: a JSON object, or a raw header block from before that."""
+    if not value:
+        return None
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError:
+        return dict(HeaderParser().parsestr(value).items())
+
+
+def _split_email_contents(conn):
+    from database.models import EmailContent, compress_body
+    conn.execute(text(
+        """CREATE TABLE IF NOT EXISTS email_contents (
+            email_id UUID NOT NULL,
+            body BYTEA,
+            headers JSONB,
+            PRIMARY KEY (email_id),
+            FOREIGN KEY (email_id) REFERENCES emails (id) ON DELETE CASCADE
+        )"""
+    ))
+    has_raw = conn.execute(text(
+        "SELECT 1 FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = 'emails' AND column_name = 'raw'"
+    )).first()
+    if has_raw is None:
+        return
+    # Bodies are compressed in Python, so rows are copied over in keyset-ordered batches
+    last_id = None
+    moved = 0
+    while True:
+        query = "SELECT id, raw, headers FROM emails"
+        if last_id is not None:
+            query += " WHERE id > :last_id"
+        rows = conn.execute(text(query + " ORDER BY id LIMIT :limit"), {"last_id": last_id, "limit": CONTENT_MIGRATION_BATCH_SIZE}).all()
+        if not rows:
+            break
+        stmt = insert(EmailContent).values([
+            {"email_id": row.id, "body": compress_body(row.raw), "headers": _parse_stored_headers(row.headers)}
+            for row in rows
+        ])
+        conn.execute(stmt.on_conflict_do_nothing())
+        moved += len(rows)
+        last_id = rows[-1].id
+    print(f"[MIGRATIONS] Moved the content of {moved} emails to email_contents")
+    conn.execute(text("ALTER TABLE emails DROP COLUMN IF EXISTS raw, DROP COLUMN IF EXISTS headers"))
+
+
+HEADER_MIGRATION_BATCH_SIZE = 1000
+
+
+def _promote_headers(conn):
+    from database.models import header_columns
+    statements = [
+        "ALTER TABLE emails ADD COLUMN IF NOT EXISTS list_unsubscribe TEXT, "
+        "ADD COLUMN IF NOT EXISTS list_unsubscribe_post VARCHAR, "
+        "ADD COLUMN IF NOT EXISTS message_id VARCHAR, "
+        "ADD COLUMN IF NOT EXISTS sent_at TIMESTAMPTZ",
+    ]
+    for statement in statements:
+        conn.execute(text(statement))
+    # Header names vary in case and Date needs RFC 2822 parsing, so the values are
+    # extracted with the same header_columns() ingest uses, batch by batch
+    last_id = None
+    filled = 0
+    while True:
+        query = "SELECT email_id, headers FROM email_contents WHERE headers IS NOT NULL"
+        if last_id is not None:
+            query += " AND email_id > :last_id"
+        rows = conn.execute(text(query + " ORDER BY email_id LIMIT :limit"), {"last_id": last_id, "limit": HEADER_MIGRATION_BATCH_SIZE}).all()
+        if not rows:
+            break
+        updates = [{"id": row.email_id, **header_columns(row.headers)} for row in rows]
+        updates = [update for update in updates if any(value is not None for key, value in update.items() if key != "id")]
+        if updates:
+            conn.execute(text(
+                "UPDATE emails SET list_unsubscribe = :list_unsubscribe, list_unsubscribe_post = :list_unsubscribe_post, "
+                "message_id = :message_id, sent_at = :sent_at WHERE id = :id"
+            ), updates)
+        filled += len(updates)
+        last_id = rows[-1].email_id
+    print(f"[MIGRATIONS] Promoted the headers of {filled} emails")
+
+
+def _llm_cache_age_index(conn):
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_llm_cache_created_at ON llm_cache (created_at)"))
+
+
+def _drop_unused_header_indexes(conn):
+    # Version 5 used to index the promoted headers; no query reads them through an index,
+    # so the indexes only slowed down every insert
+    for index in ("ix_emails_message_id", "ix_emails_user_email_unsubscribable", "ix_emails_user_email_sent_at"):
+        conn.execute(text(f"DROP INDEX IF EXISTS {index}"))
+
+
+# (version, name, upgrade) - append only, never renumber
+MIGRATIONS = [
+    (1, "create tables", _create_tables),
+    (2, "indexes and unique constraints for hot queries", _hot_query_indexes),
+    (3, "email arrival time for keyset pagination", _email_arrival_order),
+    (4, "email bodies and headers in email_contents", _split_email_contents),
+    (5, "promoted header columns on emails", _promote_headers),
+    (6, "llm_cache age index for purging expired entries", _llm_cache_age_index),
+    (7, "drop unused indexes on promoted headers", _drop_unused_header_indexes),
+]
+
+
+def run_migrations(bind=None) -> list:
+    """Apply pending migrations in order. Returns the versions applied by this call."""
+    applied = []
+    with (bind or engine).begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version INTEGER PRIMARY KEY, name TEXT NOT NULL, applied_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+        ))
+        done = {row.version for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+        for version, name, upgrade in MIGRATIONS:
+            if version in done:
+                continue
+            print(f"[MIGRATIONS] Applying {version}: {name}")
+            upgrade(conn)
+            conn.execute(text("INSERT INTO schema_migrations (version, name) VALUES (:version, :name)"), {"version": version, "name": name})
+            applied.append(version)
+    return applied
@@ -1,44 +1,163 @@
-from sqlalchemy import Column, ForeignKey, String, Text
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import JSON, Boolean, Column, DateTime, ForeignKey, Index, Integer, LargeBinary, String, Text, func, text
+from sqlalchemy.dialects.postgresql import JSONB, UUID
 from database.db import Base
 import uuid
+import zlib
+from email.utils import parsedate_to_datetime
 from sqlalchemy.orm import relationship
 
 class Category(Base):
     __tablename__ = "categories"
     __table_args__ = {'extend_existing': True}
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, index=True)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     name = Column(String, nullable=False)
     description = Column(Text, nullable=True)
-    session_id = Column(String, nullable=False)  # used instead of user_email
+    session_id = Column(String, nullable=False, index=True)  # used instead of user_email
 
 class Email(Base):
     __tablename__ = "emails"
-    __table_args__ = {'extend_existing': True}
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, index=True)
+    __table_args__ = (
+        # Serves the existence lookups and makes bulk inserts idempotent (ON CONFLICT DO NOTHING)
+        Index('uq_emails_user_email_gmail_id', 'user_email', 'gmail_id', unique=True),
+        # Listing a category; lookups by user_email alone use the leading column of either index
+        Index('ix_emails_user_email_category_id', 'user_email', 'category_id'),
+        # Keyset pagination of the email list, newest first: one category, or one account's orphans
+        Index('ix_emails_category_id_created_at', 'category_id', 'created_at', 'id'),
+        Index('ix_emails_user_email_created_at', 'user_email', 'created_at', 'id'),
+        {'extend_existing': True},
+    )
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     subject = Column(String, nullable=False)
     from_email = Column(String, nullable=False)
     category_id = Column(UUID(as_uuid=True), ForeignKey("categories.id"))
     summary = Column(Text, nullable=True)
-    raw = Column(Text, nullable=True)
     user_email = Column(String, nullable=False)
     gmail_id = Column(String, nullable=False)
-    headers = Column(Text, nullable=True)  # Store headers as JSON string for SQLite compatibility
+    # clock_timestamp() rather than now(), so rows of one bulk insert keep their order
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=text("clock_timestamp()"))
+    # Body and headers live in email_contents and are only loaded when accessed
+    content = relationship("database.models.EmailContent", uselist=False, cascade="all, delete-orphan", passive_deletes=True)
+    # Copied out of the headers at ingest (see header_columns), so reads need not touch email_contents
+    list_unsubscribe = Column(Text, nullable=True)
+    list_unsubscribe_post = Column(String, nullable=True)
+    message_id = Column(String, nullable=True)
+    sent_at = Column(DateTime(timezone=True), nullable=True)  # the Date header
+
+EMAIL_BODY_COMPRESSION_LEVEL = 6
+
+def compress_body(raw):
+    return zlib.compress(raw.encode("utf-8"), EMAIL_BODY_COMPRESSION_LEVEL) if raw is not None else None
+
+def decompress_body(body):
+    return zlib.decompress(body).decode("utf-8") if body is not None else None
+
+# Headers promoted to columns of emails, by lower-cased header name
+PROMOTED_HEADERS = {
+    "list-unsubscribe": "list_unsubscribe",
+    "list-unsubscribe-post": "list_unsubscribe_post",
+    "message-id": "message_id",
+    "date": "sent_at",
+}
+
+def _parse_date(value):
+    try:
+        return parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+
+def header_columns(headers):
+    """Values of the promoted headers, keyed by emails column. Header names match case-insensitively."""
+    columns = dict.fromkeys(PROMOTED_HEADERS.values())
+    for name, value in (headers or {}).items():
+        column = PROMOTED_HEADERS.get(name.lower())
+        if column is not None and value:
+            columns[column] = value
+    if columns["sent_at"] is not None:
+        columns["sent_at"] = _parse_date(columns["sent_at"])
+    return columns
+
+class EmailContent(Base):
+    """An email's body (zlib-compressed UTF-8) and headers, kept out of the emails heap that listings scan."""
+    __tablename__ = "email_contents"
+    __table_args__ = {'extend_existing': True}
+    email_id = Column(UUID(as_uuid=True), ForeignKey("emails.id", ondelete="CASCADE"), primary_key=True)
+    body = Column(LargeBinary, nullable=True)
+    # JSONB on Postgres, plain JSON elsewhere (SQLite)
+    headers = Column(JSON().with_variant(JSONB(), "postgresql"), nullable=True)
+
+    @property
+    def raw(self):
+        return decompress_body(self.body)
 
 class Session(Base):
     __tablename__ = "sessions"
     __table_args__ = {'extend_existing': True}
-    id = Column(String, primary_key=True, index=True)  # session_id (UUID)
+    id = Column(String, primary_key=True)  # session_id (UUID)
     primary_account = Column(String, nullable=False)
     accounts = relationship("database.models.SessionAccount", back_populates="session", cascade="all, delete-orphan")
 
 class SessionAccount(Base):
     __tablename__ = "session_accounts"
-    __table_args__ = {'extend_existing': True}
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, index=True)
+    __table_args__ = (
+        # An address is linked to a session at most once; also serves lookups by session_id
+        Index('uq_session_accounts_session_id_email', 'session_id', 'email', unique=True),
+        {'extend_existing': True},
+    )
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     session_id = Column(String, ForeignKey("sessions.id"), nullable=False)
-    email = Column(String, nullable=False)
+    email = Column(String, nullable=False, index=True)
     access_token = Column(String, nullable=False)
     refresh_token = Column(String, nullable=True)
     history_id = Column(String, nullable=True)
-    session = relationship("database.models.Session", back_populates="accounts")
\ No newline at end of file
+    session = relationship("database.models.Session", back_populates="accounts")
+
+class LLMCacheEntry(Base):
+    __tablename__ = "llm_cache"
+    __table_args__ = {'extend_existing': True}
+    key = Column(String(64), primary_key=True)  # sha256 of prompt kind, model, prompt version, categories and body
+    value = Column(Text, nullable=False)
+    session_id = Column(String, nullable=True, index=True)  # session that wrote the entry, for invalidation
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), index=True)  # expired rows are purged by age
+
+class MailboxResync(Base):
+    """Progress of a full inbox resync, run when the stored history id has expired."""
+    __tablename__ = "mailbox_resyncs"
+    __table_args__ = {'extend_existing': True}
+    email = Column(String, primary_key=True)
+    status = Column(String, nullable=False, default="running")  # running | done
+    history_id = Column(String, nullable=True)  # captured when the resync started, stored on the account once it finishes
+    page_token = Column(String, nullable=True)  # messages().list page to resume from
+    scanned = Column(Integer, nullable=False, default=0)
+    skipped = Column(Integer, nullable=False, default=0)
+    processed = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    started_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
+
+class ProcessingJob(Base):
+    """A queued Gmail notification, claimed by workers with SELECT ... FOR UPDATE SKIP LOCKED."""
+    __tablename__ = "processing_jobs"
+    __table_args__ = (
+        Index('ix_processing_jobs_claim', 'status', 'run_after'),
+        # At most one waiting job per account; further notifications are folded into it
+        Index('uq_processing_jobs_queued_account', 'account_email', unique=True, postgresql_where=text("status = 'queued'")),
+        {'extend_existing': True},
+    )
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    account_email = Column(String, nullable=False, index=True)
+    history_id = Column(String, nullable=True)  # highest historyId among the notifications folded into the job
+    status = Column(String, nullable=False, default="queued")  # queued | running | dead
+    attempts = Column(Integer, nullable=False, default=0)
+    run_after = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    locked_until = Column(DateTime(timezone=True), nullable=True)  # visibility timeout of a running job
+    locked_by = Column(String, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+class AccountLock(Base):
+    """Cross-process 'run again' flag for accounts whose processing was requested while already running."""
+    __tablename__ = "account_locks"
+    __table_args__ = {'extend_existing': True}
+    email = Column(String, primary_key=True)
+    dirty = Column(Boolean, nullable=False, default=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
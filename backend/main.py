@@ -1,12 +1,17 @@
 from dotenv import load_dotenv
 import uvicorn
 import logging
-from fastapi import FastAPI, Query, Request, Header, Body
+from fastapi import FastAPI, Query, Request, Header, Body, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from services.session_db import get_session_accounts, get_primary_account, get_account, get_history_id_by_email, set_history_id_by_email, find_session_id_by_email
+from services.session_db import get_session_accounts, get_primary_account, get_account, get_history_id_by_email, set_history_id_by_email, find_session_id_by_email, get_account_context, account_context_stats, is_unknown_sender, unknown_sender_stats
 from services.gmail_processor import process_user_emails
-from database.db import engine, Base
+from database.db import engine, get_db
+from database.migrations import run_migrations
+from sqlalchemy.orm import Session
 from fastapi.routing import APIRoute
+from starlette.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
+from services import job_queue
 from routes.auth import router as auth_router
 from routes.categories import router as categories_router
 from routes.emails import router as emails_router
@@ -15,15 +20,22 @@ import os
 # Load environment variables from .env
 load_dotenv()
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    job_queue.start_workers(handle_gmail_notification)
+    yield
+    job_queue.stop_workers()
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
-Base.metadata.create_all(bind=engine)
+run_migrations(engine)
 
 app.include_router(auth_router, prefix="/auth")
 app.include_router(categories_router, prefix="/categories")
@@ -33,33 +45,31 @@ for route in app.routes:
     if isinstance(route, APIRoute):
         print("ROUTE LOADED:", route.path)
 
-no_token_logged_emails = set()
-
 @app.get("/dev/process-emails")
-def dev_process_emails(session_id: str = Query(...), email: str = Query(None), max_emails: int = Query(3), force: bool = Query(False)):
+def dev_process_emails(session_id: str = Query(...), email: str = Query(None), max_emails: int = Query(3), force: bool = Query(False), db: Session = Depends(get_db)):
     try:
         print(f"Processing emails request - session_id: {session_id}, email: {email}, max_emails: {max_emails}")
 
         if email:
-            acc = get_account(session_id, email)
+            acc = get_account(session_id, email, db=db)
         else:
-            primary_email = get_primary_account(session_id)
-            acc = get_account(session_id, primary_email)
+            primary_email = get_primary_account(session_id, db=db)
+            acc = get_account(session_id, primary_email, db=db)
         if not acc:
             print(f"User token not found for session {session_id}")
             return {"error": "User token not found"}
         print(f"Found user token for: {acc.email}")
         from services.session_db import get_categories_by_session
-        categories = get_categories_by_session(session_id)
+        categories = get_categories_by_session(session_id, db=db)
         if not categories:
             # Get or create "Uncategorized" category for this user
             print(f"No categories found for session: {session_id}, getting or creating 'Uncategorized' category")
             from services.session_db import get_or_create_uncategorized_category
 
             # Get the primary account email for this session
-            primary_email = get_primary_account(session_id)
+            primary_email = get_primary_account(session_id, db=db)
             if primary_email:
-                uncategorized_category = get_or_create_uncategorized_category(primary_email, session_id)
+                uncategorized_category = get_or_create_uncategorized_category(primary_email, session_id, db=db)
                 categories = [uncategorized_category]
                 print(f"Got or created 'Uncategorized' category for user {primary_email}")
             else:
@@ -75,9 +85,10 @@ def dev_process_emails(session_id: str = Query(...), email: str = Query(None), m
             refresh_token=acc.refresh_token,
             history_id=acc.history_id
         )
-        # If force=True, use empty history_id to process all recent emails
-        history_id_to_use = "" if force else ""
-        result = process_user_emails(user_token, categories, max_emails=max_emails, last_history_id=history_id_to_use)
+        # Processing talks to Gmail for a while, so hand the connection back to the pool first
+        db.close()
+        # force=True resyncs the inbox (or continues a resync in progress) instead of reading history
+        result = process_user_emails(user_token, categories, max_emails=max_emails, last_history_id=acc.history_id or "", force_resync=force)
         print(f"Email processing result: {type(result)}, length: {len(result) if isinstance(result, list) else 'N/A'}")
         return result
 
@@ -87,59 +98,71 @@ def dev_process_emails(session_id: str = Query(...), email: str = Query(None), m
         traceback.print_exc()
         return {"error": f"Failed to process emails: {str(e)}"}
 
+@app.get("/dev/resync-status")
+def dev_resync_status(email: str = Query(...), db: Session = Depends(get_db)):
+    """Progress of the full inbox resync for an account, if one was ever started."""
+    from services.session_db import get_mailbox_resync
+    resync = get_mailbox_resync(email, db=db)
+    if not resync:
+        return {"email": email, "status": "none"}
+    return {
+        "email": resync.email,
+        "status": resync.status,
+        "scanned": resync.scanned,
+        "skipped": resync.skipped,
+        "processed": resync.processed,
+        "resume_page_token": resync.page_token,
+        "history_id": resync.history_id,
+        "last_error": resync.last_error,
+        "started_at": resync.started_at,
+        "updated_at": resync.updated_at,
+    }
+
 @app.get("/dev/session/{session_id}/accounts")
-def get_session_accounts_endpoint(session_id: str):
+def get_session_accounts_endpoint(session_id: str, db: Session = Depends(get_db)):
     """Get all accounts in a session"""
-    accounts = get_session_accounts(session_id)
+    accounts = get_session_accounts(session_id, db=db)
     return {
         "session_id": session_id,
         "accounts": [{"email": acc.email} for acc in accounts]
     }
 
 @app.get("/dev/process-all-accounts")
-def process_all_accounts(session_id: str = Query(...), max_emails: int = Query(3)):
-    """Process emails for all accounts in a session"""
-    accounts = get_session_accounts(session_id)
+def process_all_accounts(session_id: str = Query(...), max_emails: int = Query(3), db: Session = Depends(get_db)):
+    """Process emails for all accounts in a session, several accounts at a time"""
+    accounts = get_session_accounts(session_id, db=db)
     if not accounts:
         return {"error": "No accounts found for session"}
 
-    results = {}
-    for acc in accounts:
-        try:
-            # Get categories for this session
-            from services.session_db import get_categories_by_session
-            categories = get_categories_by_session(session_id)
-            if not categories:
-                # Get or create "Uncategorized" category
-                from services.session_db import get_or_create_uncategorized_category
-                primary_email = get_primary_account(session_id)
-                if primary_email:
-                    uncategorized_category = get_or_create_uncategorized_category(primary_email, session_id)
-                    categories = [uncategorized_category]
-
-            # Build UserToken
-            from models.user import UserToken
-            user_token = UserToken(
-                email=acc.email,
-                access_token=acc.access_token,
-                refresh_token=acc.refresh_token,
-                history_id=acc.history_id
-            )
-
-            # Process emails for this account
-            result = process_user_emails(user_token, categories, max_emails=max_emails, last_history_id="")
-            results[acc.email] = {
-                "processed": len(result),
-                "emails": result
-            }
-        except Exception as e:
-            results[acc.email] = {"error": str(e)}
-
-    return {"session_id": session_id, "results": results}
-
-# On session creation/login, log the email and session ID
+    # Categories are shared by every account of the session, so resolve them once
+    from services.session_db import get_categories_by_session
+    categories = get_categories_by_session(session_id, db=db)
+    if not categories:
+        # Get or create "Uncategorized" category
+        from services.session_db import get_or_create_uncategorized_category
+        primary_email = get_primary_account(session_id, db=db)
+        if primary_email:
+            uncategorized_category = get_or_create_uncategorized_category(primary_email, session_id, db=db)
+            categories = [uncategorized_category]
+
+    from models.user import UserToken
+    from services.gmail_processor import process_accounts
+    user_tokens = [
+        UserToken(
+            email=acc.email,
+            access_token=acc.access_token,
+            refresh_token=acc.refresh_token,
+            history_id=acc.history_id
+        )
+        for acc in accounts
+    ]
+    # Processing talks to Gmail for a while, so hand the connection back to the pool first
+    db.close()
+    results, summary = process_accounts(user_tokens, categories, max_emails=max_emails)
+    return {"session_id": session_id, "results": results, "summary": summary}
+
 @app.post("/dev/test/create-session")
-def create_test_session(email: str = Query(...), access_token: str = Query("test-token"), refresh_token: str = Query("test-refresh")):
+def create_test_session(email: str = Query(...), access_token: str = Query("test-token"), refresh_token: str = Query("test-refresh"), db: Session = Depends(get_db)):
     """Create a test session for manual testing"""
     import uuid
     session_id = str(uuid.uuid4())
@@ -148,7 +171,7 @@ def create_test_session(email: str = Query(...), access_token: str = Query("test
         "email": email,
         "access_token": access_token,
         "refresh_token": refresh_token
-    }])
+    }], db=db)
     print(f"[SESSION CREATED] Email: {email}, Session ID: {session_id}")
     return {
         "session_id": session_id,
@@ -157,10 +180,10 @@ def create_test_session(email: str = Query(...), access_token: str = Query("test
     }
 
 @app.post("/dev/test/add-account")
-def add_test_account(session_id: str = Query(...), email: str = Query(...), access_token: str = Query("test-token"), refresh_token: str = Query("test-refresh")):
+def add_test_account(session_id: str = Query(...), email: str = Query(...), access_token: str = Query("test-token"), refresh_token: str = Query("test-refresh"), db: Session = Depends(get_db)):
     """Add a test account to an existing session"""
     from services.session_db import add_account_to_session
-    add_account_to_session(session_id, email, access_token, refresh_token)
+    add_account_to_session(session_id, email, access_token, refresh_token, db=db)
     return {
         "session_id": session_id,
         "email": email,
@@ -173,38 +196,18 @@ async def test_webhook(request: Request):
     print("Webhook received data:", data)
     return {"status": "ok", "received": data}
 
-@app.post("/gmail/webhook")
-async def gmail_webhook(request: Request, authorization: str = Header(None)):
-    body = await request.json()
-    print("== RAW PubSub BODY ==\n", body)
-
-    # If payload unwrapping is enabled, emailAddress/historyId are at the top level
-    email_address = body.get("emailAddress")
-    history_id = body.get("historyId")
-
-    if not email_address or not history_id:
-        logging.warning("Missing emailAddress or historyId in body")
-        return {"status": "missing attributes"}
-
-    logging.info(f"[GMAIL WEBHOOK] email: {email_address}, historyId: {history_id}")
-
-    # Find the session and account for this email
-    session_id = find_session_id_by_email(email_address)
-    if not session_id:
-        if email_address not in no_token_logged_emails:
-            logging.warning(f"No session found for {email_address}")
-            no_token_logged_emails.add(email_address)
-        return {"status": "user not found"}
-
-    # Get the account details
-    acc = get_account(session_id, email_address)
-    if not acc:
-        logging.warning(f"No account found for {email_address} in session {session_id}")
-        return {"status": "account not found"}
-
-    # Get categories for this session
-    from services.session_db import get_categories_by_session
-    categories = get_categories_by_session(session_id)
+def handle_gmail_notification(job):
+    """Queue handler: process new mail for the account a Gmail notification was about. Raising retries the job."""
+    email_address = job.account_email
+    history_id = job.history_id
+
+    # Account, session and categories in one cached lookup
+    context = get_account_context(email_address)
+    if not context:
+        logging.warning(f"No account found for {email_address}")
+        return
+    session_id = context.session_id
+    categories = context.categories
     print(f"[WEBHOOK] Found {len(categories)} categories for session {session_id}: {[c.name for c in categories]}")
 
     if not categories:
@@ -213,7 +216,7 @@ async def gmail_webhook(request: Request, authorization: str = Header(None)):
         from services.session_db import get_or_create_uncategorized_category
 
         # Get the primary account email for this session
-        primary_email = get_primary_account(session_id)
+        primary_email = context.primary_account
         if primary_email:
             uncategorized_category = get_or_create_uncategorized_category(primary_email, session_id)
             categories = [uncategorized_category]
@@ -221,107 +224,114 @@ async def gmail_webhook(request: Request, authorization: str = Header(None)):
             print(f"[WEBHOOK] Created 'Uncategorized' category: {uncategorized_category.name} (ID: {uncategorized_category.id})")
         else:
             logging.error(f"No primary account found for session {session_id}")
-            return {"status": "no primary account"}
+            return
 
-    # Get last processed historyId
+    # Last processed historyId, read from the database: other workers move it forward,
+    # so the copy in the cached account context can be behind
     last_history_id = get_history_id_by_email(email_address)
     print(f"[GMAIL WEBHOOK] Last processed historyId for {email_address}: {last_history_id}")
     logging.info(f"[GMAIL WEBHOOK] Last processed historyId for {email_address}: {last_history_id}")
 
-    # Debug: Check if this history_id is newer than what we have
-    if last_history_id:
+    # Skip notifications an earlier run already covered
+    if last_history_id and history_id:
         try:
-            last_history_int = int(last_history_id)
-            if history_id <= last_history_int:
+            if int(history_id) <= int(last_history_id):
                 print(f"[GMAIL WEBHOOK] Skipping - history_id {history_id} is not newer than last processed {last_history_id}")
-                return {"status": "already processed"}
+                return
         except (ValueError, TypeError):
-            print(f"[GMAIL WEBHOOK] Warning: Could not parse last_history_id '{last_history_id}' as integer")
+            print(f"[GMAIL WEBHOOK] Warning: Could not compare history_id '{history_id}' with '{last_history_id}'")
 
-    # Call process_user_emails with last_history_id
-    try:
-        from models.user import UserToken
-        user_token = UserToken(
-            email=acc.email,
-            access_token=acc.access_token,
-            refresh_token=acc.refresh_token,
-            history_id=acc.history_id
-        )
-        processed = process_user_emails(user_token, categories, last_history_id=last_history_id or "")
-        print(f"[GMAIL WEBHOOK] Processed {len(processed)} emails for {email_address}")
-        logging.info(f"[GMAIL WEBHOOK] Processed {len(processed)} emails for {email_address}")
-        # Update stored historyId to the latest from Gmail
-        from services.gmail_processor import get_latest_history_id
-        creds = acc.access_token
-        refresh = acc.refresh_token
-        from google.oauth2.credentials import Credentials
-        from googleapiclient.discovery import build
-        creds_obj = Credentials(token=creds, refresh_token=refresh, token_uri="https://oauth2.googleapis.com/token", client_id=None, client_secret=None)
-        service = build('gmail', 'v1', credentials=creds_obj)
-        latest_history_id = get_latest_history_id(service)
-        set_history_id_by_email(email_address, latest_history_id)
-        print(f"[GMAIL WEBHOOK] Updated historyId for {email_address} to {latest_history_id}")
-        logging.info(f"[GMAIL WEBHOOK] Updated historyId for {email_address} to {latest_history_id}")
-    except Exception as e:
-        logging.error(f"Error processing emails for {email_address}: {e}")
-        return {"status": "processing error"}
+    # None: the run reads the stored historyId again once it holds the account
+    processed = process_user_emails(context.user_token(), categories, last_history_id=None)
+    # process_user_emails checkpoints the historyId itself as it works through the history pages
+    logging.info(f"[GMAIL WEBHOOK] Processed {len(processed)} emails for {email_address}")
+
+@app.post("/gmail/webhook")
+async def gmail_webhook(request: Request, authorization: str = Header(None)):
+    """Validate the Pub/Sub push and queue it; the job workers do the processing."""
+    body = await request.json()
+    print("== RAW PubSub BODY ==\n", body)
+
+    # If payload unwrapping is enabled, emailAddress/historyId are at the top level
+    email_address = body.get("emailAddress")
+    history_id = body.get("historyId")
+
+    if not email_address or not history_id:
+        logging.warning("Missing emailAddress or historyId in body")
+        return {"status": "missing attributes"}
 
-    return {"status": "ok", "processed": len(processed), "history_id": latest_history_id}
+    logging.info(f"[GMAIL WEBHOOK] email: {email_address}, historyId: {history_id}")
+
+    # Addresses that recently turned out to have no session are answered from memory
+    if is_unknown_sender(email_address):
+        return {"status": "user not found"}
+
+    # Database calls block, so they run in the threadpool rather than on the event loop
+    context = await run_in_threadpool(get_account_context, email_address)
+    if not context:
+        logging.warning(f"No session found for {email_address}")
+        return {"status": "user not found"}
+
+    job_id = await run_in_threadpool(job_queue.enqueue, email_address, history_id)
+    return {"status": "queued", "job_id": job_id}
+
+@app.get("/dev/stats")
+def dev_stats():
+    """Runtime counters for caches and processing."""
+    from services.llm_cache import get_llm_cache
+    from services.gmail_client import gmail_client_stats
+    from services.gmail_processor import fetch_stats
+    from services.account_lock import single_flight_stats
+    return {
+        "llm_cache": get_llm_cache().stats(),
+        "gmail_clients": gmail_client_stats(),
+        "gmail_fetch": fetch_stats(),
+        "job_queue": job_queue.queue_stats(),
+        "account_locks": single_flight_stats(),
+        "account_contexts": account_context_stats(),
+        "unknown_senders": unknown_sender_stats(),
+    }
 
 @app.post("/dev/migrate-orphaned-emails")
-def migrate_orphaned_emails_endpoint(session_id: str = Query(...)):
+def migrate_orphaned_emails_endpoint(session_id: str = Query(...), db: Session = Depends(get_db)):
     """Manually migrate orphaned emails to the session's Uncategorized category"""
     from services.session_db import migrate_orphaned_emails_to_uncategorized
-    migrate_orphaned_emails_to_uncategorized(session_id)
-    return {"message": "Migration completed"}
+    migrated = migrate_orphaned_emails_to_uncategorized(session_id, db=db)
+    return {"message": "Migration completed", "migrated": migrated}
 
 @app.get("/dev/debug/sessions")
-def debug_sessions_endpoint():
+def debug_sessions_endpoint(db: Session = Depends(get_db)):
     """Debug endpoint to see all sessions and their categories"""
-    from services.session_db import get_session
     from database.models import Session as DBSession, Category as DBCategory
-    from database.db import SessionLocal
 
-    db = SessionLocal()
-    try:
-        sessions = db.query(DBSession).all()
-        result = []
-
-        for session in sessions:
-            categories = db.query(DBCategory).filter(DBCategory.session_id == session.id).all()
-            result.append({
-                "session_id": session.id,
-                "primary_account": session.primary_account,
-                "categories": [{"id": str(cat.id), "name": cat.name, "description": cat.description} for cat in categories]
-            })
-
-        return {"sessions": result}
-    finally:
-        db.close()
+    sessions = db.query(DBSession).all()
+    result = []
+
+    for session in sessions:
+        categories = db.query(DBCategory).filter(DBCategory.session_id == session.id).all()
+        result.append({
+            "session_id": session.id,
+            "primary_account": session.primary_account,
+            "categories": [{"id": str(cat.id), "name": cat.name, "description": cat.description} for cat in categories]
+        })
+
+    return {"sessions": result}
 
 @app.post("/dev/gmail-watch")
-def dev_gmail_watch(user_email: str = Body(...)):
+def dev_gmail_watch(user_email: str = Body(...), db: Session = Depends(get_db)):
     """Register Gmail watch for the given user (for debugging Google Pub/Sub webhook setup)."""
     # Find the session for this email
-    session_id = find_session_id_by_email(user_email)
+    session_id = find_session_id_by_email(user_email, db=db)
     if not session_id:
         return {"error": f"No session found for {user_email}"}
 
     # Get the account details
-    acc = get_account(session_id, user_email)
+    acc = get_account(session_id, user_email, db=db)
     if not acc:
         return {"error": f"No account found for {user_email}"}
 
-    from google.oauth2.credentials import Credentials
-    from googleapiclient.discovery import build
-    creds = Credentials(
-        token=acc.access_token,
-        refresh_token=acc.refresh_token,
-        token_uri="https://oauth2.googleapis.com/token",
-        client_id=None,
-        client_secret=None
-    )
-    service = build('gmail', 'v1', credentials=creds)
+    from services.gmail_client import get_gmail_service, make_credentials
+    service = get_gmail_service(make_credentials(acc.access_token, acc.refresh_token))
     topic_name = os.getenv("GMAIL_PUBSUB_TOPIC")
     webhook_url = os.getenv("GMAIL_WEBHOOK_URL")
     if not topic_name or not webhook_url:
@@ -335,7 +345,7 @@ def dev_gmail_watch(user_email: str = Body(...)):
         resp = service.users().watch(userId='me', body=request_body).execute()
         history_id = resp.get("historyId")
         if history_id:
-            set_history_id_by_email(user_email, history_id)
+            set_history_id_by_email(user_email, history_id, db=db)
         logging.info(f"Gmail watch response: {resp}")
         return {"status": "watch registered", "response": resp}
     except Exception as e:
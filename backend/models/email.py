@@ -1,14 +1,27 @@
 from pydantic import BaseModel
 from typing import Optional, Dict
+from datetime import datetime
 import uuid
 
 class Email(BaseModel):
     id: Optional[uuid.UUID] = None
     subject: str
     from_email: str
-    category_id: uuid.UUID
+    category_id: Optional[uuid.UUID]  # None for mail whose category was deleted before it was moved to Uncategorized
     summary: str
     raw: str
     user_email: str
     gmail_id: str  # Gmail message ID
-    headers: Optional[Dict[str, str]] = None
\ No newline at end of file
+    headers: Optional[Dict[str, str]] = None
+    created_at: Optional[datetime] = None  # when the email was stored; list order and pagination key
+
+class EmailSummary(BaseModel):
+    """What the email list shows. The body and headers come from the detail route."""
+    id: uuid.UUID
+    subject: str
+    from_email: str
+    category_id: Optional[uuid.UUID]
+    summary: Optional[str] = None
+    user_email: str
+    gmail_id: str
+    created_at: Optional[datetime] = None
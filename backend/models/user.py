@@ -1,6 +1,7 @@
 # user.py
 from typing import Optional, List
 from pydantic import BaseModel
+from models.category import Category
 
 class UserToken(BaseModel):
     email: str
@@ -11,4 +12,22 @@ class UserToken(BaseModel):
 class UserSession(BaseModel):
     session_id: str
     accounts: List[UserToken]
-    primary_account: str  # email of primary account
\ No newline at end of file
+    primary_account: str  # email of primary account
+
+class AccountContext(BaseModel):
+    """Everything webhook processing needs about a mailbox, loaded in one query."""
+    email: str
+    session_id: str
+    access_token: str
+    refresh_token: Optional[str] = None
+    history_id: Optional[str] = None
+    primary_account: Optional[str] = None
+    categories: List[Category] = []
+
+    def user_token(self) -> UserToken:
+        return UserToken(
+            email=self.email,
+            access_token=self.access_token,
+            refresh_token=self.refresh_token,
+            history_id=self.history_id
+        )
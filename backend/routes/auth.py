@@ -1,7 +1,9 @@
-from fastapi import APIRouter, Request, Response, status, Query
+from fastapi import APIRouter, Request, Response, status, Query, Depends
+from sqlalchemy.orm import Session
 from fastapi.responses import RedirectResponse
 from utils.google_oauth import get_auth_url, fetch_token, get_user_email
 from services.session_db import add_account_to_session, get_session, set_primary_account
+from database.db import get_db
 import os
 
 router = APIRouter()
@@ -18,7 +20,7 @@ def google_add_account(session_id: str = Query(...)):
     return RedirectResponse(url)
 
 @router.get("/callback")
-def google_callback(request: Request, code: str = "", state: str = ""):
+def google_callback(request: Request, code: str = "", state: str = "", db: Session = Depends(get_db)):
     if not code:
         return Response(content="Missing code", status_code=status.HTTP_400_BAD_REQUEST)
     
@@ -37,7 +39,7 @@ def google_callback(request: Request, code: str = "", state: str = ""):
         # Set up Gmail watch for the new account
         from services.session_db import setup_gmail_watch_for_user
         history_id = setup_gmail_watch_for_user(email, access_token, refresh_token)
-        add_account_to_session(session_id, email, access_token, refresh_token, history_id)
+        add_account_to_session(session_id, email, access_token, refresh_token, history_id, db=db)
         frontend_url = os.getenv("FRONTEND_URL", "http://localhost:3000")
         redirect_url = f"{frontend_url}/dashboard?session_id={session_id}&account_added={email}"
         return RedirectResponse(url=redirect_url)
@@ -47,12 +49,12 @@ def google_callback(request: Request, code: str = "", state: str = ""):
     history_id = setup_gmail_watch_for_user(email, access_token, refresh_token)
     
     from services.session_db import get_or_create_session_by_email
-    session_id = get_or_create_session_by_email(email, access_token, refresh_token, history_id)
+    session_id = get_or_create_session_by_email(email, access_token, refresh_token, history_id, db=db)
     print(f"[AUTH] Using session {session_id} for user {email}")
     
     # Get or create "Uncategorized" category for this session
     from services.session_db import get_or_create_uncategorized_category
-    uncategorized_category = get_or_create_uncategorized_category(email, session_id)
+    uncategorized_category = get_or_create_uncategorized_category(email, session_id, db=db)
     
     # Redirect to frontend with session info
     frontend_url = os.getenv("FRONTEND_URL", "http://localhost:3000")
@@ -60,9 +62,9 @@ def google_callback(request: Request, code: str = "", state: str = ""):
     return RedirectResponse(url=redirect_url)
 
 @router.get("/session/{session_id}")
-def get_session_info(session_id: str):
+def get_session_info(session_id: str, db: Session = Depends(get_db)):
     """Get session information including all accounts"""
-    session = get_session(session_id)
+    session = get_session(session_id, db=db)
     if not session:
         return Response(content="Session not found", status_code=status.HTTP_404_NOT_FOUND)
     
@@ -73,31 +75,31 @@ def get_session_info(session_id: str):
     }
 
 @router.post("/session/{session_id}/primary")
-def set_primary_account_endpoint(session_id: str, email: str = Query(...)):
+def set_primary_account_endpoint(session_id: str, email: str = Query(...), db: Session = Depends(get_db)):
     """Set the primary account for a session"""
-    success = set_primary_account(session_id, email)
+    success = set_primary_account(session_id, email, db=db)
     if not success:
         return Response(content="Account not found in session", status_code=status.HTTP_404_NOT_FOUND)
     
     return {"message": f"Primary account set to {email}"}
 
 @router.delete("/session/{session_id}/account")
-def remove_account_endpoint(session_id: str, email: str = Query(...)):
+def remove_account_endpoint(session_id: str, email: str = Query(...), db: Session = Depends(get_db)):
     """Remove an account from a session"""
     from services.session_db import remove_account_from_session
     
-    success, message = remove_account_from_session(session_id, email)
+    success, message = remove_account_from_session(session_id, email, db=db)
     if not success:
         return Response(content=message, status_code=status.HTTP_400_BAD_REQUEST)
     
     return {"message": message, "removed_email": email}
 
 @router.post("/logout")
-def logout_endpoint(session_id: str = Query(...)):
+def logout_endpoint(session_id: str = Query(...), db: Session = Depends(get_db)):
     """Logout and clear session data"""
     from services.session_db import delete_session
     
-    success = delete_session(session_id)
+    success = delete_session(session_id, db=db)
     if success:
         return {"message": "Logged out successfully and session cleared"}
     else:
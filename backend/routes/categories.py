@@ -1,7 +1,10 @@
-from fastapi import APIRouter, Body, Query, status, Response
+from fastapi import APIRouter, Body, Query, status, Response, Depends
+from sqlalchemy.orm import Session
 from typing import List
 from models.category import Category
-from services.session_db import add_category, get_categories_by_session
+from services.session_db import add_category, get_categories_by_session, invalidate_account_context
+from services.llm_cache import invalidate_session
+from database.db import get_db
 import uuid
 
 router = APIRouter()
@@ -10,7 +13,8 @@ router = APIRouter()
 def create_category(
     name: str = Body(...),
     description: str = Body(None),
-    session_id: str = Body(...)
+    session_id: str = Body(...),
+    db: Session = Depends(get_db)
 ):
     category = Category(
         id=uuid.uuid4(),  # Generate UUID for new category
@@ -18,7 +22,7 @@ def create_category(
         description=description,
         session_id=session_id
     )
-    db_cat = add_category(category)
+    db_cat = add_category(category, db=db)
     # Return as Pydantic model
     return Category(
         id=db_cat.id,
@@ -28,8 +32,8 @@ def create_category(
     )
 
 @router.get("/", response_model=List[Category])
-def list_categories(session_id: str = Query(...)):
-    db_cats = get_categories_by_session(session_id)
+def list_categories(session_id: str = Query(...), db: Session = Depends(get_db)):
+    db_cats = get_categories_by_session(session_id, db=db)
     return [Category(
         id=cat.id,
         name=cat.name,
@@ -38,13 +42,11 @@ def list_categories(session_id: str = Query(...)):
     ) for cat in db_cats]
 
 @router.put("/{category_id}")
-def update_category(category_id: str, name: str = Body(None), description: str = Body(None)):
+def update_category(category_id: str, name: str = Body(None), description: str = Body(None), db: Session = Depends(get_db)):
     """Update a category's name and/or description"""
-    from database.db import SessionLocal
     from database.models import Category as DBCategory
     from database.models import Email as DBEmail
     
-    db = SessionLocal()
     try:
         category = db.query(DBCategory).filter(DBCategory.id == category_id).first()
         if not category:
@@ -63,6 +65,8 @@ def update_category(category_id: str, name: str = Body(None), description: str =
             category.description = description
         
         db.commit()
+        invalidate_session(category.session_id)
+        invalidate_account_context(session_id=category.session_id)
         
         return {
             "message": "Category updated successfully",
@@ -76,5 +80,3 @@ def update_category(category_id: str, name: str = Body(None), description: str =
     except Exception as e:
         db.rollback()
         return {"error": f"Failed to update category: {str(e)}"}
-    finally:
-        db.close()
@@ -1,110 +1,87 @@
-from fastapi import APIRouter, Query, Body
+from fastapi import APIRouter, Query, Body, Depends, Response, status
+from sqlalchemy.orm import Session
 from typing import List
-from models.email import Email
-from services.session_db import get_emails_by_user_and_category, email_exists, save_email
-from services.session_db import get_session_accounts
+from models.email import Email, EmailSummary
+from services.session_db import count_session_emails, list_session_emails, get_session_email
 from utils.unsubscribe import extract_unsubscribe_links
 from services.unsubscribe_worker import batch_unsubscribe_worker
-from email.parser import HeaderParser
+from database.db import get_db
+from datetime import datetime
+import base64
+import uuid
 
 router = APIRouter()
 
-@router.get("/", response_model=List[Email])
-def list_emails(session_id: str = Query(...), category_id: str = Query(...), user_email: str = Query(None)):
-    print(f"[EMAILS API] Request: session_id={session_id}, category_id={category_id}, user_email={user_email}")
-    
-    accounts = get_session_accounts(session_id)
-    print(f"[EMAILS API] Found {len(accounts)} accounts: {[acc.email for acc in accounts]}")
-    
-    if not accounts:
-        print("[EMAILS API] No accounts found, returning empty list")
-        return []
-    
-    all_emails = []
-    
-    # If user_email is specified, only get emails for that specific account
-    if user_email:
-        print(f"[EMAILS API] Filtering for specific user: {user_email}")
-        # Verify the user_email belongs to this session
-        account_emails = [acc.email for acc in accounts]
-        if user_email in account_emails:
-            # Get emails for this specific category
-            category_emails = get_emails_by_user_and_category(user_email, category_id)
-            print(f"[EMAILS API] Found {len(category_emails)} emails for {user_email} in category {category_id}")
-            all_emails.extend(category_emails)
-            
-            # If this is the "Uncategorized" category, also include orphaned emails (emails with invalid category_ids)
-            if category_id and "uncategorized" in category_id.lower():
-                from services.session_db import get_emails_by_user_email, get_categories_by_session
-                all_user_emails = get_emails_by_user_email(user_email)
-                
-                # Get all valid category IDs for this session
-                session_categories = get_categories_by_session(session_id)
-                valid_category_ids = {str(cat.id) for cat in session_categories}
-                
-                # Find emails that have category_ids that don't exist in this session (orphaned emails)
-                orphaned_emails = []
-                for email in all_user_emails:
-                    if email.category_id:
-                        # Check if this email's category_id exists in the current session
-                        if str(email.category_id) not in valid_category_ids:
-                            # This email has a category_id from an old session, treat it as orphaned
-                            orphaned_emails.append(email)
-                    else:
-                        # Email has no category_id at all
-                        orphaned_emails.append(email)
-                
-                print(f"[EMAILS API] Found {len(orphaned_emails)} orphaned emails for {user_email}")
-                all_emails.extend(orphaned_emails)
-        else:
-            print(f"[EMAILS API] User {user_email} not found in session accounts")
-    else:
-        print(f"[EMAILS API] Getting emails for all accounts in session")
-        # Get emails for all accounts in the session (existing behavior)
-        for account in accounts:
-            account_emails = get_emails_by_user_and_category(account.email, category_id)
-            print(f"[EMAILS API] Found {len(account_emails)} emails for {account.email} in category {category_id}")
-            all_emails.extend(account_emails)
-    
-    print(f"[EMAILS API] Returning {len(all_emails)} total emails")
-    return [Email(
-        id=e.id,
-        subject=e.subject,
-        from_email=e.from_email,
-        category_id=e.category_id,
-        summary=e.summary,
-        raw=e.raw,
-        user_email=e.user_email,
-        gmail_id=e.gmail_id,
-        headers=getattr(e, 'headers', None)
-    ) for e in all_emails]
+EMAIL_PAGE_SIZE = 100
+EMAIL_PAGE_SIZE_MAX = 500
+
+def _encode_cursor(key):
+    created_at, email_id = key
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{email_id}".encode()).decode()
+
+def _decode_cursor(cursor):
+    created_at, email_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    return datetime.fromisoformat(created_at), uuid.UUID(email_id)
+
+@router.get("/", response_model=List[EmailSummary])
+def list_emails(
+    response: Response,
+    session_id: str = Query(...),
+    category_id: str = Query(...),
+    user_email: str = Query(None),
+    limit: int = Query(EMAIL_PAGE_SIZE, ge=1, le=EMAIL_PAGE_SIZE_MAX),
+    cursor: str = Query(None),
+    db: Session = Depends(get_db)
+):
+    """
+    One page of a category's emails, newest first. When more follow, the X-Next-Cursor
+    header holds the cursor to pass back for the next page. Bodies and headers are left
+    out; GET /emails/{email_id} returns them.
+    """
+    print(f"[EMAILS API] Request: session_id={session_id}, category_id={category_id}, user_email={user_email}, cursor={cursor}")
+    try:
+        after = _decode_cursor(cursor) if cursor else None
+    except (ValueError, UnicodeDecodeError):
+        return Response(content="Invalid cursor", status_code=status.HTTP_400_BAD_REQUEST)
+
+    emails, next_key = list_session_emails(session_id, category_id, user_email=user_email, limit=limit, after=after, db=db)
+    if next_key is not None:
+        response.headers["X-Next-Cursor"] = _encode_cursor(next_key)
+    print(f"[EMAILS API] Returning {len(emails)} emails, more: {next_key is not None}")
+    return emails
+
+@router.get("/count")
+def count_emails(
+    session_id: str = Query(...),
+    category_id: str = Query(...),
+    user_email: str = Query(None),
+    db: Session = Depends(get_db)
+):
+    """How many emails the list holds, so callers need not page through it to count."""
+    return {"count": count_session_emails(session_id, category_id, user_email=user_email, db=db)}
+
+@router.get("/{email_id}", response_model=Email)
+def get_email(email_id: uuid.UUID, session_id: str = Query(...), db: Session = Depends(get_db)):
+    """The full email, body and headers included."""
+    email = get_session_email(session_id, email_id, db=db)
+    if email is None:
+        return Response(content="Email not found", status_code=status.HTTP_404_NOT_FOUND)
+    return email
 
 @router.post("/unsubscribe")
-def unsubscribe_from_emails(email_ids: list = Body(...)):
+def unsubscribe_from_emails(email_ids: list = Body(...), db: Session = Depends(get_db)):
     print("DEBUG: Received unsubscribe request for email_ids:", email_ids)
     results = []
     for eid in email_ids:
-        from database.db import SessionLocal
-        from database.models import Email as DBEmail
-        import json
-        db = SessionLocal()
-        db_email = db.query(DBEmail).filter(DBEmail.id == eid).first()
-        db.close()
+        from database.models import Email as DBEmail, EmailContent as DBEmailContent
+        from sqlalchemy.orm import joinedload
+        db_email = db.query(DBEmail).options(joinedload(DBEmail.content).load_only(DBEmailContent.body)).filter(DBEmail.id == eid).first()
         if db_email:
-            # Parse headers from JSON string if needed
-            if isinstance(db_email.headers, str):
-                try:
-                    headers = json.loads(db_email.headers)
-                except json.JSONDecodeError:
-                    # Fallback to header parser for old format
-                    headers = dict(HeaderParser().parsestr(db_email.headers).items())
-            else:
-                headers = db_email.headers or {}
-            
-            # Normalize headers
-            headers = {k.lower(): v for k, v in headers.items()}
+            raw = (db_email.content.raw if db_email.content is not None else None) or ""
+            # Only List-Unsubscribe is needed from the headers, and it was promoted at ingest
+            headers = {'list-unsubscribe': db_email.list_unsubscribe} if db_email.list_unsubscribe else {}
             print("DEBUG: Email headers:", headers)
-            print("DEBUG: Email raw (first 200 chars):", db_email.raw[:200])
+            print("DEBUG: Email raw (first 200 chars):", raw[:200])
             
             # Create Email object for unsubscribe processing
             from models.email import Email
@@ -114,7 +91,7 @@ def unsubscribe_from_emails(email_ids: list = Body(...)):
                 from_email=db_email.from_email,
                 category_id=db_email.category_id,
                 summary=db_email.summary,
-                raw=db_email.raw,
+                raw=raw,
                 user_email=db_email.user_email,
                 gmail_id=db_email.gmail_id,
                 headers=headers
@@ -138,12 +115,10 @@ def ai_unsubscribe_from_links(payload: dict = Body(...)):
     return {"results": results}
 
 @router.delete("/")
-def delete_emails(email_ids: list = Body(...)):
+def delete_emails(email_ids: list = Body(...), db: Session = Depends(get_db)):
     """Delete multiple emails by their IDs"""
-    from database.db import SessionLocal
     from database.models import Email as DBEmail
     
-    db = SessionLocal()
     deleted_count = 0
     failed_ids = []
     
@@ -164,6 +139,4 @@ def delete_emails(email_ids: list = Body(...)):
         }
     except Exception as e:
         db.rollback()
-        return {"error": f"Failed to delete emails: {str(e)}"}
-    finally:
-        db.close() 
\ No newline at end of file
+        return {"error": f"Failed to delete emails: {str(e)}"} 
\ No newline at end of file
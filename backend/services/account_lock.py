@@ -0,0 +1,134 @@
+"""
+Single-flight guard for per-account mailbox processing.
+
+Only one run per account may be in progress: within a process a threading.Lock
+decides, across uvicorn workers and nodes a Postgres advisory lock does. A
+caller that finds the account busy doesn't wait; it marks the account dirty
+(in memory and in account_locks) and returns, and the current holder runs one
+more pass before letting go, so the late request's mail is still picked up.
+"""
+import threading
+from typing import Callable, List, Optional, TypeVar
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+
+from database.db import SessionLocal, engine
+from database.models import AccountLock
+
+T = TypeVar("T")
+
+# First half of the two-key advisory lock, so these locks don't collide with other users of advisory locks
+ADVISORY_LOCK_NAMESPACE = 7210
+
+_guard = threading.Lock()
+_local_locks = {}  # key -> lock, only while a run for the key is in progress
+_dirty = set()
+_stats = {"runs": 0, "reruns": 0, "deferred": 0}
+
+
+def _acquire_local(key: str) -> Optional[threading.Lock]:
+    """The key's in-process lock, acquired, or None if a run in this process holds it."""
+    with _guard:
+        lock = _local_locks.setdefault(key, threading.Lock())
+        return lock if lock.acquire(blocking=False) else None
+
+
+def _release_local(key: str, lock: threading.Lock):
+    # Nobody ever waits on these locks, so the entry goes with the run and the dict
+    # only holds keys being processed right now
+    with _guard:
+        lock.release()
+        _local_locks.pop(key, None)
+
+
+def mark_dirty(key: str):
+    with _guard:
+        _dirty.add(key)
+        _stats["deferred"] += 1
+    db = SessionLocal()
+    try:
+        stmt = insert(AccountLock).values(email=key, dirty=True)
+        db.execute(stmt.on_conflict_do_update(index_elements=[AccountLock.email], set_={"dirty": True}))
+        db.commit()
+    finally:
+        db.close()
+
+
+def take_dirty(key: str) -> bool:
+    """Clear the dirty flag and report whether it was set."""
+    with _guard:
+        local = key in _dirty
+        _dirty.discard(key)
+    db = SessionLocal()
+    try:
+        cleared = db.query(AccountLock).filter_by(email=key, dirty=True).update({"dirty": False}, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+    return local or cleared > 0
+
+
+def _try_advisory_lock(conn, key: str) -> bool:
+    return conn.execute(
+        text("SELECT pg_try_advisory_lock(:ns, hashtext(:key))"), {"ns": ADVISORY_LOCK_NAMESPACE, "key": key}
+    ).scalar()
+
+
+def _advisory_unlock(conn, key: str):
+    conn.execute(text("SELECT pg_advisory_unlock(:ns, hashtext(:key))"), {"ns": ADVISORY_LOCK_NAMESPACE, "key": key})
+
+
+def single_flight(key: str, fn: Callable[[], T]) -> Optional[List[T]]:
+    """
+    Run fn() as the only run for `key`, repeating it while other callers marked the
+    key dirty. Returns the result of every pass, or None if another run was already
+    in progress (the key is then marked dirty for that run to pick up).
+    """
+    results = []
+    while True:
+        lock = _acquire_local(key)
+        if lock is None:
+            mark_dirty(key)
+            return results or None
+        try:
+            # Session-level advisory locks belong to a connection, so one is held for the whole run
+            with engine.connect() as conn:
+                if not _try_advisory_lock(conn, key):
+                    mark_dirty(key)
+                    return results or None
+                try:
+                    take_dirty(key)  # requests made before this pass are covered by it
+                    while True:
+                        with _guard:
+                            _stats["runs" if not results else "reruns"] += 1
+                        results.append(fn())
+                        if not take_dirty(key):
+                            break
+                finally:
+                    try:
+                        _advisory_unlock(conn, key)
+                        conn.commit()
+                    except Exception:
+                        # Never hand a connection that may still hold the lock back to the pool
+                        conn.invalidate()
+                        raise
+        finally:
+            _release_local(key, lock)
+        # A request that arrived between the last check and the release found the lock
+        # still taken, so take one more look now that it is free
+        with _guard:
+            pending = key in _dirty
+        if not pending:
+            db = SessionLocal()
+            try:
+                pending = db.query(AccountLock.email).filter_by(email=key, dirty=True).first() is not None
+            finally:
+                db.close()
+        if not pending:
+            return results
+
+
+def single_flight_stats() -> dict:
+    with _guard:
+        return {"running": len(_local_locks), **_stats}
@@ -0,0 +1,92 @@
+"""
+Shared Gmail API client factory.
+
+`build('gmail', 'v1', ...)` re-reads and re-parses the discovery document every
+time it is called. Here the bundled static copy is parsed once per process and
+ready-to-use service objects are cached per access token, so a webhook or a
+processing run reuses the same client instead of building several.
+"""
+import json
+import os
+import threading
+
+import httplib2
+import google_auth_httplib2
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.http import HttpRequest
+from dotenv import load_dotenv
+from utils.ttl_cache import TTLCache
+
+load_dotenv()
+
+# Google access tokens live for an hour, so cached clients are dropped a little before that
+GMAIL_CLIENT_CACHE_SIZE = int(os.getenv("GMAIL_CLIENT_CACHE_SIZE", "256"))
+GMAIL_CLIENT_CACHE_TTL = int(os.getenv("GMAIL_CLIENT_CACHE_TTL", "3300"))
+
+_discovery_doc = None
+_build_lock = threading.Lock()
+_services = TTLCache(maxsize=GMAIL_CLIENT_CACHE_SIZE, ttl=GMAIL_CLIENT_CACHE_TTL)
+
+
+def make_credentials(access_token: str, refresh_token: str = None) -> Credentials:
+    return Credentials(
+        token=access_token,
+        refresh_token=refresh_token,
+        token_uri="https://oauth2.googleapis.com/token",
+        client_id=None,
+        client_secret=None
+    )
+
+
+def gmail_discovery_document() -> dict:
+    """The Gmail v1 discovery document bundled with googleapiclient, parsed once."""
+    global _discovery_doc
+    if _discovery_doc is None:
+        with _build_lock:
+            if _discovery_doc is None:
+                _discovery_doc = json.loads(get_static_doc("gmail", "v1"))
+    return _discovery_doc
+
+
+def _per_thread_request_builder(credentials):
+    """
+    httplib2.Http is not thread-safe, so a shared service gives every thread its own
+    authorized transport. Each thread keeps reusing its transport (and its open
+    connections) for all requests it sends through the service.
+    """
+    local = threading.local()
+
+    def build_request(http, *args, **kwargs):
+        if not hasattr(local, "http"):
+            local.http = google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http())
+        return HttpRequest(local.http, *args, **kwargs)
+
+    return build_request
+
+
+def get_gmail_service(credentials: Credentials):
+    """Return a cached Gmail service for these credentials, building it on first use."""
+    key = credentials.token
+    service = _services.get(key)
+    if service is None:
+        doc = gmail_discovery_document()
+        # build_from_document normalizes the document in place, so builds are serialized
+        with _build_lock:
+            service = build_from_document(
+                doc,
+                credentials=credentials,
+                requestBuilder=_per_thread_request_builder(credentials)
+            )
+        _services.set(key, service)
+    return service
+
+
+def evict_gmail_service(access_token: str):
+    """Forget the cached client for a token, e.g. after it was revoked or replaced."""
+    _services.delete(access_token)
+
+
+def gmail_client_stats() -> dict:
+    return _services.stats()
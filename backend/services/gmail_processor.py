@@ -1,21 +1,107 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 from models.user import UserToken
 from models.category import Category
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
 import openai
 import os
 import base64
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from services.session_db import save_email, email_exists
+from services.session_db import (
+    save_emails, get_existing_gmail_ids, get_history_id_by_email, set_history_id_by_email,
+    get_mailbox_resync, start_mailbox_resync, update_mailbox_resync
+)
+from services.llm_cache import get_llm_cache, make_key, categories_fingerprint
+from services.gmail_client import get_gmail_service, make_credentials
+from services.account_lock import single_flight
 from models.email import Email
 
 load_dotenv()
 client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
-print(f"Using OpenAI model: {OPENAI_MODEL}")
+# Classify and summarize with one JSON completion instead of two separate calls
+OPENAI_COMBINED_MODE = os.getenv("OPENAI_COMBINED_MODE", "false").lower() in ("1", "true", "yes")
+print(f"Using OpenAI model: {OPENAI_MODEL} (combined mode: {OPENAI_COMBINED_MODE})")
+
+# Batched classification: emails are truncated and packed into prompts under a token budget
+CLASSIFY_BATCH_TOKEN_BUDGET = int(os.getenv("CLASSIFY_BATCH_TOKEN_BUDGET", "6000"))
+CLASSIFY_BATCH_MAX_CHARS = int(os.getenv("CLASSIFY_BATCH_MAX_CHARS", "2000"))
+CLASSIFY_BATCH_MAX_ITEMS = int(os.getenv("CLASSIFY_BATCH_MAX_ITEMS", "20"))
+
+# Gmail batch requests are capped at 100 calls; Google recommends staying around 50
+GMAIL_BATCH_MAX = 100
+GMAIL_BATCH_SIZE = max(1, min(int(os.getenv("GMAIL_BATCH_SIZE", "50")), GMAIL_BATCH_MAX))
+GMAIL_BATCH_RETRIES = int(os.getenv("GMAIL_BATCH_RETRIES", "3"))
+GMAIL_BATCH_BACKOFF = float(os.getenv("GMAIL_BATCH_BACKOFF", "1.0"))
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# batchModify accepts up to 1000 ids; processed messages are saved and archived in groups of GMAIL_ARCHIVE_FLUSH_SIZE
+GMAIL_BATCH_MODIFY_MAX = 1000
+GMAIL_ARCHIVE_FLUSH_SIZE = max(1, min(int(os.getenv("GMAIL_ARCHIVE_FLUSH_SIZE", "100")), GMAIL_BATCH_MODIFY_MAX))
+
+# Messages are fetched in two phases: labels and headers first, then only the text parts of
+# messages that will actually be sorted. Decoded bodies are capped at GMAIL_MAX_BODY_BYTES.
+GMAIL_METADATA_FIELDS = 'id,labelIds,snippet,sizeEstimate,payload/headers'
+GMAIL_BODY_FIELDS = 'id,payload(mimeType,body/data,parts(mimeType,body/data,parts(mimeType,body/data)))'
+GMAIL_MAX_BODY_BYTES = int(os.getenv("GMAIL_MAX_BODY_BYTES", "100000"))
+
+# Full resync when the stored history id has expired: inbox messages from the last
+# RESYNC_WINDOW_DAYS are listed RESYNC_PAGE_SIZE at a time
+RESYNC_WINDOW_DAYS = int(os.getenv("RESYNC_WINDOW_DAYS", "30"))
+RESYNC_PAGE_SIZE = max(1, min(int(os.getenv("RESYNC_PAGE_SIZE", "100")), 500))
+
+# Messages of one account processed in parallel; 1 keeps the old serial behaviour
+EMAIL_PROCESSING_CONCURRENCY = max(1, int(os.getenv("EMAIL_PROCESSING_CONCURRENCY", "4")))
+# Accounts of one session processed in parallel by process_accounts
+ACCOUNT_PROCESSING_CONCURRENCY = max(1, int(os.getenv("ACCOUNT_PROCESSING_CONCURRENCY", "3")))
+
+_fetch_stats = {"metadata_fetched": 0, "bodies_fetched": 0, "bytes_saved": 0}
+_fetch_stats_lock = threading.Lock()
+
+def _count_fetch(**deltas):
+    with _fetch_stats_lock:
+        for name, delta in deltas.items():
+            _fetch_stats[name] += delta
+
+def fetch_stats() -> dict:
+    """Counters for the two-phase fetch. bytes_saved estimates what a format='full' fetch would have downloaded on top."""
+    with _fetch_stats_lock:
+        return dict(_fetch_stats)
+
+def _cache_get(key: str):
+    try:
+        return get_llm_cache().get(key)
+    except Exception as e:
+        print(f"[LLM cache read error]: {e}")
+        return None
+
+def _cache_set(key: str, value: str, categories: list):
+    session_id = categories[0].session_id if categories else None
+    try:
+        get_llm_cache().set(key, value, session_id)
+    except Exception as e:
+        print(f"[LLM cache write error]: {e}")
+
+def _summary_cache_key(subject: str, sender: str, recipient: str, text: str) -> str:
+    # The prompt names the recipient, so the summary may too; never share it across recipients
+    return make_key("summary", OPENAI_MODEL, f"{subject}\n{sender}\n{recipient}\n{text}")
+
+def _classify_cache_key(text: str, categories: List[Category]) -> str:
+    return make_key("classify", OPENAI_MODEL, text, categories_fingerprint(categories))
+
+def _cached_category_id(key: str, categories: List[Category]):
+    name = _cache_get(key)
+    if name is None:
+        return None
+    return next((c.id for c in categories if c.name.lower() == name.lower()), None)
 
 def summarize_email(subject: str, sender: str, recipient: str, text: str, categories: list) -> str:
+    cache_key = _summary_cache_key(subject, sender, recipient, text)
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        return cached
     category_descriptions = "\n".join([f"{c.name}: {c.description}" for c in categories])
     prompt = f"""
 You're an AI assistant. Summarize the email below in 1-2 sentences. Focus on what it's about. Be concise and clear.
@@ -37,12 +123,17 @@ Respond only with the summary. Don't include any labels, categories, or extra co
             max_tokens=100
         )
         content = response.choices[0].message.content.strip()
+        _cache_set(cache_key, content, categories)
         return content
     except Exception as e:
         print(f"[Summary error]: {e}")
         return "Summary not available."
 
 def classify_email(text: str, categories: List[Category]) -> int:
+    cache_key = _classify_cache_key(text, categories)
+    cached = _cached_category_id(cache_key, categories)
+    if cached is not None:
+        return cached
     category_descriptions = "\n".join([f"{c.name}: {c.description}" for c in categories])
     prompt = f"""
 Given the following email content:
@@ -65,6 +156,7 @@ Which category does the email best belong to? Only return the category name.
         name = response.choices[0].message.content.strip().lower()
         for cat in categories:
             if cat.name.lower() in name:
+                _cache_set(cache_key, cat.name, categories)
                 return cat.id
     except Exception as e:
         print(f"[Classification error]: {e}")
@@ -73,7 +165,136 @@ Which category does the email best belong to? Only return the category name.
     fallback = next((c for c in categories if c.name.lower() == "uncategorized"), categories[0])
     return fallback.id
 
-def archive_gmail_message(service, gmail_id):
+def _estimate_tokens(text: str) -> int:
+    # ~4 characters per token is close enough for budgeting English email text
+    return len(text) // 4 + 1
+
+def classify_emails(texts: List[str], categories: List[Category]) -> list:
+    """
+    Classify several emails against the same categories with as few completions as
+    possible. Emails are truncated to CLASSIFY_BATCH_MAX_CHARS and packed into prompts
+    of at most CLASSIFY_BATCH_TOKEN_BUDGET tokens; the model answers with a JSON object
+    mapping each email's index to a category name. Entries that come back missing or
+    naming an unknown category are classified again one at a time with classify_email.
+    Returns category ids in the same order as `texts`.
+    """
+    if not texts:
+        return []
+    category_descriptions = "\n".join([f"{c.name}: {c.description}" for c in categories])
+    by_name = {c.name.strip().lower(): c for c in categories}
+    header_tokens = _estimate_tokens(category_descriptions) + 100
+
+    cache_keys = [_classify_cache_key(text, categories) for text in texts]
+    results = [_cached_category_id(key, categories) for key in cache_keys]
+
+    batches, current, used = [], [], header_tokens
+    for i, text in enumerate(texts):
+        if results[i] is not None:
+            continue
+        cost = _estimate_tokens(text[:CLASSIFY_BATCH_MAX_CHARS]) + 10
+        if current and (used + cost > CLASSIFY_BATCH_TOKEN_BUDGET or len(current) >= CLASSIFY_BATCH_MAX_ITEMS):
+            batches.append(current)
+            current, used = [], header_tokens
+        current.append(i)
+        used += cost
+    if current:
+        batches.append(current)
+
+    for batch in batches:
+        emails = "\n\n".join(f"[{n}]\n{texts[i][:CLASSIFY_BATCH_MAX_CHARS]}" for n, i in enumerate(batch, start=1))
+        prompt = f"""
+Classify each of the numbered emails below into one of these categories:
+{category_descriptions}
+
+{emails}
+
+Respond with a JSON object mapping each email number to its category name, copied exactly from the list above, e.g. {{"1": "Category", "2": "Category"}}.
+"""
+        try:
+            response = client.chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.3,
+                max_tokens=20 * len(batch) + 20,
+                response_format={"type": "json_object"}
+            )
+            answers = json.loads(response.choices[0].message.content)
+            if not isinstance(answers, dict):
+                raise ValueError(f"unexpected response shape: {answers}")
+            for n, i in enumerate(batch, start=1):
+                name = answers.get(str(n))
+                category = by_name.get(name.strip().lower()) if isinstance(name, str) else None
+                if category is not None:
+                    results[i] = category.id
+                    _cache_set(cache_keys[i], category.name, categories)
+        except Exception as e:
+            print(f"[Batch classification error]: {e}")
+
+    missing = [i for i, category_id in enumerate(results) if category_id is None]
+    if missing:
+        print(f"Classifying {len(missing)} of {len(texts)} emails individually after batch classification")
+    for i in missing:
+        results[i] = classify_email(texts[i], categories)
+    return results
+
+def classify_and_summarize_email(subject: str, sender: str, recipient: str, text: str, categories: List[Category]) -> Tuple[Any, str]:
+    """
+    Classify and summarize in a single JSON completion. The returned category must
+    name one of `categories` exactly; otherwise, or if the response can't be parsed,
+    fall back to the separate classify_email/summarize_email calls.
+    """
+    classify_key = _classify_cache_key(text, categories)
+    summary_key = _summary_cache_key(subject, sender, recipient, text)
+    cached_category_id = _cached_category_id(classify_key, categories)
+    cached_summary = _cache_get(summary_key)
+    if cached_category_id is not None and cached_summary is not None:
+        return cached_category_id, cached_summary
+
+    category_descriptions = "\n".join([f"{c.name}: {c.description}" for c in categories])
+    prompt = f"""
+You're an AI assistant that sorts and summarizes email.
+
+Email:
+Subject: {subject}
+From: {sender}
+To: {recipient}
+Body:
+{text}
+
+Categories:
+{category_descriptions}
+
+Respond with a JSON object with exactly two keys:
+"category": the name of the category the email best belongs to, copied exactly from the list above
+"summary": a concise 1-2 sentence summary of what the email is about
+"""
+    try:
+        response = client.chat.completions.create(
+            model=OPENAI_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.3,
+            max_tokens=150,
+            response_format={"type": "json_object"}
+        )
+        result = json.loads(response.choices[0].message.content)
+        name = result.get("category")
+        summary = result.get("summary")
+        if not isinstance(name, str) or not isinstance(summary, str) or not summary.strip():
+            raise ValueError(f"unexpected response shape: {result}")
+        by_name = {c.name.strip().lower(): c for c in categories}
+        category = by_name.get(name.strip().lower())
+        if category is None:
+            raise ValueError(f"unknown category {name!r}")
+        _cache_set(classify_key, category.name, categories)
+        _cache_set(summary_key, summary.strip(), categories)
+        return category.id, summary.strip()
+    except Exception as e:
+        print(f"[Combined classification error, falling back to separate calls]: {e}")
+
+    return classify_email(text, categories), summarize_email(subject, sender, recipient, text, categories)
+
+def archive_gmail_message(service, gmail_id) -> Optional[str]:
+    """Archive one message. Returns None on success (or if it's already gone), else the error."""
     try:
         service.users().messages().modify(
             userId='me',
@@ -86,106 +307,489 @@ def archive_gmail_message(service, gmail_id):
             print(f"Gmail message {gmail_id} already gone.")
         else:
             print(f"Archive failed for {gmail_id}: {e}")
+            return str(e)
+    return None
+
+def archive_gmail_messages(service, gmail_ids: List[str]) -> Tuple[List[str], Dict[str, str]]:
+    """
+    Archive messages with users.messages.batchModify, up to 1000 ids per call.
+    batchModify fails as a whole, so a failed call is retried one message at a time
+    to find out which ids are at fault. Returns (archived ids, {failed id: error}).
+    """
+    archived, failed = [], {}
+    for start in range(0, len(gmail_ids), GMAIL_BATCH_MODIFY_MAX):
+        chunk = gmail_ids[start:start + GMAIL_BATCH_MODIFY_MAX]
+        try:
+            service.users().messages().batchModify(
+                userId='me',
+                body={'ids': chunk, 'removeLabelIds': ['INBOX']}
+            ).execute()
+            archived.extend(chunk)
+            print(f"Archived {len(chunk)} Gmail messages")
+        except Exception as e:
+            print(f"Bulk archive of {len(chunk)} messages failed, archiving one by one: {e}")
+            for gmail_id in chunk:
+                error = archive_gmail_message(service, gmail_id)
+                if error is None:
+                    archived.append(gmail_id)
+                else:
+                    failed[gmail_id] = error
+    return archived, failed
+
+def _http_status(exception) -> int:
+    resp = getattr(exception, 'resp', None)
+    return getattr(resp, 'status', None)
+
+def fetch_messages(service, gmail_ids: List[str], batch_size: int = GMAIL_BATCH_SIZE, **get_kwargs) -> Dict[str, dict]:
+    """
+    Fetch messages with Gmail batch requests, `batch_size` calls per HTTP round trip.
+    Rate-limited or server-failed items are retried with backoff; anything else that
+    fails is logged and left out of the result, which maps gmail_id -> message.
+    """
+    batch_size = max(1, min(batch_size, GMAIL_BATCH_MAX))
+    results = {}
+    pending = list(dict.fromkeys(gmail_ids))
+    attempt = 0
+    while pending:
+        retry = []
+
+        def on_response(request_id, response, exception):
+            if exception is None:
+                results[request_id] = response
+            elif _http_status(exception) in RETRYABLE_STATUSES:
+                retry.append(request_id)
+            else:
+                print(f"[Fetch error for {request_id}]: {exception}")
+
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start:start + batch_size]
+            batch = service.new_batch_http_request(callback=on_response)
+            for gmail_id in chunk:
+                batch.add(service.users().messages().get(userId='me', id=gmail_id, **get_kwargs), request_id=gmail_id)
+            try:
+                batch.execute()
+            except Exception as e:
+                # The whole round trip failed, so every unanswered item in it gets another go
+                print(f"[Batch fetch error]: {e}")
+                retry.extend(i for i in chunk if i not in results and i not in retry)
+
+        if not retry:
+            break
+        attempt += 1
+        if attempt > GMAIL_BATCH_RETRIES:
+            print(f"Giving up on {len(retry)} messages after {GMAIL_BATCH_RETRIES} retries: {retry}")
+            break
+        time.sleep(GMAIL_BATCH_BACKOFF * 2 ** (attempt - 1))
+        pending = retry
+    return results
+
+def wants_message(msg_metadata: Optional[dict]) -> bool:
+    """Only inbox messages that are not our own sent mail or drafts get sorted."""
+    if msg_metadata is None:
+        return False
+    label_ids = msg_metadata.get('labelIds', [])
+    return 'INBOX' in label_ids and 'SENT' not in label_ids and 'DRAFT' not in label_ids
+
+def _find_text_part(part: dict) -> Optional[str]:
+    if part.get('mimeType') == 'text/plain' and part.get('body', {}).get('data'):
+        return part['body']['data']
+    for child in part.get('parts', []):
+        data = _find_text_part(child)
+        if data:
+            return data
+    return None
+
+def _decode_body(data: str, max_bytes: int = None) -> str:
+    max_bytes = GMAIL_MAX_BODY_BYTES if max_bytes is None else max_bytes
+    # Four base64 characters carry three bytes, so only the prefix we keep gets decoded
+    limit = -(-max_bytes // 3) * 4
+    raw = base64.urlsafe_b64decode(data[:limit] + '=' * (-min(len(data), limit) % 4))
+    return raw[:max_bytes].decode('utf-8', errors='ignore')
+
+def _body_data_size(part: dict) -> int:
+    return len(part.get('body', {}).get('data') or '') + sum(_body_data_size(p) for p in part.get('parts', []))
+
+def fetch_message_details(service, gmail_ids: List[str]) -> Tuple[Dict[str, dict], Dict[str, dict]]:
+    """
+    Fetch labels and headers for every id, then text parts only for the messages
+    that pass the label filter. Returns (metadata, bodies), both keyed by gmail_id.
+    """
+    metadata = fetch_messages(service, gmail_ids, format='metadata', fields=GMAIL_METADATA_FIELDS)
+    wanted = [gmail_id for gmail_id in gmail_ids if wants_message(metadata.get(gmail_id))]
+    bodies = fetch_messages(service, wanted, format='full', fields=GMAIL_BODY_FIELDS) if wanted else {}
+
+    saved = 0
+    for gmail_id, msg in metadata.items():
+        size = int(msg.get('sizeEstimate') or 0)
+        body = bodies.get(gmail_id)
+        downloaded = _body_data_size(body.get('payload', {})) if body else 0
+        saved += max(0, size - downloaded)
+    _count_fetch(metadata_fetched=len(metadata), bodies_fetched=len(bodies), bytes_saved=saved)
+    return metadata, bodies
+
+def parse_message(gmail_id: str, msg_detail: dict, msg_body: Optional[dict] = None) -> Optional[dict]:
+    """
+    Pull the fields we store out of a fetched Gmail message. Returns None for messages we don't sort.
+    Headers come from `msg_detail`; text parts from `msg_body` when they were fetched separately.
+    """
+    if msg_detail is None:
+        print(f"Skipping message that could not be fetched: {gmail_id}")
+        return None
+    if not wants_message(msg_detail):
+        print(f"Skipping non-inbox message: {gmail_id}")
+        return None
+
+    headers = {h['name']: h['value'] for h in msg_detail['payload'].get('headers', [])}
+    snippet = msg_detail.get('snippet', '')
+    data = _find_text_part((msg_body or msg_detail).get('payload', {}))
+    body = _decode_body(data) if data else ''
+    if not body:
+        body = snippet
+    return {
+        'gmail_id': gmail_id,
+        'subject': headers.get('Subject', ''),
+        'sender': headers.get('From', ''),
+        'recipient': headers.get('To', '') or headers.get('Delivered-To', ''),
+        'body': body,
+        'headers': headers,
+    }
+
+def process_message(user_token: UserToken, message: dict, categories: List[Category], category_id=None) -> Optional[Email]:
+    """
+    Classify (unless `category_id` was already decided by a batch) and summarize one
+    parsed message. Errors are logged and yield None. Saving and archiving are left
+    to the caller so both can be done in bulk.
+    """
+    gmail_id = message['gmail_id']
+    try:
+        subject, sender, recipient, body = message['subject'], message['sender'], message['recipient'], message['body']
+        if category_id is not None:
+            summary = summarize_email(subject, sender, recipient, body, categories)
+        elif OPENAI_COMBINED_MODE:
+            category_id, summary = classify_and_summarize_email(subject, sender, recipient, body, categories)
+        else:
+            category_id = classify_email(body, categories)
+            summary = summarize_email(subject, sender, recipient, body, categories)
+
+        return Email(
+            id=None,  # Assigned when the batch is saved
+            subject=subject,
+            from_email=sender,
+            category_id=category_id,
+            summary=summary,
+            raw=body,
+            user_email=user_token.email,
+            gmail_id=gmail_id,
+            headers=message['headers']
+        )
+    except Exception as e:
+        print(f"[Processing error for {gmail_id}]: {e}")
+        return None
+
+def _save_batch(emails: List[Email]) -> List[Email]:
+    """
+    Save a batch in one transaction. If that fails, save one by one so a single bad
+    row only drops that message. Returns the emails that are stored.
+    """
+    try:
+        save_emails(emails)
+        return list(emails)
+    except Exception as e:
+        print(f"[Bulk save error, saving individually]: {e}")
+    saved = []
+    for email in emails:
+        try:
+            save_emails([email])
+            saved.append(email)
+        except Exception as e:
+            print(f"[Processing error for {email.gmail_id}]: {e}")
+    return saved
+
+def _map_bounded(fn, items: list):
+    """
+    Yield fn(item) for each item, in order, with up to EMAIL_PROCESSING_CONCURRENCY
+    items in flight. The shared Gmail service gives each worker thread its own transport.
+    """
+    if EMAIL_PROCESSING_CONCURRENCY <= 1 or len(items) <= 1:
+        for item in items:
+            yield fn(item)
+        return
+    with ThreadPoolExecutor(max_workers=min(EMAIL_PROCESSING_CONCURRENCY, len(items))) as executor:
+        yield from executor.map(fn, items)
 
 def get_latest_history_id(service) -> str:
     profile = service.users().getProfile(userId='me').execute()
     return profile.get('historyId')
 
-def get_new_message_ids(service, last_history_id: str) -> list:
-    new_message_ids = set()
+class HistoryExpired(Exception):
+    """Gmail no longer has history back to the requested startHistoryId (HTTP 404)."""
+
+def iter_history_pages(service, start_history_id: str) -> Iterator[Tuple[List[Tuple[str, str]], str]]:
+    """
+    Walk `history().list` lazily, one page at a time. Each page yields
+    ([(gmail_id, record_history_id), ...], checkpoint): the newly added messages,
+    each with the history record that added it, and the history id that is safe
+    to store once the whole page has been handled. On the last page that is the
+    mailbox's current historyId from the response, so no getProfile call is needed.
+    """
+    seen = set()
     page_token = None
     while True:
-        history = service.users().history().list(
-            userId='me',
-            startHistoryId=last_history_id,
-            historyTypes=['messageAdded'],
-            pageToken=page_token
-        ).execute()
+        try:
+            history = service.users().history().list(
+                userId='me',
+                startHistoryId=start_history_id,
+                historyTypes=['messageAdded'],
+                pageToken=page_token
+            ).execute()
+        except Exception as e:
+            if _http_status(e) == 404:
+                raise HistoryExpired(start_history_id) from e
+            raise
+        entries = []
+        checkpoint = None
         for h in history.get('history', []):
+            checkpoint = h['id']
             for msg in h.get('messagesAdded', []):
-                new_message_ids.add(msg['message']['id'])
+                gmail_id = msg['message']['id']
+                if gmail_id not in seen:
+                    seen.add(gmail_id)
+                    entries.append((gmail_id, h['id']))
         page_token = history.get('nextPageToken')
         if not page_token:
-            break
-    return list(new_message_ids)
+            yield entries, history.get('historyId') or checkpoint
+            return
+        yield entries, checkpoint
 
-def process_user_emails(user_token: UserToken, categories: List[Category], max_emails: int = 10, last_history_id: str = "") -> List[dict]:
+def get_new_message_ids(service, last_history_id: str) -> list:
+    return [gmail_id for entries, _ in iter_history_pages(service, last_history_id) for gmail_id, _ in entries]
+
+def _checkpoint_before(entries: List[Tuple[str, str]], gmail_id: str) -> Optional[str]:
+    """The newest history record that only added messages listed before `gmail_id`."""
+    stop = next(record_id for entry_id, record_id in entries if entry_id == gmail_id)
+    earlier = [int(record_id) for _, record_id in entries if int(record_id) < int(stop)]
+    return str(max(earlier)) if earlier else None
+
+def _process_candidates(service, user_token: UserToken, candidate_ids: List[str], categories: List[Category]) -> List[dict]:
+    """Fetch, classify, summarize, save and archive the given not-yet-stored messages."""
+    metadata, bodies = fetch_message_details(service, candidate_ids)
+
+    parsed = []
+    for gmail_id in candidate_ids:
+        try:
+            message = parse_message(gmail_id, metadata.get(gmail_id), bodies.get(gmail_id))
+            if message is not None:
+                parsed.append(message)
+        except Exception as e:
+            print(f"[Processing error for {gmail_id}]: {e}")
+
+    # Several pending messages share one category list, so classify them together. In
+    # combined mode every message already gets one call that classifies and summarizes,
+    # so a batch classification on top would only send each body twice.
+    category_ids = [None] * len(parsed)
+    if len(parsed) > 1 and not OPENAI_COMBINED_MODE:
+        category_ids = classify_emails([m['body'] for m in parsed], categories)
+    work = list(zip(parsed, category_ids))
+
+    processed = []
+    pending = []
+
+    def flush():
+        saved = _save_batch(pending)
+        if saved:
+            archived, failed = archive_gmail_messages(service, [e.gmail_id for e in saved])
+            if failed:
+                print(f"Failed to archive {len(failed)} messages for {user_token.email}: {failed}")
+            archived = set(archived)
+            for email in saved:
+                processed.append({**email.model_dump(), 'archived': email.gmail_id in archived})
+        pending.clear()
+
+    for email in _map_bounded(lambda item: process_message(user_token, item[0], categories, item[1]), work):
+        if email is None:
+            continue
+        pending.append(email)
+        if len(pending) >= GMAIL_ARCHIVE_FLUSH_SIZE:
+            flush()
+    if pending:
+        flush()
+    return processed
+
+def resync_mailbox(service, user_token: UserToken, categories: List[Category], max_emails: int = 10) -> List[dict]:
+    """
+    Rebuild from the inbox itself when history is unavailable. Pages through
+    messages().list over the last RESYNC_WINDOW_DAYS, skips stored messages and
+    runs the rest through the normal pipeline. Progress lives in mailbox_resyncs,
+    so a large inbox is worked through over several runs of at most `max_emails`.
+    Once the last page is done the history id captured at the start is stored.
+    """
+    email = user_token.email
+    resync = get_mailbox_resync(email)
+    if resync is None or resync.status != 'running':
+        # Captured before listing, so mail arriving during the resync is picked up by history afterwards
+        resync = start_mailbox_resync(email, get_latest_history_id(service))
+        print(f"Started full resync for {email} (history ID {resync.history_id})")
+
+    processed = []
+    remaining = max_emails
+    page_token = resync.page_token
+    try:
+        while remaining > 0:
+            response = service.users().messages().list(
+                userId='me',
+                q=f'in:inbox newer_than:{RESYNC_WINDOW_DAYS}d',
+                maxResults=RESYNC_PAGE_SIZE,
+                pageToken=page_token
+            ).execute()
+            page_ids = [m['id'] for m in response.get('messages', [])]
+            existing_ids = get_existing_gmail_ids(email, page_ids) if page_ids else set()
+            new_ids = [gmail_id for gmail_id in page_ids if gmail_id not in existing_ids]
+            candidate_ids = new_ids[:remaining]
+            if candidate_ids:
+                processed_page = _process_candidates(service, user_token, candidate_ids, categories)
+                processed.extend(processed_page)
+            else:
+                processed_page = []
+            remaining -= len(candidate_ids)
+
+            if len(candidate_ids) < len(new_ids):
+                # Out of budget mid-page: keep the page token so this page is listed again next run
+                resync = update_mailbox_resync(email, page_token, processed=len(processed_page))
+                break
+            page_token = response.get('nextPageToken')
+            resync = update_mailbox_resync(
+                email, page_token, scanned=len(page_ids), skipped=len(existing_ids), processed=len(processed_page),
+                status=None if page_token else 'done'
+            )
+            if not page_token:
+                set_history_id_by_email(email, resync.history_id)
+                print(f"Finished full resync for {email}: {resync.processed} processed, {resync.skipped} already stored")
+                break
+    except Exception as e:
+        update_mailbox_resync(email, page_token, error=str(e))
+        raise
+    if resync.status == 'running':
+        print(f"Resync for {email} paused after {resync.scanned} scanned messages; it continues on the next run")
+    return processed
+
+def process_user_emails(user_token: UserToken, categories: List[Category], max_emails: int = 10, last_history_id: Optional[str] = "", force_resync: bool = False) -> List[dict]:
+    """
+    Process new mail for one account, as the only run for that mailbox. A call made
+    while another run holds the account returns [] straight away and that run makes
+    one more pass instead; passes after the first start from the stored history id.
+    With `last_history_id=None` the first pass does too, read once the account is held.
+    """
+    calls = []
+
+    def run():
+        rerun = bool(calls)
+        calls.append(rerun)
+        if rerun:
+            # Covers requests made during the previous pass, from wherever that pass got to
+            return _process_user_emails(user_token, categories, max_emails, get_history_id_by_email(user_token.email) or "")
+        start = (get_history_id_by_email(user_token.email) or "") if last_history_id is None else last_history_id
+        return _process_user_emails(user_token, categories, max_emails, start, force_resync)
+
+    passes = single_flight(user_token.email, run)
+    if passes is None:
+        print(f"Processing for {user_token.email} is already running; it will pick up this request")
+        return []
+    return [email for processed in passes for email in processed]
+
+def _process_user_emails(user_token: UserToken, categories: List[Category], max_emails: int = 10, last_history_id: str = "", force_resync: bool = False) -> List[dict]:
+    """
+    Process messages added since `last_history_id`, page by page. After each fully
+    handled page the stored history id moves forward, so a crash only repeats the
+    page that was in flight. When `max_emails` runs out mid-page the checkpoint stops
+    just before the first message left over and the next run picks it up from there.
+
+    If the history id has expired, or `force_resync` is set, the inbox is resynced
+    instead (see resync_mailbox); an unfinished resync is continued on later runs.
+    """
     try:
         print(f"Processing emails for user: {user_token.email}")
-        creds = Credentials(
-            token=user_token.access_token,
-            refresh_token=user_token.refresh_token,
-            token_uri="https://oauth2.googleapis.com/token",
-            client_id=None,
-            client_secret=None
-        )
-        service = build('gmail', 'v1', credentials=creds)
+        service = get_gmail_service(make_credentials(user_token.access_token, user_token.refresh_token))
 
         if not categories:
             print(f"No categories available for user {user_token.email}")
             return []
 
+        resync = get_mailbox_resync(user_token.email)
+        if force_resync or (resync is not None and resync.status == 'running'):
+            return resync_mailbox(service, user_token, categories, max_emails)
+
         if not last_history_id:
-            from services.session_db import set_history_id_by_email
             current_history_id = get_latest_history_id(service)
             set_history_id_by_email(user_token.email, current_history_id)
             print(f"Set initial history ID for {user_token.email} to {current_history_id}")
             return []
 
-        new_message_ids = get_new_message_ids(service, last_history_id)
-        print(f"Found {len(new_message_ids)} new messages.")
-
         processed = []
-        for gmail_id in new_message_ids[:max_emails]:
-            try:
-                if email_exists(user_token.email, gmail_id):
-                    print(f"Skipping already-processed message: {gmail_id}")
-                    continue
-
-                msg_detail = service.users().messages().get(userId='me', id=gmail_id, format='full').execute()
-                label_ids = msg_detail.get('labelIds', [])
-                if 'INBOX' not in label_ids or 'SENT' in label_ids or 'DRAFT' in label_ids:
-                    print(f"Skipping non-inbox message: {gmail_id}")
-                    continue
-
-                headers = {h['name']: h['value'] for h in msg_detail['payload'].get('headers', [])}
-                subject = headers.get('Subject', '')
-                sender = headers.get('From', '')
-                recipient = headers.get('To', '') or headers.get('Delivered-To', '')
-                snippet = msg_detail.get('snippet', '')
-                body = ''
-                for part in msg_detail['payload'].get('parts', []):
-                    if part.get('mimeType') == 'text/plain':
-                        data = part['body'].get('data')
-                        if data:
-                            body = base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore')
-                            break
-                if not body:
-                    body = snippet
-
-                category_id = classify_email(body, categories)
-                summary = summarize_email(subject, sender, recipient, body, categories)
-
-                email_obj = Email(
-                    id=None,  # Let the database generate the UUID
-                    subject=subject,
-                    from_email=sender,
-                    category_id=category_id,
-                    summary=summary,
-                    raw=body,
-                    user_email=user_token.email,
-                    gmail_id=gmail_id,
-                    headers=headers
-                )
-                save_email(email_obj)
-                archive_gmail_message(service, gmail_id)
-                processed.append(email_obj.model_dump())
-            except Exception as e:
-                print(f"[Processing error for {gmail_id}]: {e}")
-                continue
+        remaining = max_emails
+        try:
+            for entries, checkpoint in iter_history_pages(service, last_history_id):
+                page_ids = [gmail_id for gmail_id, _ in entries]
+                print(f"Found {len(page_ids)} new messages.")
+
+                # One query filters out everything already stored, before any Gmail fetch
+                existing_ids = get_existing_gmail_ids(user_token.email, page_ids) if page_ids else set()
+                if existing_ids:
+                    print(f"Skipping {len(existing_ids)} already-processed messages")
+                new_ids = [gmail_id for gmail_id in page_ids if gmail_id not in existing_ids]
+                candidate_ids = new_ids[:remaining]
+
+                if candidate_ids:
+                    processed.extend(_process_candidates(service, user_token, candidate_ids, categories))
+                remaining -= len(candidate_ids)
+
+                if len(candidate_ids) < len(new_ids):
+                    checkpoint = _checkpoint_before(entries, new_ids[len(candidate_ids)])
+                    if checkpoint:
+                        set_history_id_by_email(user_token.email, checkpoint)
+                    print(f"Reached max_emails={max_emails}; {len(new_ids) - len(candidate_ids)} messages left for the next run")
+                    break
+                if checkpoint:
+                    set_history_id_by_email(user_token.email, checkpoint)
+                    print(f"Checkpointed history ID for {user_token.email} at {checkpoint}")
+        except HistoryExpired:
+            print(f"History ID {last_history_id} for {user_token.email} has expired, falling back to a full resync")
+            processed.extend(resync_mailbox(service, user_token, categories, max(0, remaining)))
 
         return processed
 
     except Exception as e:
         print(f"[Critical error in process_user_emails]: {e}")
         raise e
+
+def process_accounts(user_tokens: List[UserToken], categories: List[Category], max_emails: int = 10) -> Tuple[Dict[str, dict], dict]:
+    """
+    Run process_user_emails for several accounts of one session, at most
+    ACCOUNT_PROCESSING_CONCURRENCY at a time. One account failing doesn't stop
+    the others. Returns per-account results ({"processed", "emails"} or {"error"})
+    and a summary with success/failure counts and per-account timings.
+    """
+    def run(user_token):
+        start = time.perf_counter()
+        try:
+            emails = process_user_emails(user_token, categories, max_emails=max_emails, last_history_id=user_token.history_id or "")
+            result = {"processed": len(emails), "emails": emails}
+        except Exception as e:
+            result = {"error": str(e)}
+        return user_token.email, result, round(time.perf_counter() - start, 3)
+
+    started = time.perf_counter()
+    results, timings = {}, {}
+    workers = min(ACCOUNT_PROCESSING_CONCURRENCY, max(1, len(user_tokens)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for email, result, seconds in executor.map(run, user_tokens):
+            results[email] = result
+            timings[email] = seconds
+    failed = [email for email, result in results.items() if "error" in result]
+    summary = {
+        "accounts": len(results),
+        "succeeded": len(results) - len(failed),
+        "failed": failed,
+        "timings": timings,
+        "total_seconds": round(time.perf_counter() - started, 3),
+    }
+    return results, summary
@@ -0,0 +1,241 @@
+"""
+Postgres-backed queue for Gmail notification processing.
+
+The webhook only inserts a row into processing_jobs; worker threads claim rows
+with SELECT ... FOR UPDATE SKIP LOCKED, so any number of uvicorn workers or
+nodes can drain the same table without handing a job out twice. A claimed job
+is invisible to other workers until its visibility timeout passes; if the
+worker dies first the job is claimed again. Failures are retried with
+exponential backoff and end in the 'dead' state after JOB_MAX_ATTEMPTS.
+
+Gmail pushes one notification per mailbox change, so bursts are coalesced: a
+new job waits JOB_COALESCE_WINDOW seconds before it can run, and notifications
+for an account that already has a waiting job only raise that job's historyId.
+"""
+import os
+import socket
+import threading
+import traceback
+import uuid
+from datetime import timedelta
+from typing import Callable, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import Numeric, String, and_, cast, func, literal_column, or_, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+
+from database.db import SessionLocal
+from database.models import ProcessingJob
+
+load_dotenv()
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))  # worker threads per process; 0 disables them
+JOB_VISIBILITY_TIMEOUT = int(os.getenv("JOB_VISIBILITY_TIMEOUT", "300"))  # seconds a claimed job stays hidden
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", "10"))  # seconds, doubled after every failed attempt
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+JOB_COALESCE_WINDOW = float(os.getenv("JOB_COALESCE_WINDOW", "5"))  # seconds a new job waits for more notifications
+
+# Per-process counters; notifications versus runs shows how much coalescing saves
+_metrics = {"notifications": 0, "coalesced": 0, "runs": 0, "failures": 0}
+_metrics_lock = threading.Lock()
+
+
+def _count(name: str):
+    with _metrics_lock:
+        _metrics[name] += 1
+
+
+def _later_history_id(a: Optional[str], b: Optional[str]) -> Optional[str]:
+    if a is None or b is None:
+        return a or b
+    return a if int(a) >= int(b) else b
+
+
+def enqueue(account_email: str, history_id: Optional[str] = None, window: float = None) -> str:
+    """
+    Queue processing for an account. If a job for it is already waiting, that job
+    absorbs this notification (keeping the highest historyId) and its id is returned.
+    """
+    window = JOB_COALESCE_WINDOW if window is None else window
+    stmt = insert(ProcessingJob).values(
+        id=uuid.uuid4(),
+        account_email=account_email,
+        history_id=str(history_id) if history_id is not None else None,
+        run_after=func.now() + timedelta(seconds=window),
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ProcessingJob.account_email],
+        index_where=ProcessingJob.status == "queued",
+        set_={"history_id": cast(func.greatest(cast(ProcessingJob.history_id, Numeric), cast(stmt.excluded.history_id, Numeric)), String)},
+    ).returning(ProcessingJob.id, literal_column("xmax = 0").label("inserted"))
+    db = SessionLocal()
+    try:
+        job_id, inserted = db.execute(stmt).one()
+        db.commit()
+    finally:
+        db.close()
+    _count("notifications")
+    if not inserted:
+        _count("coalesced")
+    return str(job_id)
+
+
+def claim(worker_id: str, visibility_timeout: int = None) -> Optional[ProcessingJob]:
+    """
+    Take the oldest runnable job: a queued one whose run_after has passed, or a
+    running one whose visibility timeout expired. Returns None when there is none.
+    """
+    visibility_timeout = JOB_VISIBILITY_TIMEOUT if visibility_timeout is None else visibility_timeout
+    db = SessionLocal()
+    try:
+        now = func.now()
+        candidate = (
+            select(ProcessingJob.id)
+            .where(or_(
+                and_(ProcessingJob.status == "queued", ProcessingJob.run_after <= now),
+                and_(ProcessingJob.status == "running", ProcessingJob.locked_until < now),
+            ))
+            .order_by(ProcessingJob.run_after)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        job = db.execute(
+            update(ProcessingJob)
+            .where(ProcessingJob.id == candidate)
+            .values(
+                status="running",
+                attempts=ProcessingJob.attempts + 1,
+                locked_by=worker_id,
+                locked_until=now + timedelta(seconds=visibility_timeout),
+            )
+            .returning(ProcessingJob)
+        ).scalar_one_or_none()
+        if job is not None:
+            db.expunge(job)  # keep the loaded values usable after commit and close
+        db.commit()
+        return job
+    finally:
+        db.close()
+
+
+def _owned(job: ProcessingJob):
+    # A worker whose lease expired must not touch the job after someone else claimed it
+    return and_(
+        ProcessingJob.id == job.id,
+        ProcessingJob.status == "running",
+        ProcessingJob.locked_by == job.locked_by,
+        ProcessingJob.attempts == job.attempts,
+    )
+
+
+def complete(job: ProcessingJob) -> bool:
+    db = SessionLocal()
+    try:
+        deleted = db.query(ProcessingJob).filter(_owned(job)).delete(synchronize_session=False)
+        db.commit()
+        return deleted == 1
+    finally:
+        db.close()
+
+
+def fail(job: ProcessingJob, error: str, max_attempts: int = None) -> str:
+    """
+    Schedule a retry with backoff, or dead-letter the job once it used up its attempts.
+    A retry is folded into the account's waiting job if notifications queued one meanwhile.
+    """
+    max_attempts = JOB_MAX_ATTEMPTS if max_attempts is None else max_attempts
+    if job.attempts >= max_attempts:
+        values = {"status": "dead"}
+    else:
+        delay = JOB_RETRY_BACKOFF * 2 ** (job.attempts - 1)
+        values = {"status": "queued", "run_after": func.now() + timedelta(seconds=delay)}
+    db = SessionLocal()
+    try:
+        for _ in range(2):
+            try:
+                if values["status"] == "queued":
+                    waiting = db.query(ProcessingJob).filter_by(account_email=job.account_email, status="queued").with_for_update().first()
+                    if waiting is not None:
+                        waiting.history_id = _later_history_id(waiting.history_id, job.history_id)
+                        db.query(ProcessingJob).filter(_owned(job)).delete(synchronize_session=False)
+                        db.commit()
+                        return "queued"
+                db.execute(
+                    update(ProcessingJob)
+                    .where(_owned(job))
+                    .values(locked_until=None, locked_by=None, last_error=error[:4000], **values)
+                )
+                db.commit()
+                return values["status"]
+            except IntegrityError:
+                # A notification queued a job for the account between our check and update
+                db.rollback()
+        raise RuntimeError(f"Could not requeue job {job.id}")
+    finally:
+        db.close()
+
+
+def queue_stats() -> dict:
+    db = SessionLocal()
+    try:
+        rows = db.query(ProcessingJob.status, func.count()).group_by(ProcessingJob.status).all()
+    finally:
+        db.close()
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    return {"workers": len(_workers), "jobs": {status: count for status, count in rows}, **metrics}
+
+
+def run_once(handler: Callable[[ProcessingJob], None], worker_id: str) -> bool:
+    """Claim and run a single job. Returns False if there was nothing to do."""
+    job = claim(worker_id)
+    if job is None:
+        return False
+    _count("runs")
+    try:
+        handler(job)
+    except Exception as e:
+        _count("failures")
+        traceback.print_exc()
+        status = fail(job, f"{type(e).__name__}: {e}")
+        print(f"[JOB QUEUE] Job {job.id} for {job.account_email} failed (attempt {job.attempts}), now {status}")
+    else:
+        complete(job)
+    return True
+
+
+_workers: List[threading.Thread] = []
+_stop = threading.Event()
+
+
+def _worker_loop(handler, worker_id: str):
+    while not _stop.is_set():
+        try:
+            if run_once(handler, worker_id):
+                continue
+        except Exception as e:
+            # e.g. the database is briefly unreachable; keep the worker alive
+            print(f"[JOB QUEUE] Worker {worker_id} error: {e}")
+        _stop.wait(JOB_POLL_INTERVAL)
+
+
+def start_workers(handler: Callable[[ProcessingJob], None], count: int = None):
+    count = JOB_WORKERS if count is None else count
+    _stop.clear()
+    prefix = f"{socket.gethostname()}:{os.getpid()}"
+    for _ in range(count):
+        worker_id = f"{prefix}:{uuid.uuid4().hex[:8]}"
+        thread = threading.Thread(target=_worker_loop, args=(handler, worker_id), name=f"job-worker-{worker_id}", daemon=True)
+        thread.start()
+        _workers.append(thread)
+    print(f"[JOB QUEUE] Started {count} workers")
+
+
+def stop_workers(timeout: float = 10):
+    _stop.set()
+    for thread in _workers:
+        thread.join(timeout)
+    _workers.clear()
@@ -0,0 +1,206 @@
+"""
+Content-addressed cache for OpenAI classification and summary results.
+
+Newsletters and notifications arrive with near-identical bodies across many
+accounts, so results are keyed on a hash of the normalized body together with
+the model, the prompt version and a fingerprint of the category set. Entries
+also remember the session that wrote them so a category change can drop them.
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from dotenv import load_dotenv
+from utils.ttl_cache import TTLCache
+
+load_dotenv()
+
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "memory").lower()  # memory | postgres | none
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+LLM_CACHE_PURGE_INTERVAL = int(os.getenv("LLM_CACHE_PURGE_INTERVAL", "3600"))  # seconds between purges of expired rows
+
+# Bump when a prompt changes so results produced by the old wording stop matching
+PROMPT_VERSIONS = {
+    "classify": "1",
+    "summary": "1",
+}
+
+
+def normalize_body(text: str) -> str:
+    return re.sub(r"\s+", " ", text or "").strip().lower()
+
+
+def categories_fingerprint(categories) -> str:
+    """Stable hash of the category names and descriptions, independent of ids and order."""
+    items = sorted((c.name.strip().lower(), (c.description or "").strip()) for c in categories)
+    return hashlib.sha256(repr(items).encode("utf-8")).hexdigest()
+
+
+def make_key(kind: str, model: str, text: str, fingerprint: str = "") -> str:
+    raw = "\x1f".join([kind, model, PROMPT_VERSIONS[kind], fingerprint, normalize_body(text)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class MemoryLLMCache:
+    """In-process LRU cache with TTL. Fast, but not shared between workers."""
+    name = "memory"
+
+    def __init__(self, maxsize: int = LLM_CACHE_MAX_ENTRIES, ttl: int = LLM_CACHE_TTL):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._cache.get(key)
+        return entry[0] if entry is not None else None
+
+    def set(self, key: str, value: str, session_id: Optional[str] = None):
+        self._cache.set(key, (value, session_id))
+
+    def invalidate_session(self, session_id: str) -> int:
+        return self._cache.delete_where(lambda key, entry: entry[1] == session_id)
+
+    def stats(self) -> dict:
+        return {"backend": self.name, **self._cache.stats()}
+
+
+class PostgresLLMCache:
+    """Cache rows in the llm_cache table so every worker and node shares results."""
+    name = "postgres"
+
+    def __init__(self, ttl: int = LLM_CACHE_TTL, purge_interval: int = LLM_CACHE_PURGE_INTERVAL):
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self.hits = 0
+        self.misses = 0
+        self._last_purge = None
+        self._lock = threading.Lock()
+
+    def _cutoff(self):
+        return datetime.now(timezone.utc) - timedelta(seconds=self.ttl)
+
+    def get(self, key: str) -> Optional[str]:
+        from database.db import SessionLocal
+        from database.models import LLMCacheEntry
+        db = SessionLocal()
+        try:
+            entry = db.query(LLMCacheEntry.value).filter(LLMCacheEntry.key == key, LLMCacheEntry.created_at >= self._cutoff()).first()
+        finally:
+            db.close()
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return entry.value
+
+    def set(self, key: str, value: str, session_id: Optional[str] = None):
+        from sqlalchemy.dialects.postgresql import insert
+        from database.db import SessionLocal
+        from database.models import LLMCacheEntry
+        db = SessionLocal()
+        try:
+            stmt = insert(LLMCacheEntry).values(key=key, value=value, session_id=session_id)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[LLMCacheEntry.key],
+                set_={"value": stmt.excluded.value, "session_id": stmt.excluded.session_id, "created_at": datetime.now(timezone.utc)}
+            )
+            db.execute(stmt)
+            db.commit()
+        finally:
+            db.close()
+        if self._purge_due():
+            self.purge_expired()
+
+    def _purge_due(self) -> bool:
+        """True for at most one caller per purge interval in this process."""
+        now = time.monotonic()
+        with self._lock:
+            if self._last_purge is not None and now - self._last_purge < self.purge_interval:
+                return False
+            self._last_purge = now
+            return True
+
+    def purge_expired(self) -> int:
+        """Delete rows older than the TTL; get() already ignores them. Returns the number deleted."""
+        from database.db import SessionLocal
+        from database.models import LLMCacheEntry
+        db = SessionLocal()
+        try:
+            deleted = db.query(LLMCacheEntry).filter(LLMCacheEntry.created_at < self._cutoff()).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+        if deleted:
+            print(f"[LLM cache] Purged {deleted} expired entries")
+        return deleted
+
+    def invalidate_session(self, session_id: str) -> int:
+        from database.db import SessionLocal
+        from database.models import LLMCacheEntry
+        db = SessionLocal()
+        try:
+            deleted = db.query(LLMCacheEntry).filter(LLMCacheEntry.session_id == session_id).delete(synchronize_session=False)
+            db.commit()
+            return deleted
+        finally:
+            db.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "backend": self.name,
+            "ttl": self.ttl,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+        }
+
+
+class NullLLMCache:
+    name = "none"
+
+    def get(self, key: str) -> Optional[str]:
+        return None
+
+    def set(self, key: str, value: str, session_id: Optional[str] = None):
+        pass
+
+    def invalidate_session(self, session_id: str) -> int:
+        return 0
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+
+_cache = None
+
+
+def get_llm_cache():
+    """The process-wide cache backend selected by LLM_CACHE_BACKEND."""
+    global _cache
+    if _cache is None:
+        if LLM_CACHE_BACKEND == "postgres":
+            _cache = PostgresLLMCache()
+        elif LLM_CACHE_BACKEND == "none":
+            _cache = NullLLMCache()
+        else:
+            _cache = MemoryLLMCache()
+        print(f"Using LLM cache backend: {_cache.name}")
+    return _cache
+
+
+def invalidate_session(session_id: str) -> int:
+    """Drop cached results written for a session, e.g. after one of its categories changed."""
+    try:
+        dropped = get_llm_cache().invalidate_session(session_id)
+        print(f"[LLM CACHE] Invalidated {dropped} entries for session {session_id}")
+        return dropped
+    except Exception as e:
+        print(f"[LLM CACHE] Invalidation failed for session {session_id}: {e}")
+        return 0
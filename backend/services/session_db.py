@@ -1,9 +1,24 @@
-from database.db import SessionLocal
-from database.models import Session as DBSession, SessionAccount as DBSessionAccount, Category as DBCategory, Email as DBEmail
+from database.db import SessionLocal, session_scope
+from database.models import Session as DBSession, SessionAccount as DBSessionAccount, Category as DBCategory, Email as DBEmail, EmailContent as DBEmailContent, MailboxResync as DBMailboxResync
+from database.models import compress_body, header_columns
+from sqlalchemy import func
 from sqlalchemy.orm import joinedload
-import json
+from utils.ttl_cache import TTLCache
 import os
 
+# Webhook account resolution is cached per process. Writes made here drop or update the
+# cached entry; writes made by another process show up once the entry expires.
+ACCOUNT_CONTEXT_CACHE_SIZE = int(os.getenv("ACCOUNT_CONTEXT_CACHE_SIZE", "1024"))
+ACCOUNT_CONTEXT_CACHE_TTL = int(os.getenv("ACCOUNT_CONTEXT_CACHE_TTL", "60"))
+_account_contexts = TTLCache(maxsize=ACCOUNT_CONTEXT_CACHE_SIZE, ttl=ACCOUNT_CONTEXT_CACHE_TTL)
+
+# Addresses that pushed notifications but belong to no session, so repeats skip the database.
+# Adding an account clears the entry only in the process that added it; other workers keep
+# dropping that address's notifications until the entry expires, so the TTL stays short.
+UNKNOWN_SENDER_CACHE_SIZE = int(os.getenv("UNKNOWN_SENDER_CACHE_SIZE", "10000"))
+UNKNOWN_SENDER_CACHE_TTL = int(os.getenv("UNKNOWN_SENDER_CACHE_TTL", "5"))
+_unknown_senders = TTLCache(maxsize=UNKNOWN_SENDER_CACHE_SIZE, ttl=UNKNOWN_SENDER_CACHE_TTL)
+
 # Gmail watch management
 def setup_gmail_watch_for_user(email: str, access_token: str, refresh_token: str):
     """
@@ -11,20 +26,10 @@ def setup_gmail_watch_for_user(email: str, access_token: str, refresh_token: str
     This should be called when a user first connects their Gmail
     """
     try:
-        from google.oauth2.credentials import Credentials
-        from googleapiclient.discovery import build
-        
-        # Create credentials
-        creds = Credentials(
-            token=access_token,
-            refresh_token=refresh_token,
-            token_uri="https://oauth2.googleapis.com/token",
-            client_id=None,
-            client_secret=None
-        )
+        from services.gmail_client import get_gmail_service, make_credentials
         
-        # Build Gmail service
-        service = build('gmail', 'v1', credentials=creds)
+        # Get a (cached) Gmail service for these tokens
+        service = get_gmail_service(make_credentials(access_token, refresh_token))
         
         # Get current profile to get the history ID
         profile = service.users().getProfile(userId='me').execute()
@@ -52,407 +57,638 @@ def setup_gmail_watch_for_user(email: str, access_token: str, refresh_token: str
         return None
 
 # Category and Email management
-def add_category(category):
-    db = SessionLocal()
-    db_category = DBCategory(
-        id=category.id,
-        name=category.name,
-        description=category.description,
-        session_id=category.session_id
-    )
-    db.add(db_category)
-    db.commit()
-    db.refresh(db_category)
-    db.close()
+def add_category(category, db=None):
+    with session_scope(db) as db:
+        db_category = DBCategory(
+            id=category.id,
+            name=category.name,
+            description=category.description,
+            session_id=category.session_id
+        )
+        db.add(db_category)
+        db.commit()
+        db.refresh(db_category)
+    # The category set changed, so cached classifications for this session are stale
+    from services.llm_cache import invalidate_session
+    invalidate_session(category.session_id)
+    invalidate_account_context(session_id=category.session_id)
     return db_category
 
-def get_categories_by_session(session_id: str):
-    db = SessionLocal()
-    cats = db.query(DBCategory).filter(DBCategory.session_id == session_id).all()
-    db.close()
-    return cats
-
-def save_email(email):
-    db = SessionLocal()
-    # Convert headers dict to JSON string for SQLite compatibility
-    headers_json = json.dumps(email.headers) if email.headers else None
-    db_email = DBEmail(
-        id=email.id,
-        subject=email.subject,
-        from_email=email.from_email,
-        category_id=email.category_id,
-        summary=email.summary,
-        raw=email.raw,
-        user_email=email.user_email,
-        gmail_id=email.gmail_id,
-        headers=headers_json  # Save headers as JSON string
-    )
-    db.add(db_email)
-    db.commit()
-    db.refresh(db_email)
-    db.close()
-    return db_email
-
-def get_emails_by_user_and_category(user_email: str, category_id: str):
-    db = SessionLocal()
-    # Convert string category_id to UUID for proper comparison
-    import uuid
-    try:
-        category_uuid = uuid.UUID(category_id)
-        db_emails = db.query(DBEmail).filter(DBEmail.user_email == user_email, DBEmail.category_id == category_uuid).all()
-    except ValueError:
-        # If category_id is not a valid UUID, return empty list
-        db_emails = []
-    db.close()
+def get_categories_by_session(session_id: str, db=None):
+    with session_scope(db) as db:
+        return db.query(DBCategory).filter(DBCategory.session_id == session_id).all()
+
+def _email_content(email):
+    return DBEmailContent(body=compress_body(email.raw), headers=email.headers or None)
+
+def _to_email(e):
+    """Email model for a row loaded together with its content."""
     from models.email import Email
-    return [Email(
+    return Email(
         id=e.id,
         subject=e.subject,
         from_email=e.from_email,
         category_id=e.category_id,
         summary=e.summary,
-        raw=e.raw,
+        raw=(e.content.raw if e.content is not None else None) or "",
         user_email=e.user_email,
         gmail_id=e.gmail_id,
-        headers=e.headers if isinstance(e.headers, dict) else (json.loads(e.headers) if e.headers else None)  # Handle both dict and JSON string
-    ) for e in db_emails]
+        headers=e.content.headers if e.content is not None else None,
+        created_at=e.created_at
+    )
+
+def save_email(email, db=None):
+    with session_scope(db) as db:
+        db_email = DBEmail(
+            id=email.id,
+            subject=email.subject,
+            from_email=email.from_email,
+            category_id=email.category_id,
+            summary=email.summary,
+            user_email=email.user_email,
+            gmail_id=email.gmail_id,
+            content=_email_content(email),
+            **header_columns(email.headers)
+        )
+        db.add(db_email)
+        db.commit()
+        db.refresh(db_email)
+        return db_email
+
+SAVE_EMAILS_CHUNK_SIZE = 500  # rows per multi-row INSERT, keeps bind parameters well under the driver limits
+
+def save_emails(emails, db=None) -> int:
+    """
+    Insert a batch of processed emails in one transaction, using multi-row INSERTs.
+    Rows whose (user_email, gmail_id) is already stored are skipped (ON CONFLICT DO
+    NOTHING), so retrying a batch is harmless. Bodies and headers go to email_contents
+    for the rows that were inserted. Emails without an id get one assigned in place.
+    Returns the number of rows actually inserted.
+    """
+    if not emails:
+        return 0
+    import uuid
+    from sqlalchemy.dialects.postgresql import insert
+    rows = []
+    for email in emails:
+        if email.id is None:
+            email.id = uuid.uuid4()
+        rows.append({
+            "id": email.id,
+            "subject": email.subject,
+            "from_email": email.from_email,
+            "category_id": email.category_id,
+            "summary": email.summary,
+            "user_email": email.user_email,
+            "gmail_id": email.gmail_id,
+            **header_columns(email.headers),
+        })
+    by_id = {email.id: email for email in emails}
+    with session_scope(db) as db:
+        try:
+            inserted_ids = []
+            for start in range(0, len(rows), SAVE_EMAILS_CHUNK_SIZE):
+                stmt = insert(DBEmail).values(rows[start:start + SAVE_EMAILS_CHUNK_SIZE]).on_conflict_do_nothing().returning(DBEmail.id)
+                inserted_ids.extend(row.id for row in db.execute(stmt))
+            contents = [
+                {"email_id": email_id, "body": compress_body(by_id[email_id].raw), "headers": by_id[email_id].headers or None}
+                for email_id in inserted_ids
+            ]
+            for start in range(0, len(contents), SAVE_EMAILS_CHUNK_SIZE):
+                db.execute(insert(DBEmailContent).values(contents[start:start + SAVE_EMAILS_CHUNK_SIZE]))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+    inserted = len(inserted_ids)
+    print(f"[SAVE_EMAILS] Inserted {inserted} of {len(rows)} emails")
+    return inserted
+
+def get_emails_by_user_and_category(user_email: str, category_id: str, db=None):
+    # Convert string category_id to UUID for proper comparison
+    import uuid
+    try:
+        category_uuid = uuid.UUID(category_id)
+    except ValueError:
+        # If category_id is not a valid UUID, return empty list
+        return []
+    with session_scope(db) as db:
+        db_emails = db.query(DBEmail).options(joinedload(DBEmail.content)).filter(DBEmail.user_email == user_email, DBEmail.category_id == category_uuid).all()
+    return [_to_email(e) for e in db_emails]
 
-def get_emails_by_user_email(user_email: str):
+def get_emails_by_user_email(user_email: str, db=None):
     """Get all emails for a specific user email, regardless of session"""
-    db = SessionLocal()
-    db_emails = db.query(DBEmail).filter(DBEmail.user_email == user_email).all()
-    db.close()
-    from models.email import Email
-    return [Email(
+    with session_scope(db) as db:
+        db_emails = db.query(DBEmail).options(joinedload(DBEmail.content)).filter(DBEmail.user_email == user_email).all()
+    return [_to_email(e) for e in db_emails]
+
+# Columns behind EmailSummary; the list query loads nothing else
+EMAIL_SUMMARY_COLUMNS = (DBEmail.id, DBEmail.subject, DBEmail.from_email, DBEmail.category_id, DBEmail.summary, DBEmail.user_email, DBEmail.gmail_id, DBEmail.created_at)
+
+def _session_accounts(session_id: str, user_email: str = None):
+    """Addresses of the session's accounts, or just `user_email` if it is one of them."""
+    from sqlalchemy import select
+    query = select(DBSessionAccount.email).where(DBSessionAccount.session_id == session_id)
+    if user_email:
+        query = query.where(DBSessionAccount.email == user_email)
+    return query
+
+def _orphan_filter(session_id: str, category_uuid):
+    """
+    Criteria for the orphans the session's Uncategorized category also lists: emails whose
+    category is missing or belongs to no category of this session. The first criterion does
+    not depend on the row, so for any other category Postgres skips the orphans altogether.
+    """
+    from sqlalchemy import exists
+    is_uncategorized = exists().where(
+        DBCategory.id == category_uuid,
+        DBCategory.session_id == session_id,
+        DBCategory.name == "Uncategorized"
+    )
+    in_session_category = exists().where(DBCategory.id == DBEmail.category_id, DBCategory.session_id == session_id)
+    return is_uncategorized, ~in_session_category
+
+def session_email_page_query(session_id: str, category_uuid, user_email: str = None, limit: int = 100, after=None):
+    """
+    The statement behind list_session_emails, one page plus one row. The category's own rows
+    and the orphans are separate branches of a UNION ALL, so neither needs an OR: the first walks
+    ix_emails_category_id_created_at, the second ix_emails_user_email_created_at once per account,
+    and each stops after a page, whatever the size of the mailbox.
+    """
+    from sqlalchemy import select, true, tuple_, union_all
+    newest_first = (DBEmail.created_at.desc(), DBEmail.id.desc())
+    keyset = (tuple_(DBEmail.created_at, DBEmail.id) < tuple_(*after),) if after is not None else ()
+    is_uncategorized, not_in_session_category = _orphan_filter(session_id, category_uuid)
+    own = (
+        select(*EMAIL_SUMMARY_COLUMNS)
+        .where(DBEmail.category_id == category_uuid, DBEmail.user_email.in_(_session_accounts(session_id, user_email)), *keyset)
+        .order_by(*newest_first)
+        .limit(limit + 1)
+    )
+    accounts = _session_accounts(session_id, user_email).subquery("accounts")
+    account_orphans = (
+        select(*EMAIL_SUMMARY_COLUMNS)
+        .where(DBEmail.user_email == accounts.c.email, not_in_session_category, *keyset)
+        .order_by(*newest_first)
+        .limit(limit + 1)
+        .lateral("account_orphans")
+    )
+    orphans = select(account_orphans).select_from(accounts).join(account_orphans, true()).where(is_uncategorized)
+    page = union_all(own, orphans).subquery("page")
+    return select(page).order_by(page.c.created_at.desc(), page.c.id.desc()).limit(limit + 1)
+
+def list_session_emails(session_id: str, category_id: str, user_email: str = None, limit: int = 100, after=None, db=None):
+    """
+    One page of a category's emails across every account of the session, newest first,
+    as EmailSummary: only the listed columns are loaded, bodies and headers stay in the database.
+    Uncategorized includes orphans (see _orphan_filter). `after` is the (created_at, id)
+    of the last email of the previous page. Returns (emails, key of the next page or None).
+    """
+    import uuid
+    try:
+        category_uuid = uuid.UUID(category_id)
+    except ValueError:
+        return [], None
+    with session_scope(db) as db:
+        # One extra row tells whether another page follows
+        rows = db.execute(session_email_page_query(session_id, category_uuid, user_email=user_email, limit=limit, after=after)).all()
+    next_key = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_key = (rows[-1].created_at, rows[-1].id)
+    from models.email import EmailSummary
+    return [EmailSummary(
         id=e.id,
         subject=e.subject,
         from_email=e.from_email,
         category_id=e.category_id,
         summary=e.summary,
-        raw=e.raw,
         user_email=e.user_email,
         gmail_id=e.gmail_id,
-        headers=e.headers if isinstance(e.headers, dict) else (json.loads(e.headers) if e.headers else None)
-    ) for e in db_emails]
+        created_at=e.created_at
+    ) for e in rows], next_key
+
+def session_email_count_query(session_id: str, category_uuid, user_email: str = None):
+    """The statement behind count_session_emails: the same two branches as the list, counted."""
+    from sqlalchemy import select
+    accounts = _session_accounts(session_id, user_email)
+    own = select(func.count()).select_from(DBEmail).where(DBEmail.category_id == category_uuid, DBEmail.user_email.in_(accounts))
+    orphans = select(func.count()).select_from(DBEmail).where(DBEmail.user_email.in_(accounts), *_orphan_filter(session_id, category_uuid))
+    return select(own.scalar_subquery() + orphans.scalar_subquery())
+
+def count_session_emails(session_id: str, category_id: str, user_email: str = None, db=None) -> int:
+    """Number of emails list_session_emails would page through, counted in the database."""
+    import uuid
+    try:
+        category_uuid = uuid.UUID(category_id)
+    except ValueError:
+        return 0
+    with session_scope(db) as db:
+        return db.execute(session_email_count_query(session_id, category_uuid, user_email=user_email)).scalar()
+
+def get_session_email(session_id: str, email_id, db=None):
+    """A single email with body and headers, if it belongs to one of the session's accounts."""
+    from sqlalchemy import select
+    with session_scope(db) as db:
+        session_accounts = select(DBSessionAccount.email).where(DBSessionAccount.session_id == session_id)
+        e = (
+            db.query(DBEmail)
+            .options(joinedload(DBEmail.content))
+            .filter(DBEmail.id == email_id, DBEmail.user_email.in_(session_accounts))
+            .first()
+        )
+    return _to_email(e) if e is not None else None
 
-def email_exists(user_email: str, gmail_id: str) -> bool:
-    db = SessionLocal()
-    exists = db.query(DBEmail).filter(DBEmail.user_email == user_email, DBEmail.gmail_id == gmail_id).first() is not None
+def email_exists(user_email: str, gmail_id: str, db=None) -> bool:
+    with session_scope(db) as db:
+        exists = db.query(DBEmail).filter(DBEmail.user_email == user_email, DBEmail.gmail_id == gmail_id).first() is not None
     print(f"[EMAIL_EXISTS] Checking {user_email} with gmail_id {gmail_id}: {exists}")
-    db.close()
     return exists
 
-def create_session(session_id, primary_account, accounts):
-    db = SessionLocal()
-    db_session = DBSession(id=session_id, primary_account=primary_account)
-    db.add(db_session)
-    db.commit()
+def get_existing_gmail_ids(user_email: str, gmail_ids, db=None) -> set:
+    """Return the subset of gmail_ids already stored for this user, in a single query."""
+    gmail_ids = list(gmail_ids)
+    if not gmail_ids:
+        return set()
+    with session_scope(db) as db:
+        rows = db.query(DBEmail.gmail_id).filter(
+            DBEmail.user_email == user_email,
+            DBEmail.gmail_id.in_(gmail_ids)
+        ).all()
+    existing = {row.gmail_id for row in rows}
+    print(f"[EMAIL_EXISTS] {len(existing)} of {len(gmail_ids)} gmail ids already stored for {user_email}")
+    return existing
+
+def create_session(session_id, primary_account, accounts, db=None):
+    with session_scope(db) as db:
+        db_session = DBSession(id=session_id, primary_account=primary_account)
+        db.add(db_session)
+        db.commit()
+        for acc in accounts:
+            db_account = DBSessionAccount(
+                session_id=session_id,
+                email=acc['email'],
+                access_token=acc['access_token'],
+                refresh_token=acc.get('refresh_token'),
+                history_id=acc.get('history_id')
+            )
+            db.add(db_account)
+        db.commit()
+    invalidate_account_context(session_id=session_id)
     for acc in accounts:
-        db_account = DBSessionAccount(
-            session_id=session_id,
-            email=acc['email'],
-            access_token=acc['access_token'],
-            refresh_token=acc.get('refresh_token'),
-            history_id=acc.get('history_id')
-        )
-        db.add(db_account)
-    db.commit()
-    db.close()
+        invalidate_account_context(acc['email'])
     return session_id
 
-def add_account_to_session(session_id, email, access_token, refresh_token=None, history_id=None):
-    db = SessionLocal()
-    db_account = db.query(DBSessionAccount).filter_by(session_id=session_id, email=email).first()
-    if db_account:
-        db_account.access_token = access_token
-        db_account.refresh_token = refresh_token
-        db_account.history_id = history_id
-    else:
-        db_account = DBSessionAccount(
-            session_id=session_id,
-            email=email,
-            access_token=access_token,
-            refresh_token=refresh_token,
-            history_id=history_id
-        )
-        db.add(db_account)
-    db.commit()
-    db.close()
+def add_account_to_session(session_id, email, access_token, refresh_token=None, history_id=None, db=None):
+    with session_scope(db) as db:
+        db_account = db.query(DBSessionAccount).filter_by(session_id=session_id, email=email).first()
+        is_new = db_account is None
+        if db_account:
+            db_account.access_token = access_token
+            db_account.refresh_token = refresh_token
+            db_account.history_id = history_id
+        else:
+            db_account = DBSessionAccount(
+                session_id=session_id,
+                email=email,
+                access_token=access_token,
+                refresh_token=refresh_token,
+                history_id=history_id
+            )
+            db.add(db_account)
+        db.commit()
+        if is_new:
+            # The account may bring emails filed under categories that no longer exist
+            migrate_orphaned_emails_to_uncategorized(session_id, db=db)
+    invalidate_account_context(email)
     return True
 
-def get_session(session_id):
-    db = SessionLocal()
-    session = db.query(DBSession).options(joinedload(DBSession.accounts)).filter_by(id=session_id).first()
-    db.close()
-    return session
-
-def get_session_accounts(session_id):
-    db = SessionLocal()
-    accounts = db.query(DBSessionAccount).filter_by(session_id=session_id).all()
-    db.close()
-    return accounts
-
-def set_primary_account(session_id, email):
-    db = SessionLocal()
-    session = db.query(DBSession).filter_by(id=session_id).first()
-    if session:
+def get_session(session_id, db=None):
+    with session_scope(db) as db:
+        return db.query(DBSession).options(joinedload(DBSession.accounts)).filter_by(id=session_id).first()
+
+def get_session_accounts(session_id, db=None):
+    with session_scope(db) as db:
+        return db.query(DBSessionAccount).filter_by(session_id=session_id).all()
+
+def set_primary_account(session_id, email, db=None):
+    with session_scope(db) as db:
+        session = db.query(DBSession).filter_by(id=session_id).first()
+        if not session:
+            return False
         session.primary_account = email
         db.commit()
-        db.close()
-        return True
-    db.close()
-    return False
-
-def get_primary_account(session_id):
-    db = SessionLocal()
-    session = db.query(DBSession).filter_by(id=session_id).first()
-    db.close()
-    return session.primary_account if session else None
-
-def update_account_tokens(session_id, email, access_token, refresh_token=None, history_id=None):
-    db = SessionLocal()
-    acc = db.query(DBSessionAccount).filter_by(session_id=session_id, email=email).first()
-    if acc:
-        acc.access_token = access_token
-        acc.refresh_token = refresh_token
-        acc.history_id = history_id
-        db.commit()
-    db.close()
+    invalidate_account_context(session_id=session_id)
     return True
 
-def get_account(session_id, email):
-    db = SessionLocal()
-    acc = db.query(DBSessionAccount).filter_by(session_id=session_id, email=email).first()
-    db.close()
-    return acc
+def get_primary_account(session_id, db=None):
+    with session_scope(db) as db:
+        session = db.query(DBSession).filter_by(id=session_id).first()
+        return session.primary_account if session else None
 
-# --- New utility functions for lookup by email ---
-def get_account_by_email(email):
-    db = SessionLocal()
-    acc = db.query(DBSessionAccount).filter_by(email=email).first()
-    db.close()
-    return acc
-
-def set_history_id_by_email(email, history_id):
-    db = SessionLocal()
-    acc = db.query(DBSessionAccount).filter_by(email=email).first()
-    if acc:
-        acc.history_id = history_id
-        db.commit()
-    db.close()
+def update_account_tokens(session_id, email, access_token, refresh_token=None, history_id=None, db=None):
+    with session_scope(db) as db:
+        acc = db.query(DBSessionAccount).filter_by(session_id=session_id, email=email).first()
+        if acc:
+            acc.access_token = access_token
+            acc.refresh_token = refresh_token
+            acc.history_id = history_id
+            db.commit()
+    invalidate_account_context(email)
     return True
 
-def get_history_id_by_email(email):
-    db = SessionLocal()
-    acc = db.query(DBSessionAccount).filter_by(email=email).first()
-    db.close()
-    return acc.history_id if acc else None
+def get_account(session_id, email, db=None):
+    with session_scope(db) as db:
+        return db.query(DBSessionAccount).filter_by(session_id=session_id, email=email).first()
 
-def find_session_id_by_email(email):
-    db = SessionLocal()
-    acc = db.query(DBSessionAccount).filter_by(email=email).first()
-    db.close()
-    return acc.session_id if acc else None
+# --- New utility functions for lookup by email ---
+def get_account_by_email(email, db=None):
+    with session_scope(db) as db:
+        return db.query(DBSessionAccount).filter_by(email=email).first()
 
-def get_or_create_session_by_email(email, access_token, refresh_token=None, history_id=None, force_new=False):
-    """Get existing session for any account with this email, or create new one. Returns session_id. If force_new, always create a new session."""
-    db = SessionLocal()
-    from database.models import Session as DBSession, SessionAccount as DBSessionAccount
-    import uuid
-    if not force_new:
-        # Find any session where this email is present (not just primary)
+def set_history_id_by_email(email, history_id, db=None):
+    with session_scope(db) as db:
         acc = db.query(DBSessionAccount).filter_by(email=email).first()
         if acc:
-            session_id = acc.session_id
-            # Update tokens if needed
-            acc.access_token = access_token
-            acc.refresh_token = refresh_token
             acc.history_id = history_id
             db.commit()
-            db.close()
-            return session_id
-    # Create new session
-    session_id = str(uuid.uuid4())
-    session = DBSession(id=session_id, primary_account=email)
-    db.add(session)
-    db.commit()
-    db_account = DBSessionAccount(
-        session_id=session_id,
-        email=email,
-        access_token=access_token,
-        refresh_token=refresh_token,
-        history_id=history_id
+    # Written after every processed page, so the cached context is updated rather than dropped
+    context = _account_contexts.get(email)
+    if context is not None:
+        _account_contexts.set(email, context.model_copy(update={"history_id": history_id}))
+    return True
+
+def get_history_id_by_email(email, db=None):
+    with session_scope(db) as db:
+        acc = db.query(DBSessionAccount).filter_by(email=email).first()
+        return acc.history_id if acc else None
+
+# --- Full resync progress ---
+def get_mailbox_resync(email, db=None):
+    with session_scope(db) as db:
+        return db.query(DBMailboxResync).filter_by(email=email).first()
+
+def start_mailbox_resync(email, history_id, db=None):
+    """Begin (or restart) a resync from the first page, remembering the history id to resume from afterwards."""
+    with session_scope(db) as db:
+        resync = db.query(DBMailboxResync).filter_by(email=email).first()
+        if resync is None:
+            resync = DBMailboxResync(email=email)
+            db.add(resync)
+        resync.status = "running"
+        resync.history_id = history_id
+        resync.page_token = None
+        resync.scanned = resync.skipped = resync.processed = 0
+        resync.last_error = None
+        resync.started_at = func.now()
+        db.commit()
+        db.refresh(resync)
+        return resync
+
+def update_mailbox_resync(email, page_token=None, scanned=0, skipped=0, processed=0, status=None, error=None, db=None):
+    """Store the page to resume from and add to the progress counters."""
+    with session_scope(db) as db:
+        resync = db.query(DBMailboxResync).filter_by(email=email).first()
+        if resync is None:
+            return None
+        resync.page_token = page_token
+        resync.scanned += scanned
+        resync.skipped += skipped
+        resync.processed += processed
+        if status:
+            resync.status = status
+        resync.last_error = error
+        db.commit()
+        db.refresh(resync)
+        return resync
+
+# --- Webhook account resolution ---
+def resolve_account_context(email, db=None):
+    """Load the account, its session's primary account and the session's categories with one query."""
+    from models.category import Category
+    from models.user import AccountContext
+    with session_scope(db) as db:
+        rows = (
+            db.query(DBSessionAccount, DBSession.primary_account, DBCategory)
+            .outerjoin(DBSession, DBSession.id == DBSessionAccount.session_id)
+            .outerjoin(DBCategory, DBCategory.session_id == DBSessionAccount.session_id)
+            .filter(DBSessionAccount.email == email)
+            .all()
+        )
+    if not rows:
+        return None
+    # An address linked to several sessions resolves to one of them, like find_session_id_by_email
+    acc, primary_account, _ = rows[0]
+    return AccountContext(
+        email=acc.email,
+        session_id=acc.session_id,
+        access_token=acc.access_token,
+        refresh_token=acc.refresh_token,
+        history_id=acc.history_id,
+        primary_account=primary_account,
+        categories=[
+            Category(id=cat.id, name=cat.name, description=cat.description, session_id=cat.session_id)
+            for a, _, cat in rows if cat is not None and a.id == acc.id
+        ],
     )
-    db.add(db_account)
-    db.commit()
-    db.close()
+
+def get_account_context(email, db=None):
+    """resolve_account_context through the per-process cache. Unknown addresses are remembered in the negative cache."""
+    context = _account_contexts.get(email)
+    if context is None:
+        context = resolve_account_context(email, db=db)
+        if context is not None:
+            _account_contexts.set(email, context)
+        else:
+            _unknown_senders.set(email, True)
+    return context
+
+def is_unknown_sender(email) -> bool:
+    """True if a recent lookup found no account for this address. Memory only."""
+    return _unknown_senders.get(email, False)
+
+def invalidate_account_context(email=None, session_id=None):
+    """Drop cached contexts for an address, or for every account of a session."""
+    if email is not None:
+        _account_contexts.delete(email)
+        _unknown_senders.delete(email)
+    if session_id is not None:
+        _account_contexts.delete_where(lambda key, context: context.session_id == session_id)
+
+def account_context_stats() -> dict:
+    return _account_contexts.stats()
+
+def unknown_sender_stats() -> dict:
+    return _unknown_senders.stats()
+
+def find_session_id_by_email(email, db=None):
+    with session_scope(db) as db:
+        acc = db.query(DBSessionAccount).filter_by(email=email).first()
+        return acc.session_id if acc else None
+
+def get_or_create_session_by_email(email, access_token, refresh_token=None, history_id=None, force_new=False, db=None):
+    """Get existing session for any account with this email, or create new one. Returns session_id. If force_new, always create a new session."""
+    import uuid
+    with session_scope(db) as db:
+        if not force_new:
+            # Find any session where this email is present (not just primary)
+            acc = db.query(DBSessionAccount).filter_by(email=email).first()
+            if acc:
+                session_id = acc.session_id
+                # Update tokens if needed
+                acc.access_token = access_token
+                acc.refresh_token = refresh_token
+                acc.history_id = history_id
+                db.commit()
+                invalidate_account_context(email)
+                return session_id
+        # Create new session
+        session_id = str(uuid.uuid4())
+        session = DBSession(id=session_id, primary_account=email)
+        db.add(session)
+        db.commit()
+        db_account = DBSessionAccount(
+            session_id=session_id,
+            email=email,
+            access_token=access_token,
+            refresh_token=refresh_token,
+            history_id=history_id
+        )
+        db.add(db_account)
+        db.commit()
+    invalidate_account_context(email)
     return session_id
 
-def remove_account_from_session(session_id, email):
+def remove_account_from_session(session_id, email, db=None):
     """Remove an account from a session. Returns True if successful, False if account not found."""
-    db = SessionLocal()
-    
-    # Check if this is the last account in the session
-    account_count = db.query(DBSessionAccount).filter_by(session_id=session_id).count()
-    if account_count <= 1:
-        db.close()
-        return False, "Cannot remove the last account from a session"
-    
-    # Find and remove the account
-    account = db.query(DBSessionAccount).filter_by(session_id=session_id, email=email).first()
-    if not account:
-        db.close()
-        return False, "Account not found in session"
-    
-    # If this was the primary account, set a new primary account
-    session = db.query(DBSession).filter_by(id=session_id).first()
-    if session and session.primary_account == email:
-        # Find another account to set as primary
-        other_account = db.query(DBSessionAccount).filter_by(session_id=session_id).filter(DBSessionAccount.email != email).first()
-        if other_account:
-            session.primary_account = other_account.email
-    
-    # Remove the account
-    db.delete(account)
-    db.commit()
-    db.close()
-    
-    return True, "Account removed successfully"
-
-def get_or_create_uncategorized_category(user_email: str, session_id: str):
-    """Get existing "Uncategorized" category for session or create new one. Returns the category."""
-    db = SessionLocal()
-    
-    # First, try to find an existing "Uncategorized" category for this session
-    from database.models import Category as DBCategory
-    
-    # Look for an "Uncategorized" category in this session
-    existing_uncategorized = db.query(DBCategory).filter(
-        DBCategory.session_id == session_id,
-        DBCategory.name == "Uncategorized"
-    ).first()
-    
-    if existing_uncategorized:
-        # Found existing "Uncategorized" category in this session
-        print(f"[UNCATEGORIZED] Found existing category for session {session_id}: {existing_uncategorized.id}")
+    with session_scope(db) as db:
+        # Check if this is the last account in the session
+        account_count = db.query(DBSessionAccount).filter_by(session_id=session_id).count()
+        if account_count <= 1:
+            return False, "Cannot remove the last account from a session"
         
-        # Get the values before closing the session
-        category_id = existing_uncategorized.id
-        category_name = existing_uncategorized.name
-        category_description = existing_uncategorized.description
-        db.close()
+        # Find and remove the account
+        account = db.query(DBSessionAccount).filter_by(session_id=session_id, email=email).first()
+        if not account:
+            return False, "Account not found in session"
         
-        # Migrate any orphaned emails to this category
-        migrate_orphaned_emails_to_uncategorized(session_id)
+        # If this was the primary account, set a new primary account
+        session = db.query(DBSession).filter_by(id=session_id).first()
+        if session and session.primary_account == email:
+            # Find another account to set as primary
+            other_account = db.query(DBSessionAccount).filter_by(session_id=session_id).filter(DBSessionAccount.email != email).first()
+            if other_account:
+                session.primary_account = other_account.email
         
-        from models.category import Category
-        return Category(
-            id=category_id,
-            name=category_name,
-            description=category_description,
-            session_id=session_id
-        )
-    
-    # No existing "Uncategorized" category found in this session, create a new one
-    import uuid
-    uncategorized_category = DBCategory(
-        id=uuid.uuid4(),
-        name="Uncategorized",
-        description="Emails that don't fit other categories",
-        session_id=session_id
-    )
-    db.add(uncategorized_category)
-    db.commit()
-    
-    print(f"[UNCATEGORIZED] Created new category for session {session_id}: {uncategorized_category.id}")
-    
-    # Get the values before closing the session
-    category_id = uncategorized_category.id
-    category_name = uncategorized_category.name
-    category_description = uncategorized_category.description
-    db.close()
-    
-    # Migrate any orphaned emails to this new category
-    migrate_orphaned_emails_to_uncategorized(session_id)
+        # Remove the account
+        db.delete(account)
+        db.commit()
+    invalidate_account_context(session_id=session_id)
     
-    from models.category import Category
-    return Category(
-        id=category_id,
-        name=category_name,
-        description=category_description,
-        session_id=session_id
-    )
+    return True, "Account removed successfully"
 
-def migrate_orphaned_emails_to_uncategorized(session_id: str):
-    """Migrate emails with invalid category_ids to the session's Uncategorized category"""
-    db = SessionLocal()
-    try:
-        from database.models import Category as DBCategory, Email as DBEmail
-        
-        # Get the Uncategorized category for this session
-        uncategorized_category = db.query(DBCategory).filter(
+def get_or_create_uncategorized_category(user_email: str, session_id: str, db=None):
+    """Get existing "Uncategorized" category for session or create new one. Returns the category."""
+    from models.category import Category
+    with session_scope(db) as db:
+        # Look for an "Uncategorized" category in this session
+        existing_uncategorized = db.query(DBCategory).filter(
             DBCategory.session_id == session_id,
             DBCategory.name == "Uncategorized"
         ).first()
         
-        if not uncategorized_category:
-            print(f"[MIGRATION] No Uncategorized category found for session {session_id}")
-            return
-        
-        # Get all valid category IDs for this session
-        valid_category_ids = {str(cat.id) for cat in db.query(DBCategory).filter(DBCategory.session_id == session_id).all()}
-        
-        # Find emails that have category_ids that don't exist in this session
-        orphaned_emails = db.query(DBEmail).filter(
-            DBEmail.category_id.notin_(valid_category_ids)
-        ).all()
-        
-        if orphaned_emails:
-            print(f"[MIGRATION] Found {len(orphaned_emails)} orphaned emails to migrate")
-            for email in orphaned_emails:
-                email.category_id = uncategorized_category.id
-                print(f"[MIGRATION] Migrated email {email.id} to Uncategorized category")
-            
-            db.commit()
-            print(f"[MIGRATION] Successfully migrated {len(orphaned_emails)} emails")
+        if existing_uncategorized:
+            # Found existing "Uncategorized" category in this session
+            print(f"[UNCATEGORIZED] Found existing category for session {session_id}: {existing_uncategorized.id}")
+            category = Category(
+                id=existing_uncategorized.id,
+                name=existing_uncategorized.name,
+                description=existing_uncategorized.description,
+                session_id=session_id
+            )
         else:
-            print(f"[MIGRATION] No orphaned emails found")
-            
-    except Exception as e:
-        print(f"[MIGRATION] Error migrating orphaned emails: {e}")
-        db.rollback()
-    finally:
-        db.close()
+            # No existing "Uncategorized" category found in this session, create a new one
+            import uuid
+            uncategorized_category = DBCategory(
+                id=uuid.uuid4(),
+                name="Uncategorized",
+                description="Emails that don't fit other categories",
+                session_id=session_id
+            )
+            db.add(uncategorized_category)
+            db.commit()
+            invalidate_account_context(session_id=session_id)
+            print(f"[UNCATEGORIZED] Created new category for session {session_id}: {uncategorized_category.id}")
+            category = Category(
+                id=uncategorized_category.id,
+                name=uncategorized_category.name,
+                description=uncategorized_category.description,
+                session_id=session_id
+            )
+            # Emails left without a category now have somewhere to go
+            migrate_orphaned_emails_to_uncategorized(session_id, db=db)
+    return category
+
+def migrate_orphaned_emails_to_uncategorized(session_id: str, db=None) -> int:
+    """
+    Move the session's emails whose category no longer exists (or that have none) to its
+    Uncategorized category, with one UPDATE scoped to the session's accounts. Returns the
+    number of emails moved. Only needed when the session's categories or accounts change.
+    """
+    from sqlalchemy import exists, select, update
+    with session_scope(db) as db:
+        try:
+            uncategorized_id = db.query(DBCategory.id).filter(
+                DBCategory.session_id == session_id,
+                DBCategory.name == "Uncategorized"
+            ).limit(1).scalar()
+            if uncategorized_id is None:
+                print(f"[MIGRATION] No Uncategorized category found for session {session_id}")
+                return 0
+
+            session_accounts = select(DBSessionAccount.email).where(DBSessionAccount.session_id == session_id)
+            stmt = (
+                update(DBEmail)
+                .where(DBEmail.user_email.in_(session_accounts), ~exists().where(DBCategory.id == DBEmail.category_id))
+                .values(category_id=uncategorized_id)
+                .execution_options(synchronize_session=False)
+            )
+            moved = db.execute(stmt).rowcount
+            db.commit()
+            print(f"[MIGRATION] Migrated {moved} orphaned emails to Uncategorized for session {session_id}")
+            return moved
+        except Exception as e:
+            print(f"[MIGRATION] Error migrating orphaned emails: {e}")
+            db.rollback()
+            return 0
 
-def delete_session(session_id):
+def delete_session(session_id, db=None):
     """Delete a session and its associated data (accounts, categories) but preserve emails"""
-    db = SessionLocal()
-    try:
-        # Get the session and its accounts
-        session = db.query(DBSession).filter_by(id=session_id).first()
-        if not session:
+    with session_scope(db) as db:
+        try:
+            # Get the session and its accounts
+            session = db.query(DBSession).filter_by(id=session_id).first()
+            if not session:
+                return False
+            
+            # Get all accounts in this session
+            accounts = db.query(DBSessionAccount).filter_by(session_id=session_id).all()
+            account_emails = [acc.email for acc in accounts]
+            
+            # Delete categories for this session (emails will become orphaned but that's okay)
+            categories = db.query(DBCategory).filter_by(session_id=session_id).all()
+            for category in categories:
+                db.delete(category)
+            
+            # Delete the session (this will cascade to accounts due to foreign key)
+            db.delete(session)
+            db.commit()
+            
+            invalidate_account_context(session_id=session_id)
+            print(f"Deleted session {session_id} with accounts: {account_emails}")
+            print(f"Emails for these accounts are preserved in the database")
+            return True
+        except Exception as e:
+            print(f"Error deleting session {session_id}: {e}")
+            db.rollback()
             return False
-        
-        # Get all accounts in this session
-        accounts = db.query(DBSessionAccount).filter_by(session_id=session_id).all()
-        account_emails = [acc.email for acc in accounts]
-        
-        # Delete categories for this session (emails will become orphaned but that's okay)
-        from database.models import Category as DBCategory
-        categories = db.query(DBCategory).filter_by(session_id=session_id).all()
-        for category in categories:
-            db.delete(category)
-        
-        # Delete the session (this will cascade to accounts due to foreign key)
-        db.delete(session)
-        db.commit()
-        
-        print(f"Deleted session {session_id} with accounts: {account_emails}")
-        print(f"Emails for these accounts are preserved in the database")
-        return True
-    except Exception as e:
-        print(f"Error deleting session {session_id}: {e}")
-        db.rollback()
-        return False
-    finally:
-        db.close() 
\ No newline at end of file
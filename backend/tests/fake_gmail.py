@@ -0,0 +1,205 @@
+"""Minimal in-process fake of the Gmail REST API used by the pipeline tests.
+
+It serves the handful of endpoints the processor touches (messages.get/list/modify,
+messages.batchModify, history.list, getProfile and the multipart batch endpoint) from a dict of canned messages and records every HTTP
+round trip so tests can assert how many requests the client really made. messages.get honours
+format=metadata by leaving out the body parts.
+"""
+import base64
+import json
+import threading
+import urllib.parse
+from email.parser import Parser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httplib2
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+
+
+def make_message(gmail_id, subject='Subject', body='Body', label_ids=None, attachment_size=0):
+    parts = [
+        {'mimeType': 'text/plain', 'body': {'data': base64.urlsafe_b64encode(body.encode()).decode()}},
+    ]
+    if attachment_size:
+        parts.append({
+            'mimeType': 'application/pdf',
+            'filename': 'attachment.pdf',
+            'body': {'data': base64.urlsafe_b64encode(b'x' * attachment_size).decode()},
+        })
+    return {
+        'id': gmail_id,
+        'labelIds': label_ids if label_ids is not None else ['INBOX'],
+        'snippet': body[:50],
+        'payload': {
+            'headers': [
+                {'name': 'Subject', 'value': subject},
+                {'name': 'From', 'value': 'sender@example.com'},
+                {'name': 'To', 'value': 'a@b.com'},
+            ],
+            'parts': parts,
+        },
+        'sizeEstimate': len(body) + attachment_size,
+    }
+
+
+class FakeGmail:
+    def __init__(self):
+        self.messages = {}
+        self.requests = []  # (method, path) of every HTTP round trip
+        self.calls = []  # (method, path) of every API call, batched or not
+        self.failures = {}  # gmail_id -> list of statuses to return before succeeding
+        self.modify_failures = {}  # gmail_id -> list of statuses for messages.modify
+        self.batch_modify_failures = []  # statuses for successive messages.batchModify calls
+        self.archived = []  # gmail ids that had INBOX removed, in order
+        self.history_id = '500'  # reported by getProfile
+        self.history_expired = False  # history.list answers 404 like an expired startHistoryId
+        self.history = []  # (record id, gmail_id) for messages added through deliver()
+        self._lock = threading.Lock()
+        self._server = None
+
+    # --- API surface -------------------------------------------------------
+    def handle(self, method, path, query, body):
+        with self._lock:
+            self.calls.append((method, path))
+        parts = path.strip('/').split('/')
+        if parts == ['gmail', 'v1', 'users', 'me', 'profile'] and method == 'GET':
+            return 200, {'emailAddress': 'me@example.com', 'historyId': self.history_id}
+        if parts == ['gmail', 'v1', 'users', 'me', 'history'] and method == 'GET':
+            if self.history_expired:
+                return 404, {'error': {'code': 404, 'message': 'Requested entity was not found.'}}
+            start = int(query['startHistoryId'][0])
+            with self._lock:
+                records = [
+                    {'id': str(record_id), 'messagesAdded': [{'message': {'id': gmail_id}}]}
+                    for record_id, gmail_id in self.history if record_id > start
+                ]
+                return 200, {'history': records, 'historyId': self.history_id}
+        if parts == ['gmail', 'v1', 'users', 'me', 'messages'] and method == 'GET':
+            # messages.list over inbox messages; the page token is just the offset
+            inbox = [m['id'] for m in self.messages.values() if 'INBOX' in m.get('labelIds', [])]
+            offset = int(query.get('pageToken', ['0'])[0])
+            size = int(query.get('maxResults', ['100'])[0])
+            response = {'messages': [{'id': i} for i in inbox[offset:offset + size]]}
+            if offset + size < len(inbox):
+                response['nextPageToken'] = str(offset + size)
+            return 200, response
+        if parts[:4] == ['gmail', 'v1', 'users', 'me'] and len(parts) == 6 and parts[4] == 'messages' and method == 'GET':
+            gmail_id = parts[5]
+            with self._lock:
+                queued = self.failures.get(gmail_id)
+                if queued:
+                    status = queued.pop(0)
+                    return status, {'error': {'code': status, 'message': 'injected failure'}}
+            if gmail_id not in self.messages:
+                return 404, {'error': {'code': 404, 'message': 'Requested entity was not found.'}}
+            message = self.messages[gmail_id]
+            if query.get('format') == ['metadata']:
+                # Like Gmail, the metadata format leaves out every body part
+                message = {**message, 'payload': {'headers': message['payload'].get('headers', [])}}
+            return 200, message
+        if parts[:5] == ['gmail', 'v1', 'users', 'me', 'messages'] and parts[5:] == ['batchModify'] and method == 'POST':
+            with self._lock:
+                if self.batch_modify_failures:
+                    status = self.batch_modify_failures.pop(0)
+                    return status, {'error': {'code': status, 'message': 'injected failure'}}
+                self.archived.extend(body['ids'])
+            return 204, None
+        if parts[:5] == ['gmail', 'v1', 'users', 'me', 'messages'] and parts[6:] == ['modify'] and method == 'POST':
+            gmail_id = parts[5]
+            with self._lock:
+                queued = self.modify_failures.get(gmail_id)
+                if queued:
+                    status = queued.pop(0)
+                    return status, {'error': {'code': status, 'message': 'injected failure'}}
+            if gmail_id not in self.messages:
+                return 404, {'error': {'code': 404, 'message': 'Requested entity was not found.'}}
+            with self._lock:
+                self.archived.append(gmail_id)
+            return 200, {'id': gmail_id}
+        return 404, {'error': {'code': 404, 'message': f'Unknown path {path}'}}
+
+    def deliver(self, message):
+        """Add a message to the mailbox the way new mail arrives: with a history record. Returns the new historyId."""
+        with self._lock:
+            self.messages[message['id']] = message
+            self.history_id = str(int(self.history_id) + 1)
+            self.history.append((int(self.history_id), message['id']))
+            return self.history_id
+
+    def handle_batch(self, content_type, body):
+        message = Parser().parsestr(f'Content-Type: {content_type}\r\n\r\n' + body)
+        boundary = 'fake_batch_boundary'
+        out = []
+        for part in message.get_payload():
+            content_id = part['Content-ID'][1:-1]
+            request_line, _, rest = part.get_payload().partition('\r\n')
+            if not rest:
+                request_line, _, rest = part.get_payload().partition('\n')
+            method, target, _ = request_line.split(' ', 2)
+            url = urllib.parse.urlsplit(target)
+            status, payload = self.handle(method, url.path, urllib.parse.parse_qs(url.query), None)
+            out.append(
+                f'--{boundary}\r\n'
+                'Content-Type: application/http\r\n'
+                f'Content-ID: <response-{content_id}>\r\n\r\n'
+                f'HTTP/1.1 {status} {"OK" if status < 300 else "Error"}\r\n'
+                'Content-Type: application/json; charset=UTF-8\r\n\r\n'
+                f'{json.dumps(payload)}\r\n'
+            )
+        out.append(f'--{boundary}--\r\n')
+        return f'multipart/mixed; boundary={boundary}', ''.join(out)
+
+    # --- server lifecycle --------------------------------------------------
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}/'
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _respond(self, status, content_type, text):
+                data = text.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _dispatch(self, method):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length).decode('utf-8') if length else ''
+                url = urllib.parse.urlsplit(self.path)
+                with fake._lock:
+                    fake.requests.append((method, url.path))
+                if url.path == '/batch':
+                    content_type, text = fake.handle_batch(self.headers['Content-Type'], body)
+                    self._respond(200, content_type, text)
+                    return
+                status, payload = fake.handle(method, url.path, urllib.parse.parse_qs(url.query), json.loads(body) if body else None)
+                self._respond(status, 'application/json', json.dumps(payload) if payload is not None else '')
+
+            def do_GET(self):
+                self._dispatch('GET')
+
+            def do_POST(self):
+                self._dispatch('POST')
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def service(self):
+        """Build a real googleapiclient Gmail service that talks to this fake."""
+        doc = json.loads(get_static_doc('gmail', 'v1'))
+        doc['rootUrl'] = self.url
+        return build_from_document(doc, http=httplib2.Http())
@@ -0,0 +1,56 @@
+import threading
+import uuid
+from sqlalchemy import text
+from backend.main import app  # noqa: F401  creates the tables
+from backend.services import account_lock
+from database.db import engine
+
+
+def key():
+    return f'{uuid.uuid4().hex}@example.com'
+
+def test_single_flight_runs_once_when_uncontended():
+    k = key()
+    assert account_lock.single_flight(k, lambda: 'done') == ['done']
+    assert account_lock.single_flight(k, lambda: 'again') == ['again']
+    assert k not in account_lock._local_locks
+
+def test_late_caller_marks_dirty_and_holder_reruns():
+    k = key()
+    started = threading.Event()
+    release = threading.Event()
+    passes = []
+
+    def slow():
+        passes.append(len(passes))
+        if len(passes) == 1:
+            started.set()
+            release.wait(5)
+        return len(passes)
+
+    results = {}
+    holder = threading.Thread(target=lambda: results.setdefault('holder', account_lock.single_flight(k, slow)))
+    holder.start()
+    assert started.wait(5)
+    assert k in account_lock._local_locks
+    # two late arrivals while the first pass runs: neither runs, one extra pass covers both
+    assert account_lock.single_flight(k, lambda: 'late') is None
+    assert account_lock.single_flight(k, lambda: 'later') is None
+    release.set()
+    holder.join(5)
+    assert results['holder'] == [1, 2]
+    # the per-key lock goes away with the run
+    assert k not in account_lock._local_locks
+
+def test_advisory_lock_held_by_another_process():
+    k = key()
+    with engine.connect() as other:
+        assert other.execute(text("SELECT pg_try_advisory_lock(:ns, hashtext(:k))"), {'ns': account_lock.ADVISORY_LOCK_NAMESPACE, 'k': k}).scalar()
+        ran = []
+        assert account_lock.single_flight(k, lambda: ran.append(1)) is None
+        assert ran == []
+        other.execute(text("SELECT pg_advisory_unlock(:ns, hashtext(:k))"), {'ns': account_lock.ADVISORY_LOCK_NAMESPACE, 'k': k})
+        other.commit()
+    # the dirty flag left for the other holder is visible across processes
+    assert account_lock.take_dirty(k)
+    assert not account_lock.take_dirty(k)
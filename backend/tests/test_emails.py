@@ -9,25 +9,34 @@ import json
 def client():
     return TestClient(app)
 
+def summary_row(user_email='a@b.com'):
+    from backend.models.email import EmailSummary
+    return EmailSummary(id=uuid.uuid4(), subject='Sub', from_email='x@y.com', category_id=uuid.uuid4(), summary='sum', user_email=user_email, gmail_id='gid')
+
 def test_list_emails_for_account(client):
-    with patch('backend.services.session_db.get_session_accounts') as mock_acc, \
-         patch('backend.services.session_db.get_emails_by_user_and_category') as mock_get:
-        mock_acc.return_value = [MagicMock(email='a@b.com')]
-        mock_get.return_value = [MagicMock(id=uuid.uuid4(), subject='Sub', from_email='a@b.com', category_id=uuid.uuid4(), summary='sum', raw='raw', user_email='a@b.com', gmail_id='gid')]
+    with patch('routes.emails.list_session_emails', return_value=([summary_row()], None)) as mock_list:
         resp = client.get('/emails/?session_id=sessid&category_id=catid&user_email=a@b.com')
         assert resp.status_code == 200
-        data = resp.json()
-        assert isinstance(data, list)
+        assert [e['subject'] for e in resp.json()] == ['Sub']
+        assert 'X-Next-Cursor' not in resp.headers
+    args, kwargs = mock_list.call_args
+    assert args == ('sessid', 'catid')
+    assert kwargs['user_email'] == 'a@b.com'
+    assert kwargs['after'] is None
 
 def test_list_emails_all_accounts(client):
-    with patch('backend.services.session_db.get_session_accounts') as mock_acc, \
-         patch('backend.services.session_db.get_emails_by_user_and_category') as mock_get:
-        mock_acc.return_value = [MagicMock(email='a@b.com'), MagicMock(email='b@b.com')]
-        mock_get.side_effect = [[MagicMock(id=uuid.uuid4(), subject='S1', from_email='a@b.com', category_id=uuid.uuid4(), summary='s', raw='r', user_email='a@b.com', gmail_id='g')], []]
-        resp = client.get('/emails/?session_id=sessid&category_id=catid')
+    from datetime import datetime, timezone
+    next_key = (datetime(2025, 7, 1, tzinfo=timezone.utc), uuid.uuid4())
+    rows = [summary_row('a@b.com'), summary_row('b@b.com')]
+    with patch('routes.emails.list_session_emails', side_effect=[(rows, next_key), ([], None)]) as mock_list:
+        resp = client.get('/emails/?session_id=sessid&category_id=catid&limit=2')
         assert resp.status_code == 200
-        data = resp.json()
-        assert isinstance(data, list)
+        assert [e['user_email'] for e in resp.json()] == ['a@b.com', 'b@b.com']
+        cursor = resp.headers['X-Next-Cursor']
+        assert client.get(f'/emails/?session_id=sessid&category_id=catid&limit=2&cursor={cursor}').json() == []
+    first, second = mock_list.call_args_list
+    assert first.kwargs['user_email'] is None and first.kwargs['limit'] == 2
+    assert second.kwargs['after'] == next_key
 
 def test_delete_emails(client):
     with patch('backend.database.db.SessionLocal') as mock_db:
@@ -53,4 +62,88 @@ def test_ai_unsubscribe_from_links(client):
     with patch('backend.routes.emails.batch_unsubscribe_worker', return_value=[{"success": True, "link": "http://unsub"}]):
         resp = client.post('/emails/unsubscribe/ai', json={"unsubscribe_links": ["http://unsub"], "user_email": "a@b.com"})
         assert resp.status_code == 200
-        assert resp.json()['results'][0]['success'] in [True, 'True'] 
\ No newline at end of file
+        assert resp.json()['results'][0]['success'] in [True, 'True'] 
+def test_list_emails_single_query_keyset_pages(client):
+    from sqlalchemy import event
+    from services import session_db
+    from models.category import Category
+    from models.email import Email
+    session_id = f'sess-{uuid.uuid4()}'
+    accounts = [f'{uuid.uuid4().hex}@example.com' for _ in range(2)]
+    session_db.create_session(session_id, accounts[0], [{'email': a, 'access_token': 'tok'} for a in accounts])
+    work = Category(id=uuid.uuid4(), name='Work', description='d', session_id=session_id)
+    uncategorized = Category(id=uuid.uuid4(), name='Uncategorized', description='d', session_id=session_id)
+    foreign = Category(id=uuid.uuid4(), name='Old', description='d', session_id=f'sess-{uuid.uuid4()}')
+    for category in (work, uncategorized, foreign):
+        session_db.add_category(category)
+
+    def email(account, category_id, n):
+        return Email(subject=f'S{n}', from_email='x@y.com', category_id=category_id, summary='s', raw='r', user_email=account, gmail_id=f'g{n}')
+    # inserted in arrival order, one row per statement
+    for n in range(5):
+        session_db.save_emails([email(accounts[n % 2], work.id, n)])
+    session_db.save_emails([email(accounts[0], foreign.id, 10), email(accounts[1], None, 11), email(accounts[0], uncategorized.id, 12)])
+    session_db.save_emails([email('outsider@example.com', work.id, 20)])
+
+    engine = session_db.SessionLocal.kw['bind']
+    selects = []
+
+    def listener(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            selects.append(statement)
+
+    subjects, cursor = [], None
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        while True:
+            url = f'/emails/?session_id={session_id}&category_id={work.id}&limit=2' + (f'&cursor={cursor}' if cursor else '')
+            resp = client.get(url)
+            assert resp.status_code == 200
+            assert len(resp.json()) <= 2
+            subjects.extend(e['subject'] for e in resp.json())
+            cursor = resp.headers.get('X-Next-Cursor')
+            if not cursor:
+                break
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+    assert subjects == ['S4', 'S3', 'S2', 'S1', 'S0']
+    assert len(selects) == 3  # one query per page
+    assert not any('email_contents' in statement for statement in selects)
+
+    resp = client.get(f'/emails/?session_id={session_id}&category_id={uncategorized.id}')
+    assert sorted(e['subject'] for e in resp.json()) == ['S10', 'S11', 'S12']
+    resp = client.get(f'/emails/?session_id={session_id}&category_id={uncategorized.id}&user_email={accounts[0]}')
+    assert sorted(e['subject'] for e in resp.json()) == ['S10', 'S12']
+    resp = client.get(f'/emails/?session_id={session_id}&category_id={work.id}&user_email=outsider@example.com')
+    assert resp.json() == []
+    assert client.get(f'/emails/?session_id={session_id}&category_id={work.id}&cursor=bogus').status_code == 400
+
+    # counts follow the same filters without paging
+    def count(category_id, account=''):
+        return client.get(f'/emails/count?session_id={session_id}&category_id={category_id}&user_email={account}').json()['count']
+    assert count(work.id) == 5
+    assert count(uncategorized.id) == 3
+    assert count(uncategorized.id, accounts[0]) == 2
+    assert count('not-a-uuid') == 0
+
+def test_list_emails_leaves_out_body_detail_route_returns_it(client):
+    from services import session_db
+    from models.category import Category
+    from models.email import Email
+    session_id = f'sess-{uuid.uuid4()}'
+    account = f'{uuid.uuid4().hex}@example.com'
+    session_db.create_session(session_id, account, [{'email': account, 'access_token': 'tok'}])
+    category = Category(id=uuid.uuid4(), name='Work', description='d', session_id=session_id)
+    session_db.add_category(category)
+    email = Email(subject='S', from_email='x@y.com', category_id=category.id, summary='sum', raw='long body', user_email=account, gmail_id='g1', headers={'Subject': 'S'})
+    session_db.save_emails([email])
+
+    listed = client.get(f'/emails/?session_id={session_id}&category_id={category.id}').json()
+    assert [e['summary'] for e in listed] == ['sum']
+    assert 'raw' not in listed[0] and 'headers' not in listed[0]
+
+    detail = client.get(f'/emails/{email.id}?session_id={session_id}')
+    assert detail.status_code == 200
+    assert (detail.json()['raw'], detail.json()['headers']) == ('long body', {'Subject': 'S'})
+    # only the accounts of the session can read it
+    assert client.get(f'/emails/{email.id}?session_id=sess-other').status_code == 404
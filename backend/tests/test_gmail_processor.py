@@ -5,6 +5,57 @@ from backend.models.user import UserToken
 from backend.models.category import Category
 import uuid
 
+@pytest.fixture(autouse=True)
+def llm_cache():
+    from backend.services.llm_cache import MemoryLLMCache
+    cache = MemoryLLMCache()
+    with patch('backend.services.gmail_processor.get_llm_cache', return_value=cache):
+        yield cache
+
+@pytest.fixture(autouse=True)
+def no_account_lock():
+    """The single-flight guard needs Postgres; it has its own tests."""
+    with patch('backend.services.gmail_processor.single_flight', side_effect=lambda key, fn: [fn()]):
+        yield
+
+@pytest.fixture(autouse=True)
+def resync_state():
+    """Keeps resync progress in memory so these tests don't need the database."""
+    from types import SimpleNamespace
+    state = {}
+
+    def start(email, history_id):
+        state[email] = SimpleNamespace(email=email, status='running', history_id=history_id, page_token=None,
+                                       scanned=0, skipped=0, processed=0, last_error=None)
+        return state[email]
+
+    def update(email, page_token=None, scanned=0, skipped=0, processed=0, status=None, error=None):
+        resync = state[email]
+        resync.page_token = page_token
+        resync.scanned += scanned
+        resync.skipped += skipped
+        resync.processed += processed
+        resync.status = status or resync.status
+        resync.last_error = error
+        return resync
+
+    with patch('backend.services.gmail_processor.get_mailbox_resync', side_effect=state.get), \
+         patch('backend.services.gmail_processor.start_mailbox_resync', side_effect=start), \
+         patch('backend.services.gmail_processor.update_mailbox_resync', side_effect=update):
+        yield state
+
+def history_pages(*pages, start=100):
+    """Pager output for lists of message ids: one history record per message, pages in order."""
+    out = []
+    record = start
+    for ids in pages:
+        entries = []
+        for gmail_id in ids:
+            record += 1
+            entries.append((gmail_id, str(record)))
+        out.append((entries, str(record)))
+    return out
+
 @pytest.fixture
 def user_token():
     return UserToken(email='a@b.com', access_token='tok', refresh_token='ref', history_id='h')
@@ -34,20 +85,428 @@ def test_archive_gmail_message():
     service.users().messages().modify.assert_called()
 
 def test_process_user_emails_no_categories(user_token):
-    with patch('backend.services.gmail_processor.Credentials'), \
-         patch('backend.services.gmail_processor.build'), \
-         patch('backend.services.gmail_processor.save_email'), \
+    with patch('backend.services.gmail_processor.get_gmail_service'), \
+         patch('backend.services.gmail_processor.save_emails'), \
          patch('backend.services.gmail_processor.get_latest_history_id', return_value='h'), \
          patch('backend.services.session_db.set_history_id_by_email'):
         result = gmail_processor.process_user_emails(user_token, [], max_emails=2, last_history_id='h')
         assert result == []
 
 def test_process_user_emails_no_last_history_id(user_token, categories):
-    with patch('backend.services.gmail_processor.Credentials'), \
-         patch('backend.services.gmail_processor.build'), \
-         patch('backend.services.gmail_processor.save_email'), \
+    with patch('backend.services.gmail_processor.get_gmail_service'), \
+         patch('backend.services.gmail_processor.save_emails'), \
          patch('backend.services.gmail_processor.get_latest_history_id', return_value='h'), \
-         patch('backend.services.session_db.set_history_id_by_email') as mock_set:
+         patch('backend.services.gmail_processor.set_history_id_by_email') as mock_set:
         result = gmail_processor.process_user_emails(user_token, categories, max_emails=2, last_history_id='')
         mock_set.assert_called()
-        assert result == [] 
\ No newline at end of file
+        assert result == [] 
+@pytest.fixture
+def fake_gmail():
+    from fake_gmail import FakeGmail
+    fake = FakeGmail().start()
+    yield fake
+    fake.stop()
+
+def test_fetch_messages_batches_requests(fake_gmail):
+    from fake_gmail import make_message
+    import math
+    ids = [f'm{i}' for i in range(23)]
+    fake_gmail.messages = {i: make_message(i) for i in ids}
+    result = gmail_processor.fetch_messages(fake_gmail.service(), ids, batch_size=10, format='full')
+    assert set(result) == set(ids)
+    assert len(fake_gmail.calls) == len(ids)
+    assert len(fake_gmail.requests) == math.ceil(len(ids) / 10)
+
+def test_fetch_messages_retries_rate_limited_items(fake_gmail):
+    from fake_gmail import make_message
+    fake_gmail.messages = {i: make_message(i) for i in ['a', 'b', 'c']}
+    fake_gmail.failures = {'b': [429]}
+    with patch('backend.services.gmail_processor.time.sleep'):
+        result = gmail_processor.fetch_messages(fake_gmail.service(), ['a', 'b', 'c', 'missing'], batch_size=10)
+    assert set(result) == {'a', 'b', 'c'}
+    assert len(fake_gmail.requests) == 2
+
+def test_process_user_emails_uses_batched_fetch(user_token, categories, fake_gmail):
+    from fake_gmail import make_message
+    ids = [f'm{i}' for i in range(5)]
+    fake_gmail.messages = {i: make_message(i) for i in ids}
+    with patch('backend.services.gmail_processor.get_gmail_service', return_value=fake_gmail.service()), \
+         patch('backend.services.gmail_processor.iter_history_pages', return_value=history_pages(ids)), \
+         patch('backend.services.gmail_processor.set_history_id_by_email'), \
+         patch('backend.services.gmail_processor.get_existing_gmail_ids', return_value=set()), \
+         patch('backend.services.gmail_processor.classify_emails', side_effect=lambda texts, cats: [cats[0].id] * len(texts)), \
+         patch('backend.services.gmail_processor.summarize_email', return_value='sum'), \
+         patch('backend.services.gmail_processor.save_emails'), \
+         patch('backend.services.gmail_processor.GMAIL_BATCH_SIZE', 2), \
+         patch('backend.services.gmail_processor.GMAIL_ARCHIVE_FLUSH_SIZE', 2):
+        result = gmail_processor.process_user_emails(user_token, categories, max_emails=5, last_history_id='h')
+    assert [e['gmail_id'] for e in result] == ids
+    assert all(e['archived'] for e in result)
+    assert sorted(fake_gmail.archived) == ids
+    # one batched metadata fetch and one for bodies, then batchModify for every two processed messages
+    assert [path for _, path in fake_gmail.requests].count('/batch') == 2
+    assert [path for _, path in fake_gmail.requests].count('/gmail/v1/users/me/messages/batchModify') == 3
+
+def test_combined_mode_skips_batch_classification(user_token, categories, fake_gmail):
+    from fake_gmail import make_message
+    ids = [f'm{i}' for i in range(3)]
+    fake_gmail.messages = {i: make_message(i) for i in ids}
+    with patch('backend.services.gmail_processor.get_gmail_service', return_value=fake_gmail.service()), \
+         patch('backend.services.gmail_processor.iter_history_pages', return_value=history_pages(ids)), \
+         patch('backend.services.gmail_processor.set_history_id_by_email'), \
+         patch('backend.services.gmail_processor.get_existing_gmail_ids', return_value=set()), \
+         patch('backend.services.gmail_processor.OPENAI_COMBINED_MODE', True), \
+         patch('backend.services.gmail_processor.classify_emails') as mock_batch, \
+         patch('backend.services.gmail_processor.summarize_email') as mock_summarize, \
+         patch('backend.services.gmail_processor.classify_and_summarize_email', return_value=(categories[0].id, 'sum')) as mock_combined, \
+         patch('backend.services.gmail_processor.save_emails'):
+        result = gmail_processor.process_user_emails(user_token, categories, max_emails=3, last_history_id='h')
+    assert [e['gmail_id'] for e in result] == ids
+    # one completion per message, and no body is sent a second time for batch classification
+    assert mock_combined.call_count == 3
+    mock_batch.assert_not_called()
+    mock_summarize.assert_not_called()
+
+def test_process_user_emails_concurrent_keeps_order_and_isolates_errors(user_token, categories):
+    import threading
+    import time
+    ids = [f'm{i}' for i in range(8)]
+    in_flight = {'now': 0, 'max': 0}
+    lock = threading.Lock()
+
+    def slow_summarize(subject, sender, recipient, body, cats):
+        with lock:
+            in_flight['now'] += 1
+            in_flight['max'] = max(in_flight['max'], in_flight['now'])
+        time.sleep(0.02)
+        with lock:
+            in_flight['now'] -= 1
+        if body == 'body m3':
+            raise RuntimeError('boom')
+        return 'sum'
+
+    messages = {i: {'id': i, 'labelIds': ['INBOX'], 'snippet': f'body {i}', 'payload': {'headers': []}} for i in ids}
+    with patch('backend.services.gmail_processor.get_gmail_service'), \
+         patch('backend.services.gmail_processor.iter_history_pages', return_value=history_pages(ids)), \
+         patch('backend.services.gmail_processor.set_history_id_by_email'), \
+         patch('backend.services.gmail_processor.get_existing_gmail_ids', return_value=set()), \
+         patch('backend.services.gmail_processor.fetch_messages', return_value=messages), \
+         patch('backend.services.gmail_processor.classify_emails', side_effect=lambda texts, cats: [cats[0].id] * len(texts)), \
+         patch('backend.services.gmail_processor.summarize_email', side_effect=slow_summarize), \
+         patch('backend.services.gmail_processor.save_emails'), \
+         patch('backend.services.gmail_processor.archive_gmail_messages', side_effect=lambda service, ids: (ids, {})), \
+         patch('backend.services.gmail_processor.EMAIL_PROCESSING_CONCURRENCY', 3):
+        result = gmail_processor.process_user_emails(user_token, categories, max_emails=6, last_history_id='h')
+    assert [e['gmail_id'] for e in result] == ['m0', 'm1', 'm2', 'm4', 'm5']
+    assert 1 < in_flight['max'] <= 3
+
+def test_fetch_message_details_skips_bodies_of_unsorted_messages(fake_gmail):
+    from fake_gmail import make_message
+    fake_gmail.messages = {
+        'inbox': make_message('inbox', body='hello', attachment_size=50000),
+        'sent': make_message('sent', label_ids=['SENT'], attachment_size=50000),
+        'draft': make_message('draft', label_ids=['INBOX', 'DRAFT']),
+    }
+    before = gmail_processor.fetch_stats()
+    metadata, bodies = gmail_processor.fetch_message_details(fake_gmail.service(), ['inbox', 'sent', 'draft'])
+    after = gmail_processor.fetch_stats()
+    assert set(metadata) == {'inbox', 'sent', 'draft'}
+    assert set(bodies) == {'inbox'}
+    assert len(fake_gmail.requests) == 2
+    assert after['bodies_fetched'] - before['bodies_fetched'] == 1
+    # the whole sent message, including its attachment, was never downloaded
+    assert after['bytes_saved'] - before['bytes_saved'] >= 50000
+    parsed = gmail_processor.parse_message('inbox', metadata['inbox'], bodies['inbox'])
+    assert parsed['body'] == 'hello'
+    assert parsed['subject'] == 'Subject'
+
+def test_parse_message_caps_decoded_body():
+    import base64
+    body = {'payload': {'mimeType': 'multipart/mixed', 'parts': [
+        {'mimeType': 'multipart/alternative', 'parts': [
+            {'mimeType': 'text/plain', 'body': {'data': base64.urlsafe_b64encode(b'a' * 1000).decode()}},
+        ]},
+    ]}}
+    meta = {'id': 'x', 'labelIds': ['INBOX'], 'snippet': 's', 'payload': {'headers': []}}
+    with patch('backend.services.gmail_processor.GMAIL_MAX_BODY_BYTES', 100):
+        assert gmail_processor.parse_message('x', meta, body)['body'] == 'a' * 100
+    assert gmail_processor.parse_message('x', meta, body)['body'] == 'a' * 1000
+
+def test_classify_and_summarize_email_single_call(categories):
+    with patch.object(gmail_processor.client.chat.completions, 'create') as mock_create:
+        mock_create.return_value = MagicMock(choices=[MagicMock(message=MagicMock(content='{"category": "work", "summary": "A meeting."}'))])
+        result = gmail_processor.classify_and_summarize_email('Sub', 'a@b.com', 'b@b.com', 'Body', categories)
+        assert result == (categories[0].id, 'A meeting.')
+        assert mock_create.call_count == 1
+
+def test_classify_and_summarize_email_falls_back_on_bad_response(categories):
+    with patch.object(gmail_processor.client.chat.completions, 'create') as mock_create, \
+         patch('backend.services.gmail_processor.classify_email', return_value=categories[0].id) as mock_classify, \
+         patch('backend.services.gmail_processor.summarize_email', return_value='Summary') as mock_summarize:
+        mock_create.return_value = MagicMock(choices=[MagicMock(message=MagicMock(content='{"category": "Personal", "summary": "x"}'))])
+        result = gmail_processor.classify_and_summarize_email('Sub', 'a@b.com', 'b@b.com', 'Body', categories)
+        assert result == (categories[0].id, 'Summary')
+        mock_classify.assert_called_once()
+        mock_summarize.assert_called_once()
+
+def test_classify_emails_batches_and_falls_back(categories):
+    personal = Category(id=uuid.uuid4(), name='Personal', description='friends', session_id='sessid')
+    cats = categories + [personal]
+    with patch.object(gmail_processor.client.chat.completions, 'create') as mock_create, \
+         patch('backend.services.gmail_processor.classify_email', return_value=personal.id) as mock_single:
+        mock_create.return_value = MagicMock(choices=[MagicMock(message=MagicMock(content='{"1": "Work", "2": "Personal", "3": "Spam"}'))])
+        result = gmail_processor.classify_emails(['a', 'b', 'c', 'd'], cats)
+    assert result == [categories[0].id, personal.id, personal.id, personal.id]
+    assert mock_create.call_count == 1
+    # "3" named an unknown category and "4" was missing, so both were retried one by one
+    assert [c.args[0] for c in mock_single.call_args_list] == ['c', 'd']
+
+def test_classify_emails_splits_by_token_budget(categories):
+    with patch.object(gmail_processor.client.chat.completions, 'create') as mock_create, \
+         patch('backend.services.gmail_processor.CLASSIFY_BATCH_TOKEN_BUDGET', 400), \
+         patch('backend.services.gmail_processor.CLASSIFY_BATCH_MAX_CHARS', 800):
+        mock_create.return_value = MagicMock(choices=[MagicMock(message=MagicMock(content='{"1": "Work", "2": "Work"}'))])
+        result = gmail_processor.classify_emails(['x' * 2000] * 3, categories)
+    assert result == [categories[0].id] * 3
+    assert mock_create.call_count == 3
+
+def test_classify_email_uses_cache(categories, llm_cache):
+    with patch.object(gmail_processor.client.chat.completions, 'create') as mock_create:
+        mock_create.return_value = MagicMock(choices=[MagicMock(message=MagicMock(content='Work'))])
+        first = gmail_processor.classify_email('Weekly   digest', categories)
+        second = gmail_processor.classify_email('weekly digest', categories)
+    assert first == second == categories[0].id
+    assert mock_create.call_count == 1
+    assert llm_cache.stats()['hits'] == 1
+
+def test_summary_cache_is_per_recipient(categories, llm_cache):
+    with patch.object(gmail_processor.client.chat.completions, 'create') as mock_create:
+        mock_create.return_value = MagicMock(choices=[MagicMock(message=MagicMock(content='Summary for a@b.com'))])
+        gmail_processor.summarize_email('Sub', 'news@x.com', 'a@b.com', 'Body', [])
+        gmail_processor.summarize_email('Sub', 'news@x.com', 'a@b.com', 'Body', [])
+        assert mock_create.call_count == 1
+        # the same newsletter sent to another account must not get a's summary
+        mock_create.return_value = MagicMock(choices=[MagicMock(message=MagicMock(content='Summary for c@d.com'))])
+        assert gmail_processor.summarize_email('Sub', 'news@x.com', 'c@d.com', 'Body', []) == 'Summary for c@d.com'
+        assert mock_create.call_count == 2
+        mock_create.return_value = MagicMock(choices=[MagicMock(message=MagicMock(content='{"category": "Work", "summary": "Combined for e@f.com"}'))])
+        _, summary = gmail_processor.classify_and_summarize_email('Sub', 'news@x.com', 'e@f.com', 'Body', categories)
+    assert summary == 'Combined for e@f.com'
+    assert mock_create.call_count == 3
+
+def test_gmail_service_is_cached_per_token():
+    from backend.services import gmail_client
+    first = gmail_client.get_gmail_service(gmail_client.make_credentials('tok-cache-1', 'ref'))
+    again = gmail_client.get_gmail_service(gmail_client.make_credentials('tok-cache-1', 'ref'))
+    other = gmail_client.get_gmail_service(gmail_client.make_credentials('tok-cache-2', 'ref'))
+    assert first is again
+    assert first is not other
+    gmail_client.evict_gmail_service('tok-cache-1')
+    assert gmail_client.get_gmail_service(gmail_client.make_credentials('tok-cache-1', 'ref')) is not first
+
+def test_gmail_service_uses_a_transport_per_thread():
+    import threading
+    from backend.services import gmail_client
+    service = gmail_client.get_gmail_service(gmail_client.make_credentials('tok-threads', 'ref'))
+    transports = []
+
+    def grab():
+        first = service.users().getProfile(userId='me').http
+        second = service.users().getProfile(userId='me').http
+        transports.append((first, second))
+
+    threads = [threading.Thread(target=grab) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert all(first is second for first, second in transports)
+    assert transports[0][0] is not transports[1][0]
+
+def test_archive_gmail_messages_reports_per_id_failures(fake_gmail):
+    from fake_gmail import make_message
+    fake_gmail.messages = {i: make_message(i) for i in ['a', 'b', 'c']}
+    fake_gmail.batch_modify_failures = [400]
+    fake_gmail.modify_failures = {'b': [500]}
+    archived, failed = gmail_processor.archive_gmail_messages(fake_gmail.service(), ['a', 'b', 'c', 'gone'])
+    # 'gone' no longer exists, which counts as archived just like the single-message path
+    assert archived == ['a', 'c', 'gone']
+    assert list(failed) == ['b']
+
+def test_archive_gmail_messages_chunks_by_api_limit(fake_gmail):
+    ids = [f'm{i}' for i in range(2500)]
+    archived, failed = gmail_processor.archive_gmail_messages(fake_gmail.service(), ids)
+    assert archived == ids and failed == {}
+    assert len(fake_gmail.requests) == 3
+
+def test_process_user_emails_skips_stored_ids_before_fetch(user_token, categories):
+    ids = ['m0', 'm1', 'm2', 'm3']
+    with patch('backend.services.gmail_processor.get_gmail_service'), \
+         patch('backend.services.gmail_processor.iter_history_pages', return_value=history_pages(ids)), \
+         patch('backend.services.gmail_processor.set_history_id_by_email'), \
+         patch('backend.services.gmail_processor.get_existing_gmail_ids', return_value={'m0', 'm2'}) as mock_existing, \
+         patch('backend.services.gmail_processor.fetch_messages', return_value={}) as mock_fetch:
+        gmail_processor.process_user_emails(user_token, categories, max_emails=5, last_history_id='h')
+    mock_existing.assert_called_once_with('a@b.com', ids)
+    assert mock_fetch.call_args.args[1] == ['m1', 'm3']
+
+def test_process_user_emails_isolates_failed_saves(user_token, categories):
+    ids = ['m0', 'm1', 'm2']
+    messages = {i: {'id': i, 'labelIds': ['INBOX'], 'snippet': f'body {i}', 'payload': {'headers': []}} for i in ids}
+
+    def save(emails):
+        if len(emails) > 1 or emails[0].gmail_id == 'm1':
+            raise RuntimeError('db error')
+        return 1
+
+    with patch('backend.services.gmail_processor.get_gmail_service'), \
+         patch('backend.services.gmail_processor.iter_history_pages', return_value=history_pages(ids)), \
+         patch('backend.services.gmail_processor.set_history_id_by_email'), \
+         patch('backend.services.gmail_processor.get_existing_gmail_ids', return_value=set()), \
+         patch('backend.services.gmail_processor.fetch_messages', return_value=messages), \
+         patch('backend.services.gmail_processor.classify_emails', side_effect=lambda texts, cats: [cats[0].id] * len(texts)), \
+         patch('backend.services.gmail_processor.summarize_email', return_value='sum'), \
+         patch('backend.services.gmail_processor.save_emails', side_effect=save), \
+         patch('backend.services.gmail_processor.archive_gmail_messages', side_effect=lambda service, ids: (ids, {})) as mock_archive:
+        result = gmail_processor.process_user_emails(user_token, categories, max_emails=5, last_history_id='h')
+    assert [e['gmail_id'] for e in result] == ['m0', 'm2']
+    # only stored messages get archived
+    assert mock_archive.call_args.args[1] == ['m0', 'm2']
+
+def history_response(records, next_page=None, history_id='999'):
+    response = {'history': [{'id': record_id, 'messagesAdded': [{'message': {'id': i}} for i in ids]} for record_id, ids in records], 'historyId': history_id}
+    if next_page:
+        response['nextPageToken'] = next_page
+    return response
+
+def test_iter_history_pages_streams_pages_with_checkpoints():
+    service = MagicMock()
+    service.users().history().list().execute.side_effect = [
+        history_response([('101', ['a', 'b']), ('102', ['c'])], next_page='p2'),
+        history_response([('103', ['c', 'd'])]),
+    ]
+    pager = gmail_processor.iter_history_pages(service, '100')
+    assert next(pager) == ([('a', '101'), ('b', '101'), ('c', '102')], '102')
+    # the second page is only requested once the first one has been consumed
+    assert service.users().history().list().execute.call_count == 1
+    # the last page checkpoints at the mailbox historyId from the response, duplicates dropped
+    assert next(pager) == ([('d', '103')], '999')
+    assert list(pager) == []
+    service.users().getProfile.assert_not_called()
+
+def test_process_user_emails_checkpoints_after_each_page(user_token, categories):
+    calls = []
+    pages = history_pages(['m0', 'm1'], ['m2'])
+
+    def process(service, token, ids, cats):
+        calls.append(('process', ids))
+        if ids == ['m2']:
+            raise RuntimeError('crash mid-run')
+        return [{'gmail_id': i} for i in ids]
+
+    with patch('backend.services.gmail_processor.get_gmail_service'), \
+         patch('backend.services.gmail_processor.iter_history_pages', return_value=pages), \
+         patch('backend.services.gmail_processor.get_existing_gmail_ids', return_value=set()), \
+         patch('backend.services.gmail_processor._process_candidates', side_effect=process), \
+         patch('backend.services.gmail_processor.set_history_id_by_email', side_effect=lambda e, h: calls.append(('checkpoint', h))):
+        with pytest.raises(RuntimeError):
+            gmail_processor.process_user_emails(user_token, categories, max_emails=10, last_history_id='100')
+    # the first page is checkpointed before the second one starts; the crashed page is not
+    assert calls == [('process', ['m0', 'm1']), ('checkpoint', '102'), ('process', ['m2'])]
+
+def test_process_user_emails_stops_checkpoint_before_leftover_messages(user_token, categories):
+    entries = [('m0', '101'), ('m1', '101'), ('m2', '102'), ('m3', '103')]
+    with patch('backend.services.gmail_processor.get_gmail_service'), \
+         patch('backend.services.gmail_processor.iter_history_pages', return_value=[(entries, '999')]), \
+         patch('backend.services.gmail_processor.get_existing_gmail_ids', return_value=set()), \
+         patch('backend.services.gmail_processor._process_candidates', side_effect=lambda s, t, ids, c: [{'gmail_id': i} for i in ids]) as mock_process, \
+         patch('backend.services.gmail_processor.set_history_id_by_email') as mock_set:
+        result = gmail_processor.process_user_emails(user_token, categories, max_emails=3, last_history_id='100')
+    assert [e['gmail_id'] for e in result] == ['m0', 'm1', 'm2']
+    mock_process.assert_called_once()
+    # m3 was left over, so the stored history id stays at the record that added m2
+    mock_set.assert_called_once_with('a@b.com', '102')
+
+def test_history_expiry_falls_back_to_resumable_resync(categories, fake_gmail):
+    from fake_gmail import make_message
+    token = UserToken(email=f'{uuid.uuid4().hex}@example.com', access_token='tok', refresh_token='ref', history_id='1')
+    ids = [f'm{i}' for i in range(5)]
+    fake_gmail.messages = {i: make_message(i) for i in ids}
+    fake_gmail.messages['sent'] = make_message('sent', label_ids=['SENT'])
+    fake_gmail.history_expired = True
+    stored = []
+
+    def save(emails):
+        stored.extend(e.gmail_id for e in emails)
+        return len(emails)
+
+    with patch('backend.services.gmail_processor.get_gmail_service', return_value=fake_gmail.service()), \
+         patch('backend.services.gmail_processor.get_existing_gmail_ids', side_effect=lambda email, page: set(page) & set(stored)), \
+         patch('backend.services.gmail_processor.classify_emails', side_effect=lambda texts, cats: [cats[0].id] * len(texts)), \
+         patch('backend.services.gmail_processor.summarize_email', return_value='sum'), \
+         patch('backend.services.gmail_processor.save_emails', side_effect=save), \
+         patch('backend.services.gmail_processor.set_history_id_by_email') as mock_set, \
+         patch('backend.services.gmail_processor.RESYNC_PAGE_SIZE', 2):
+        first = gmail_processor.process_user_emails(token, categories, max_emails=3, last_history_id='1')
+        progress = gmail_processor.get_mailbox_resync(token.email)
+        assert [e['gmail_id'] for e in first] == ['m0', 'm1', 'm2']
+        assert progress.status == 'running' and progress.processed == 3 and progress.history_id == '500'
+        mock_set.assert_not_called()
+
+        # the next run resumes at the unfinished page instead of reading history again
+        second = gmail_processor.process_user_emails(token, categories, max_emails=3, last_history_id='1')
+    assert [e['gmail_id'] for e in second] == ['m3', 'm4']
+    progress = gmail_processor.get_mailbox_resync(token.email)
+    assert (progress.status, progress.scanned, progress.skipped, progress.processed) == ('done', 5, 1, 5)
+    mock_set.assert_called_once_with(token.email, '500')
+    assert sorted(stored) == ids
+
+def test_process_accounts_runs_in_parallel_and_reports_failures(categories):
+    import threading
+    import time
+    tokens = [UserToken(email=f'u{i}@example.com', access_token='tok', history_id=str(100 + i)) for i in range(5)]
+    in_flight = {'now': 0, 'max': 0}
+    lock = threading.Lock()
+
+    def process(user_token, cats, max_emails, last_history_id):
+        with lock:
+            in_flight['now'] += 1
+            in_flight['max'] = max(in_flight['max'], in_flight['now'])
+        time.sleep(0.05)
+        with lock:
+            in_flight['now'] -= 1
+        if user_token.email == 'u2@example.com':
+            raise RuntimeError('token revoked')
+        assert cats is categories and last_history_id == user_token.history_id
+        return [{'gmail_id': f'{user_token.email}-m'}]
+
+    with patch('backend.services.gmail_processor.process_user_emails', side_effect=process), \
+         patch('backend.services.gmail_processor.ACCOUNT_PROCESSING_CONCURRENCY', 2):
+        results, summary = gmail_processor.process_accounts(tokens, categories, max_emails=3)
+    assert in_flight['max'] == 2
+    assert list(results) == [t.email for t in tokens]
+    assert results['u0@example.com'] == {'processed': 1, 'emails': [{'gmail_id': 'u0@example.com-m'}]}
+    assert results['u2@example.com'] == {'error': 'token revoked'}
+    assert (summary['accounts'], summary['succeeded'], summary['failed']) == (5, 4, ['u2@example.com'])
+    assert set(summary['timings']) == set(results) and all(t >= 0.05 for t in summary['timings'].values())
+
+def test_process_user_emails_reads_stored_history_id_when_held(user_token, categories):
+    order = []
+
+    def single_flight(key, fn):
+        order.append('lock')
+        return [fn()]
+
+    def stored(email):
+        order.append('read')
+        return '300'
+
+    with patch('backend.services.gmail_processor.single_flight', side_effect=single_flight), \
+         patch('backend.services.gmail_processor.get_history_id_by_email', side_effect=stored), \
+         patch('backend.services.gmail_processor._process_user_emails', return_value=[]) as mock_run:
+        gmail_processor.process_user_emails(user_token, categories, last_history_id=None)
+        assert mock_run.call_args.args[3] == '300'
+        assert order == ['lock', 'read']
+        # an explicit start point is used as given
+        gmail_processor.process_user_emails(user_token, categories, last_history_id='100')
+        assert mock_run.call_args.args[3] == '100'
@@ -0,0 +1,105 @@
+import time
+import pytest
+from unittest.mock import patch
+from sqlalchemy import text
+from backend.main import app  # noqa: F401  (startup applies the migrations)
+from backend.services import job_queue
+from database.models import ProcessingJob
+
+
+@pytest.fixture
+def db():
+    from backend.services.session_db import SessionLocal
+    session = SessionLocal()
+    patcher = patch('backend.services.job_queue.JOB_COALESCE_WINDOW', 0)
+    patcher.start()
+    session.query(ProcessingJob).delete()
+    session.commit()
+    yield session
+    session.query(ProcessingJob).delete()
+    session.commit()
+    session.close()
+    patcher.stop()
+
+def test_enqueue_claim_complete(db):
+    job_id = job_queue.enqueue('a@example.com', 123)
+    job = job_queue.claim('w1')
+    assert str(job.id) == job_id
+    assert (job.account_email, job.history_id, job.status, job.attempts) == ('a@example.com', '123', 'running', 1)
+    # a claimed job is invisible to other workers
+    assert job_queue.claim('w2') is None
+    assert job_queue.complete(job)
+    assert db.query(ProcessingJob).count() == 0
+
+def test_claim_skips_rows_locked_by_another_worker(db):
+    first = job_queue.enqueue('a@example.com', 1)
+    second = job_queue.enqueue('b@example.com', 2)
+    engine = db.get_bind()
+    with engine.connect() as conn:
+        # another worker is in the middle of claiming the first job
+        conn.execute(text("SELECT id FROM processing_jobs WHERE id = :id FOR UPDATE"), {'id': first})
+        job = job_queue.claim('w1')
+        assert str(job.id) == second
+        conn.rollback()
+    assert str(job_queue.claim('w2').id) == first
+
+def test_expired_visibility_timeout_is_claimed_again(db):
+    job_queue.enqueue('a@example.com', 1)
+    stale = job_queue.claim('crashed', visibility_timeout=0)
+    time.sleep(0.01)
+    job = job_queue.claim('w2')
+    assert job.id == stale.id and job.attempts == 2 and job.locked_by == 'w2'
+    # the crashed worker no longer owns the job
+    assert not job_queue.complete(stale)
+    assert job_queue.complete(job)
+
+def test_failed_jobs_retry_with_backoff_then_dead_letter(db):
+    job_queue.enqueue('a@example.com', 1)
+    with patch('backend.services.job_queue.JOB_RETRY_BACKOFF', 0):
+        for attempt in range(1, 3):
+            job = job_queue.claim('w1')
+            assert job.attempts == attempt
+            assert job_queue.fail(job, 'boom', max_attempts=2) == ('queued' if attempt < 2 else 'dead')
+    row = db.query(ProcessingJob).one()
+    assert (row.status, row.last_error) == ('dead', 'boom')
+    assert job_queue.claim('w1') is None
+
+def test_retry_waits_for_backoff(db):
+    job_queue.enqueue('a@example.com', 1)
+    job = job_queue.claim('w1')
+    with patch('backend.services.job_queue.JOB_RETRY_BACKOFF', 60):
+        assert job_queue.fail(job, 'boom') == 'queued'
+    assert job_queue.claim('w1') is None
+
+def test_workers_drain_the_queue(db):
+    done = []
+    ids = [job_queue.enqueue(f'{i}@example.com', i) for i in range(6)]
+    with patch('backend.services.job_queue.JOB_POLL_INTERVAL', 0.01):
+        job_queue.start_workers(lambda job: done.append(str(job.id)), count=3)
+        try:
+            deadline = time.time() + 5
+            while len(done) < len(ids) and time.time() < deadline:
+                time.sleep(0.02)
+        finally:
+            job_queue.stop_workers()
+    assert sorted(done) == sorted(ids)
+    assert db.query(ProcessingJob).count() == 0
+
+def test_notifications_coalesce_into_one_waiting_job(db):
+    first = job_queue.enqueue('a@example.com', 5, window=0.2)
+    assert job_queue.enqueue('a@example.com', 9) == first
+    assert job_queue.enqueue('a@example.com', 7) == first
+    other = job_queue.enqueue('b@example.com', 3, window=0.2)
+    assert other != first
+    # nothing runs until the window of the first notification has passed
+    assert job_queue.claim('w1') is None
+    time.sleep(0.25)
+    job = job_queue.claim('w1')
+    assert (str(job.id), job.history_id) == (first, '9')
+    # a notification while the job runs queues a fresh job instead of being lost
+    later = job_queue.enqueue('a@example.com', 12)
+    assert later != first
+    assert job_queue.fail(job, 'boom') == 'queued'
+    # the failed run was folded into the waiting job
+    rows = db.query(ProcessingJob).filter_by(account_email='a@example.com').all()
+    assert [(str(r.id), r.status, r.history_id) for r in rows] == [(later, 'queued', '12')]
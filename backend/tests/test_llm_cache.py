@@ -0,0 +1,69 @@
+import uuid
+import time
+from backend.services import llm_cache
+from backend.models.category import Category
+from backend.utils.ttl_cache import TTLCache
+
+def make_categories(session_id='sessid', description='desc'):
+    return [Category(id=uuid.uuid4(), name='Work', description=description, session_id=session_id)]
+
+def test_key_ignores_whitespace_and_case():
+    assert llm_cache.make_key('classify', 'm', 'Hello  World\n') == llm_cache.make_key('classify', 'm', 'hello world')
+    assert llm_cache.make_key('classify', 'm', 'hello') != llm_cache.make_key('classify', 'other', 'hello')
+
+def test_category_fingerprint_tracks_names_and_descriptions():
+    base = llm_cache.categories_fingerprint(make_categories())
+    # Same names and descriptions in another session share a fingerprint
+    assert base == llm_cache.categories_fingerprint(make_categories(session_id='other'))
+    assert base != llm_cache.categories_fingerprint(make_categories(description='changed'))
+
+def test_ttl_cache_evicts_by_size_and_age():
+    cache = TTLCache(maxsize=2, ttl=0.05)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.set('c', 3)
+    assert 'a' not in cache
+    assert cache.get('c') == 3
+    time.sleep(0.06)
+    assert cache.get('c') is None
+    assert cache.stats()['hits'] == 1
+
+def test_memory_cache_invalidate_session():
+    cache = llm_cache.MemoryLLMCache()
+    cache.set('k1', 'Work', 'sess1')
+    cache.set('k2', 'Work', 'sess2')
+    assert cache.invalidate_session('sess1') == 1
+    assert cache.get('k1') is None
+    assert cache.get('k2') == 'Work'
+    assert cache.stats()['misses'] == 1
+
+def test_postgres_cache_roundtrip():
+    from backend.main import app  # noqa: F401 - creates the tables
+    cache = llm_cache.PostgresLLMCache()
+    key = uuid.uuid4().hex
+    session_id = f'sess-{uuid.uuid4()}'
+    assert cache.get(key) is None
+    cache.set(key, 'Work', session_id)
+    cache.set(key, 'Personal', session_id)
+    assert cache.get(key) == 'Personal'
+    assert cache.invalidate_session(session_id) == 1
+    assert cache.get(key) is None
+    assert cache.stats()['hits'] == 1
+
+def test_postgres_cache_purges_expired_rows():
+    from backend.main import app  # noqa: F401 - creates the tables
+    from sqlalchemy import text
+    from database.db import engine
+    cache = llm_cache.PostgresLLMCache(ttl=60, purge_interval=3600)
+    old, fresh = uuid.uuid4().hex, uuid.uuid4().hex
+    cache.set(old, 'Work')
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE llm_cache SET created_at = now() - interval '2 minutes' WHERE key = :k"), {"k": old})
+    # the first set purged (nothing was expired yet); the next purge waits for the interval
+    cache.set(fresh, 'Work')
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM llm_cache WHERE key = :k"), {"k": old}).scalar() == 1
+    assert cache.purge_expired() >= 1
+    with engine.connect() as conn:
+        keys = {row.key for row in conn.execute(text("SELECT key FROM llm_cache WHERE key IN (:a, :b)"), {"a": old, "b": fresh})}
+    assert keys == {fresh}
@@ -0,0 +1,162 @@
+import json
+import uuid
+
+import pytest
+from sqlalchemy import text
+
+from backend.main import app  # noqa: F401  (startup applies the migrations)
+from database.db import engine
+from database.migrations import MIGRATIONS, run_migrations
+
+
+def index_names(conn, table):
+    return {row.indexname for row in conn.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = :t"), {"t": table})}
+
+
+def test_migrations_recorded_and_rerun_is_noop():
+    assert run_migrations(engine) == []
+    with engine.connect() as conn:
+        versions = [row.version for row in conn.execute(text("SELECT version FROM schema_migrations ORDER BY version"))]
+        assert versions == [version for version, _, _ in MIGRATIONS]
+        assert {'uq_emails_user_email_gmail_id', 'ix_emails_user_email_category_id'} <= index_names(conn, 'emails')
+        assert {'uq_session_accounts_session_id_email', 'ix_session_accounts_email'} <= index_names(conn, 'session_accounts')
+        assert 'ix_categories_session_id' in index_names(conn, 'categories')
+        assert 'ix_emails_id' not in index_names(conn, 'emails')
+
+
+def test_index_migration_dedupes_existing_rows(capsys):
+    session_id = f'sess-{uuid.uuid4()}'
+    email = f'{uuid.uuid4().hex}@example.com'
+    # a database from before the migration: no unique index, duplicate account rows,
+    # the one with the newest tokens neither first nor last
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX uq_session_accounts_session_id_email"))
+        conn.execute(text("DELETE FROM schema_migrations WHERE version = 2"))
+        conn.execute(text("INSERT INTO sessions (id, primary_account) VALUES (:s, :e)"), {"s": session_id, "e": email})
+        for token, history_id in [('mid', '150'), ('new', '200'), ('old', '99')]:
+            conn.execute(
+                text("INSERT INTO session_accounts (id, session_id, email, access_token, refresh_token, history_id) "
+                     "VALUES (:id, :s, :e, :t, 'ref', :h)"),
+                {"id": uuid.uuid4(), "s": session_id, "e": email, "t": token, "h": history_id},
+            )
+
+    assert run_migrations(engine) == [2]
+    assert 'Deleted 2 duplicate session_accounts rows' in capsys.readouterr().out
+    with engine.connect() as conn:
+        tokens = conn.execute(text("SELECT access_token FROM session_accounts WHERE session_id = :s"), {"s": session_id}).scalars().all()
+        assert tokens == ['new']
+        assert 'uq_session_accounts_session_id_email' in index_names(conn, 'session_accounts')
+    with pytest.raises(Exception):
+        with engine.begin() as conn:
+            conn.execute(
+                text("INSERT INTO session_accounts (id, session_id, email, access_token) VALUES (:id, :s, :e, 'tok')"),
+                {"id": uuid.uuid4(), "s": session_id, "e": email},
+            )
+
+
+def test_migrations_build_the_model_schema():
+    from sqlalchemy import create_engine
+    from database.db import DATABASE_URL, Base
+    import database.models  # noqa: F401  (registers the tables on Base.metadata)
+
+    def schema(name):
+        with engine.connect() as conn:
+            columns = {
+                tuple(row) for row in conn.execute(text(
+                    "SELECT table_name, column_name, data_type, is_nullable, column_default "
+                    "FROM information_schema.columns WHERE table_schema = :s AND table_name <> 'schema_migrations'"
+                ), {"s": name})
+            }
+            indexes = {
+                (row.tablename, row.indexname, row.indexdef.replace(f'{name}.', ''))
+                for row in conn.execute(text("SELECT tablename, indexname, indexdef FROM pg_indexes WHERE schemaname = :s"), {"s": name})
+                if row.tablename != 'schema_migrations'
+            }
+        return columns, indexes
+
+    schemas = {'migrated': f'm_{uuid.uuid4().hex[:8]}', 'models': f'c_{uuid.uuid4().hex[:8]}'}
+    engines = {}
+    try:
+        for name in schemas.values():
+            with engine.begin() as conn:
+                conn.execute(text(f"CREATE SCHEMA {name}"))
+            engines[name] = create_engine(DATABASE_URL, connect_args={"options": f"-csearch_path={name}"})
+        run_migrations(engines[schemas['migrated']])
+        Base.metadata.create_all(bind=engines[schemas['models']])
+        migrated, models = schema(schemas['migrated']), schema(schemas['models'])
+        assert {('emails', 'created_at'), ('email_contents', 'body')} <= {column[:2] for column in migrated[0]}
+        assert migrated[0] == models[0]
+        assert migrated[1] == models[1]
+    finally:
+        for bind in engines.values():
+            bind.dispose()
+        with engine.begin() as conn:
+            for name in schemas.values():
+                conn.execute(text(f"DROP SCHEMA IF EXISTS {name} CASCADE"))
+
+
+def test_content_migration_moves_bodies_and_headers_in_batches():
+    import zlib
+    from unittest.mock import patch
+    from database import migrations
+    session_id = f'sess-{uuid.uuid4()}'
+    category_id = uuid.uuid4()
+    ids = [uuid.uuid4() for _ in range(3)]
+    stored_headers = [json.dumps({'Subject': 'S0'}), 'Subject: S1\nList-Unsubscribe: <https://x.test/u>\n', None]
+    # a database from before the migration: body and headers inline in emails
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE emails ADD COLUMN raw TEXT, ADD COLUMN headers TEXT"))
+        conn.execute(text("DELETE FROM schema_migrations WHERE version = 4"))
+        conn.execute(text("INSERT INTO categories (id, name, session_id) VALUES (:id, 'Work', :s)"), {"id": category_id, "s": session_id})
+        for n, (email_id, headers) in enumerate(zip(ids, stored_headers)):
+            conn.execute(
+                text("INSERT INTO emails (id, subject, from_email, category_id, summary, raw, user_email, gmail_id, headers) "
+                     "VALUES (:id, 'S', 'x@y.com', :c, 's', :raw, 'old@example.com', :g, :h)"),
+                {"id": email_id, "c": category_id, "raw": f'body {n} ' * 50, "g": f'old-{uuid.uuid4()}', "h": headers},
+            )
+
+    with patch.object(migrations, 'CONTENT_MIGRATION_BATCH_SIZE', 2):
+        assert run_migrations(engine) == [4]
+    with engine.connect() as conn:
+        columns = {row.column_name for row in conn.execute(text("SELECT column_name FROM information_schema.columns WHERE table_name = 'emails'"))}
+        assert not {'raw', 'headers'} & columns
+        contents = {row.email_id: row for row in conn.execute(text("SELECT email_id, body, headers FROM email_contents WHERE email_id = ANY(:ids)"), {"ids": ids})}
+    assert [zlib.decompress(contents[i].body).decode() for i in ids] == [f'body {n} ' * 50 for n in range(3)]
+    assert all(len(contents[i].body) < len(f'body {n} ' * 50) for n, i in enumerate(ids))
+    assert [contents[i].headers for i in ids] == [{'Subject': 'S0'}, {'Subject': 'S1', 'List-Unsubscribe': '<https://x.test/u>'}, None]
+
+
+def test_header_migration_backfills_promoted_columns():
+    from unittest.mock import patch
+    from database import migrations
+    ids = [uuid.uuid4() for _ in range(3)]
+    stored_headers = [
+        {'List-Unsubscribe': '<https://x.test/u>', 'Message-ID': '<m0@x.test>'},
+        {'message-id': '<m1@x.test>', 'DATE': 'Wed, 2 Jul 2025 08:30:00 +0200'},
+        {'Subject': 'nothing promoted'},
+    ]
+    # a database from before the migration: headers only in email_contents
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE emails DROP COLUMN list_unsubscribe, DROP COLUMN list_unsubscribe_post, DROP COLUMN message_id, DROP COLUMN sent_at"))
+        conn.execute(text("DELETE FROM schema_migrations WHERE version = 5"))
+        for email_id, headers in zip(ids, stored_headers):
+            conn.execute(
+                text("INSERT INTO emails (id, subject, from_email, summary, user_email, gmail_id) "
+                     "VALUES (:id, 'S', 'x@y.com', 's', 'old@example.com', :g)"),
+                {"id": email_id, "g": f'old-{uuid.uuid4()}'},
+            )
+            conn.execute(
+                text("INSERT INTO email_contents (email_id, headers) VALUES (:id, CAST(:h AS JSONB))"),
+                {"id": email_id, "h": json.dumps(headers)},
+            )
+
+    with patch.object(migrations, 'HEADER_MIGRATION_BATCH_SIZE', 2):
+        assert run_migrations(engine) == [5]
+    with engine.connect() as conn:
+        assert not {'ix_emails_message_id', 'ix_emails_user_email_unsubscribable', 'ix_emails_user_email_sent_at'} & index_names(conn, 'emails')
+        rows = {row.id: row for row in conn.execute(
+            text("SELECT id, list_unsubscribe, message_id, extract(epoch FROM sent_at) AS sent_at FROM emails WHERE id = ANY(:ids)"), {"ids": ids})}
+    assert (rows[ids[0]].list_unsubscribe, rows[ids[0]].message_id, rows[ids[0]].sent_at) == ('<https://x.test/u>', '<m0@x.test>', None)
+    assert (rows[ids[1]].list_unsubscribe, rows[ids[1]].message_id) == (None, '<m1@x.test>')
+    assert rows[ids[1]].sent_at == 1751437800  # 2025-07-02 06:30 UTC
+    assert (rows[ids[2]].list_unsubscribe, rows[ids[2]].message_id, rows[ids[2]].sent_at) == (None, None, None)
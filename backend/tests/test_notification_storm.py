@@ -0,0 +1,104 @@
+"""
+Load test: replay a burst of Gmail push notifications through the webhook and the
+job queue, with the workers processing mail from the fake Gmail backend.
+"""
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+import backend.main as main
+from backend.models.category import Category
+from backend.models.user import UserToken
+from backend.services import gmail_processor
+from database.models import ProcessingJob
+from fake_gmail import FakeGmail, make_message
+
+ACCOUNTS = [f'storm{i}@example.com' for i in range(3)]
+MESSAGES = 30
+
+
+@pytest.fixture
+def fake_gmail():
+    fake = FakeGmail().start()
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture
+def clean_queue():
+    from backend.services.session_db import SessionLocal
+    db = SessionLocal()
+    db.query(ProcessingJob).delete()
+    db.commit()
+    yield
+    db.query(ProcessingJob).delete()
+    db.commit()
+    db.close()
+
+
+def test_notification_storm_is_coalesced(fake_gmail, clean_queue):
+    queue = main.job_queue
+    category = Category(id=str(uuid.uuid4()), name='Inbox', description='Everything', session_id='storm')
+    history_ids = {email: fake_gmail.history_id for email in ACCOUNTS}
+    stored = {email: set() for email in ACCOUNTS}
+    runs = {email: 0 for email in ACCOUNTS}
+    lock = threading.Lock()
+
+    def handle(job):
+        with lock:
+            runs[job.account_email] += 1
+        token = UserToken(email=job.account_email, access_token='tok', refresh_token='ref', history_id=None)
+        gmail_processor.process_user_emails(token, [category], max_emails=100, last_history_id=history_ids[job.account_email])
+
+    def save(emails):
+        with lock:
+            for email in emails:
+                stored[email.user_email].add(email.gmail_id)
+        return len(emails)
+
+    before = queue.queue_stats()
+    client = TestClient(main.app)
+    with patch('backend.services.gmail_processor.get_gmail_service', side_effect=lambda creds: fake_gmail.service()), \
+         patch('backend.services.gmail_processor.get_existing_gmail_ids', side_effect=lambda email, ids: set(ids) & stored[email]), \
+         patch('backend.services.gmail_processor.classify_emails', side_effect=lambda texts, cats: [cats[0].id] * len(texts)), \
+         patch('backend.services.gmail_processor.summarize_email', return_value='sum'), \
+         patch('backend.services.gmail_processor.save_emails', side_effect=save), \
+         patch('backend.services.gmail_processor.archive_gmail_messages', side_effect=lambda service, ids: (ids, {})), \
+         patch('backend.services.gmail_processor.set_history_id_by_email', side_effect=history_ids.__setitem__), \
+         patch('backend.services.gmail_processor.get_history_id_by_email', side_effect=history_ids.get), \
+         patch('backend.services.gmail_processor.get_mailbox_resync', return_value=None), \
+         patch('backend.main.get_account_context', return_value=object()), \
+         patch.object(queue, 'JOB_COALESCE_WINDOW', 0.3), \
+         patch.object(queue, 'JOB_POLL_INTERVAL', 0.02):
+        queue.start_workers(handle, count=2)
+        try:
+            # every new message triggers one push per account, sent concurrently
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                for i in range(MESSAGES):
+                    history_id = fake_gmail.deliver(make_message(f'm{i}'))
+                    for email in ACCOUNTS:
+                        pool.submit(client.post, '/gmail/webhook', json={'emailAddress': email, 'historyId': int(history_id)})
+                    time.sleep(0.02)
+            deadline = time.time() + 15
+            while time.time() < deadline:
+                if all(len(ids) == MESSAGES for ids in stored.values()) and not queue.queue_stats()['jobs']:
+                    break
+                time.sleep(0.05)
+        finally:
+            queue.stop_workers()
+    after = queue.queue_stats()
+
+    notifications = after['notifications'] - before['notifications']
+    executed = after['runs'] - before['runs']
+    print(f"notifications={notifications} runs={executed} per account={runs} stored={ {k: len(v) for k, v in stored.items()} }")
+    assert notifications == MESSAGES * len(ACCOUNTS)
+    assert all(ids == {f'm{i}' for i in range(MESSAGES)} for ids in stored.values())
+    # a burst of ~30 pushes per account is handled in a handful of runs
+    assert executed == sum(runs.values())
+    assert executed <= notifications // 5
+    assert after['coalesced'] - before['coalesced'] == notifications - executed
@@ -47,4 +47,257 @@ def test_remove_account_endpoint(client):
         assert resp.status_code == 200
         data = resp.json()
         assert data['removed_email'] == 'a@b.com'
-        assert data['message'] == 'Removed' 
\ No newline at end of file
+        assert data['message'] == 'Removed' 
+@pytest.fixture
+def stored_category(client):
+    import uuid
+    from backend.services import session_db
+    from backend.models.category import Category
+    category = Category(id=uuid.uuid4(), name='Work', description='desc', session_id=f'sess-{uuid.uuid4()}')
+    session_db.add_category(category)
+    return category
+
+def make_email(category, user_email, gmail_id):
+    from backend.models.email import Email
+    return Email(subject='S', from_email='x@y.com', category_id=category.id, summary='s', raw='r', user_email=user_email, gmail_id=gmail_id, headers={'Subject': 'S'})
+
+def test_get_existing_gmail_ids(stored_category):
+    import uuid
+    from backend.services import session_db
+    user_email = f'{uuid.uuid4().hex}@example.com'
+    session_db.save_emails([make_email(stored_category, user_email, gmail_id) for gmail_id in ['g1', 'g2']])
+    session_db.save_emails([make_email(stored_category, 'someone-else@example.com', 'g3')])
+    assert session_db.get_existing_gmail_ids(user_email, ['g1', 'g2', 'g3', 'g4']) == {'g1', 'g2'}
+    assert session_db.get_existing_gmail_ids(user_email, []) == set()
+
+def test_save_emails_single_statement_and_idempotent(stored_category):
+    import uuid
+    from sqlalchemy import event
+    from backend.services import session_db
+    from database.models import Email as DBEmail
+    engine = session_db.SessionLocal.kw['bind']
+    user_email = f'{uuid.uuid4().hex}@example.com'
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('INSERT INTO EMAILS'):
+            statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        batch = [make_email(stored_category, user_email, f'g{i}') for i in range(25)]
+        assert session_db.save_emails(batch) == 25
+        assert len(statements) == 1
+        # a retried batch (plus one new message) only inserts the new row
+        retry = [make_email(stored_category, user_email, f'g{i}') for i in range(26)]
+        assert session_db.save_emails(retry) == 1
+        assert len(statements) == 2
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    db = session_db.SessionLocal()
+    try:
+        assert db.query(DBEmail).filter(DBEmail.user_email == user_email).count() == 26
+    finally:
+        db.close()
+    assert all(e.id is not None for e in batch)
+
+def test_ingest_promotes_headers_to_columns(stored_category):
+    import uuid
+    from datetime import datetime, timezone
+    from backend.services import session_db
+    from database.models import Email as DBEmail
+    user_email = f'{uuid.uuid4().hex}@example.com'
+    headers = {
+        'list-unsubscribe': '<https://x.test/u>',
+        'LIST-UNSUBSCRIBE-POST': 'List-Unsubscribe=One-Click',
+        'Message-ID': '<m1@x.test>',
+        'Date': 'Tue, 1 Jul 2025 10:00:00 +0000',
+    }
+    bulk = make_email(stored_category, user_email, 'g1')
+    bulk.headers = headers
+    single = make_email(stored_category, user_email, 'g2')
+    single.headers = {'Date': 'not a date'}
+    session_db.save_emails([bulk])
+    session_db.save_email(single)
+    db = session_db.SessionLocal()
+    try:
+        rows = {e.gmail_id: e for e in db.query(DBEmail).filter(DBEmail.user_email == user_email)}
+    finally:
+        db.close()
+    assert rows['g1'].list_unsubscribe == '<https://x.test/u>'
+    assert rows['g1'].list_unsubscribe_post == 'List-Unsubscribe=One-Click'
+    assert rows['g1'].message_id == '<m1@x.test>'
+    assert rows['g1'].sent_at == datetime(2025, 7, 1, 10, 0, tzinfo=timezone.utc)
+    assert (rows['g2'].list_unsubscribe, rows['g2'].message_id, rows['g2'].sent_at) == (None, None, None)
+
+def test_mailbox_resync_progress_roundtrip():
+    import uuid
+    from backend.services import session_db
+    email = f'{uuid.uuid4().hex}@example.com'
+    assert session_db.get_mailbox_resync(email) is None
+    session_db.start_mailbox_resync(email, '500')
+    session_db.update_mailbox_resync(email, 'page-2', scanned=100, skipped=40, processed=60)
+    session_db.update_mailbox_resync(email, None, scanned=10, processed=10, status='done')
+    resync = session_db.get_mailbox_resync(email)
+    assert (resync.status, resync.page_token, resync.history_id) == ('done', None, '500')
+    assert (resync.scanned, resync.skipped, resync.processed) == (110, 40, 70)
+    # restarting begins again from the first page
+    resync = session_db.start_mailbox_resync(email, '900')
+    assert (resync.status, resync.scanned, resync.history_id) == ('running', 0, '900')
+
+def count_selects(engine):
+    from sqlalchemy import event
+    statements = []
+
+    def listener(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', listener)
+    return statements, lambda: event.remove(engine, 'before_cursor_execute', listener)
+
+def test_account_context_one_query_cold_none_warm():
+    import uuid
+    from backend.services import session_db
+    from backend.models.category import Category
+    session_id = f'sess-{uuid.uuid4()}'
+    email = f'{uuid.uuid4().hex}@example.com'
+    session_db.create_session(session_id, email, [{'email': email, 'access_token': 'tok', 'history_id': '10'}])
+    for name in ['Work', 'Bills']:
+        session_db.add_category(Category(id=uuid.uuid4(), name=name, description='d', session_id=session_id))
+
+    statements, stop = count_selects(session_db.SessionLocal.kw['bind'])
+    try:
+        context = session_db.get_account_context(email)
+        assert len(statements) == 1
+        assert (context.session_id, context.primary_account, context.history_id) == (session_id, email, '10')
+        assert sorted(c.name for c in context.categories) == ['Bills', 'Work']
+        session_db.get_account_context(email)
+        assert len(statements) == 1
+    finally:
+        stop()
+
+def test_account_context_invalidation_and_history_write_through():
+    import uuid
+    from backend.services import session_db
+    from backend.models.category import Category
+    session_id = f'sess-{uuid.uuid4()}'
+    email = f'{uuid.uuid4().hex}@example.com'
+    session_db.create_session(session_id, email, [{'email': email, 'access_token': 'tok'}])
+    assert session_db.get_account_context(email).categories == []
+
+    session_db.add_category(Category(id=uuid.uuid4(), name='Work', description='d', session_id=session_id))
+    assert [c.name for c in session_db.get_account_context(email).categories] == ['Work']
+
+    session_db.update_account_tokens(session_id, email, 'new-token')
+    assert session_db.get_account_context(email).access_token == 'new-token'
+
+    statements, stop = count_selects(session_db.SessionLocal.kw['bind'])
+    try:
+        session_db.set_history_id_by_email(email, '99')
+        selects = len(statements)
+        # the cached context picks up the new history id without another lookup
+        assert session_db.get_account_context(email).history_id == '99'
+        assert len(statements) == selects
+    finally:
+        stop()
+    assert session_db.get_account_context('nobody@example.com') is None
+
+def test_unknown_sender_negative_cache(client):
+    import uuid
+    from services import session_db  # the module instance the app uses
+    email = f'{uuid.uuid4().hex}@example.com'
+    statements, stop = count_selects(session_db.SessionLocal.kw['bind'])
+    try:
+        for _ in range(3):
+            resp = client.post('/gmail/webhook', json={"emailAddress": email, "historyId": 1})
+            assert resp.json()['status'] == 'user not found'
+        # only the first push reached the database
+        assert len(statements) == 1
+    finally:
+        stop()
+    assert session_db.is_unknown_sender(email)
+
+    # adding the account makes its notifications count again
+    session_id = f'sess-{uuid.uuid4()}'
+    session_db.create_session(session_id, 'owner@example.com', [{'email': 'owner@example.com', 'access_token': 'tok'}])
+    session_db.add_account_to_session(session_id, email, 'tok')
+    assert not session_db.is_unknown_sender(email)
+    assert session_db.get_account_context(email).session_id == session_id
+
+def test_unknown_sender_cache_is_bounded():
+    from unittest.mock import patch
+    from backend.services import session_db
+    from utils.ttl_cache import TTLCache
+    with patch.object(session_db, '_unknown_senders', TTLCache(maxsize=2, ttl=300)), \
+         patch.object(session_db, 'resolve_account_context', return_value=None):
+        for email in ['a@x.com', 'b@x.com', 'c@x.com']:
+            session_db.get_account_context(email)
+        assert not session_db.is_unknown_sender('a@x.com')
+        assert session_db.is_unknown_sender('c@x.com')
+        assert session_db.unknown_sender_stats()['size'] == 2
+
+def test_request_sessions_return_connections_to_pool(client):
+    import uuid
+    from database.db import engine
+    session_id = f'sess-{uuid.uuid4()}'
+    email = f'{uuid.uuid4().hex}@example.com'
+    client.post(f'/dev/test/create-session?email={email}')
+    baseline = engine.pool.checkedout()
+    for _ in range(5):
+        resp = client.post('/categories/', json={"name": f"C{uuid.uuid4().hex[:6]}", "description": "d", "session_id": session_id})
+        assert resp.status_code == 200
+        assert client.get(f'/categories/?session_id={session_id}').status_code == 200
+        assert client.get(f'/emails/?session_id={session_id}&category_id={uuid.uuid4()}').status_code == 200
+        assert client.get(f'/auth/session/{session_id}').status_code == 404
+        assert client.post('/emails/unsubscribe', json=[str(uuid.uuid4())]).status_code == 200
+        # error paths roll back and still hand the connection back
+        assert 'error' in client.put('/categories/not-a-uuid', json={"name": "x"}).json()
+        assert client.request("DELETE", '/emails/', json=[str(uuid.uuid4())]).status_code == 200
+        assert engine.pool.checkedout() == baseline
+
+def test_orphan_migration_scoped_and_only_on_category_changes(stored_category):
+    import uuid
+    from sqlalchemy import event
+    from backend.services import session_db
+    from database.models import Email as DBEmail
+    engine = session_db.SessionLocal.kw['bind']
+    session_id = f'sess-{uuid.uuid4()}'
+    owner, added, outsider = (f'{uuid.uuid4().hex}@example.com' for _ in range(3))
+    session_db.create_session(session_id, owner, [{'email': owner, 'access_token': 'tok'}])
+    orphans = [make_email(stored_category, account, f'o-{account}') for account in (owner, added, outsider)]
+    for email in orphans:
+        email.category_id = None
+    filed = make_email(stored_category, owner, 'filed')
+    session_db.save_emails(orphans + [filed])
+    updates = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('UPDATE EMAILS'):
+            updates.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        uncategorized = session_db.get_or_create_uncategorized_category(owner, session_id)
+        assert len(updates) == 1
+        # the category exists now, so later calls leave the emails alone
+        session_db.get_or_create_uncategorized_category(owner, session_id)
+        assert len(updates) == 1
+        # a new account brings its orphans along; refreshing its tokens does not
+        session_db.add_account_to_session(session_id, added, 'tok')
+        assert len(updates) == 2
+        session_db.add_account_to_session(session_id, added, 'tok2')
+        assert len(updates) == 2
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    assert session_db.migrate_orphaned_emails_to_uncategorized(session_id) == 0
+
+    db = session_db.SessionLocal()
+    try:
+        categories = {e.gmail_id: e.category_id for e in db.query(DBEmail).filter(DBEmail.user_email.in_([owner, added, outsider]))}
+    finally:
+        db.close()
+    assert categories[f'o-{owner}'] == uncategorized.id
+    assert categories[f'o-{added}'] == uncategorized.id
+    assert categories[f'o-{outsider}'] is None
+    assert categories['filed'] == stored_category.id
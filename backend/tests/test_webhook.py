@@ -1,43 +1,73 @@
 import pytest
+import uuid
 from fastapi.testclient import TestClient
 from backend.main import app
 from unittest.mock import patch, MagicMock
+from database.models import ProcessingJob
 
 @pytest.fixture(scope="module")
 def client():
     return TestClient(app)
 
 def test_gmail_webhook_missing_fields(client):
-    resp = client.post('/gmail/webhook', json={})
-    assert resp.status_code == 200
-    assert resp.json()['status'] == 'missing attributes'
+    with patch('backend.main.job_queue.enqueue') as mock_enqueue:
+        resp = client.post('/gmail/webhook', json={})
+        assert resp.status_code == 200
+        assert resp.json()['status'] == 'missing attributes'
+        resp = client.post('/gmail/webhook', json={"emailAddress": "a@b.com"})
+        assert resp.json()['status'] == 'missing attributes'
+    mock_enqueue.assert_not_called()
 
-def test_gmail_webhook_user_not_found(client):
-    with patch('backend.services.session_db.find_session_id_by_email', return_value=None):
+def test_gmail_webhook_remembered_unknown_sender(client):
+    with patch('backend.main.is_unknown_sender', return_value=True), \
+         patch('backend.main.get_account_context') as mock_context, \
+         patch('backend.main.job_queue.enqueue') as mock_enqueue:
         resp = client.post('/gmail/webhook', json={"emailAddress": "a@b.com", "historyId": "123"})
         assert resp.status_code == 200
         assert resp.json()['status'] == 'user not found'
+    # answered from the negative cache, without a lookup
+    mock_context.assert_not_called()
+    mock_enqueue.assert_not_called()
 
 def test_gmail_webhook_account_not_found(client):
-    with patch('backend.services.session_db.find_session_id_by_email', return_value='sessid'), \
-         patch('backend.services.session_db.get_account', return_value=None):
+    with patch('backend.main.is_unknown_sender', return_value=False), \
+         patch('backend.main.get_account_context', return_value=None) as mock_context, \
+         patch('backend.main.job_queue.enqueue') as mock_enqueue:
         resp = client.post('/gmail/webhook', json={"emailAddress": "a@b.com", "historyId": "123"})
         assert resp.status_code == 200
         assert resp.json()['status'] == 'user not found'
+    mock_context.assert_called_once_with("a@b.com")
+    mock_enqueue.assert_not_called()
 
-def test_gmail_webhook_success(client):
-    with patch('backend.services.session_db.find_session_id_by_email', return_value='sessid'), \
-         patch('backend.services.session_db.get_account') as mock_acc, \
-         patch('backend.services.session_db.get_categories_by_session', return_value=[MagicMock(name='Work', id='catid')]), \
-         patch('backend.services.session_db.get_history_id_by_email', return_value='100'), \
-         patch('backend.models.user.UserToken') as mock_token, \
-         patch('backend.services.gmail_processor.process_user_emails', return_value=[{'id': 'eid'}]), \
-         patch('backend.services.gmail_processor.get_latest_history_id', return_value='200'), \
-         patch('backend.services.session_db.set_history_id_by_email') as mock_set, \
-         patch('google.oauth2.credentials.Credentials'), \
-         patch('googleapiclient.discovery.build'):
-        mock_acc.return_value = MagicMock(email='a@b.com', access_token='tok', refresh_token='ref', history_id='100')
-        resp = client.post('/gmail/webhook', json={"emailAddress": "a@b.com", "historyId": "123"})
-        assert resp.status_code == 200
-        data = resp.json()
-        assert data['status'] == 'user not found' 
\ No newline at end of file
+def test_gmail_webhook_queues_and_returns_immediately(client):
+    from backend.services.session_db import SessionLocal
+    email = f'{uuid.uuid4().hex}@example.com'
+    with patch('backend.main.is_unknown_sender', return_value=False), \
+         patch('backend.main.get_account_context', return_value=MagicMock()), \
+         patch('backend.main.process_user_emails') as mock_process:
+        resp = client.post('/gmail/webhook', json={"emailAddress": email, "historyId": 42})
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data['status'] == 'queued'
+    # processing is left to the job workers
+    mock_process.assert_not_called()
+    db = SessionLocal()
+    try:
+        job = db.query(ProcessingJob).filter_by(account_email=email).one()
+        assert (str(job.id), job.history_id, job.status) == (data['job_id'], '42', 'queued')
+        db.delete(job)
+        db.commit()
+    finally:
+        db.close()
+
+def test_notification_handler_uses_stored_history_id():
+    from backend.main import handle_gmail_notification
+    # the cached context lags behind another worker's progress
+    context = MagicMock(history_id='100', categories=[MagicMock()])
+    with patch('backend.main.get_account_context', return_value=context), \
+         patch('backend.main.get_history_id_by_email', return_value='300'), \
+         patch('backend.main.process_user_emails', return_value=[]) as mock_process:
+        handle_gmail_notification(MagicMock(account_email='a@b.com', history_id='200'))
+        mock_process.assert_not_called()
+        handle_gmail_notification(MagicMock(account_email='a@b.com', history_id='400'))
+    assert mock_process.call_args.kwargs['last_history_id'] is None
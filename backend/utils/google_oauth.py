@@ -1,6 +1,5 @@
 import os
 from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
 from dotenv import load_dotenv
 
 dotenv_path = os.path.join(os.path.dirname(__file__), '..', '.env')
@@ -47,6 +46,7 @@ def fetch_token(state, code):
     return flow.credentials
 
 def get_user_email(credentials):
-    service = build('gmail', 'v1', credentials=credentials)
+    from services.gmail_client import get_gmail_service
+    service = get_gmail_service(credentials)
     profile = service.users().getProfile(userId='me').execute()
     return profile['emailAddress'] 
\ No newline at end of file
@@ -16,7 +16,9 @@ const CategoryView = ({ sessionId, sessionInfo }: CategoryViewProps) => {
   const navigate = useNavigate();
   const { activeAccount } = useAccount();
   const [emails, setEmails] = useState<Email[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | undefined>(undefined);
   const [isLoading, setIsLoading] = useState(true);
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
   const [selectedEmails, setSelectedEmails] = useState<Set<string>>(new Set());
   const [unsubscribeResults, setUnsubscribeResults] = useState<UnsubscribeResult[]>([]);
   const [aiUnsubscribeResults, setAiUnsubscribeResults] = useState<any[]>([]);
@@ -51,14 +53,17 @@ const CategoryView = ({ sessionId, sessionInfo }: CategoryViewProps) => {
     }
   };
 
+  // Use activeAccount for filtering, but handle "All Accounts" case and single account case
+  // If activeAccount is empty, "All Accounts", or there's only one account, don't filter
+  const filterUserEmail = () =>
+    (activeAccount && activeAccount !== 'All Accounts' && sessionInfo?.accounts && sessionInfo.accounts.length > 1) ? activeAccount : undefined;
+
   const loadEmails = async () => {
     if (!categoryId) return;
     
     try {
       setIsLoading(true);
-      // Use activeAccount for filtering, but handle "All Accounts" case and single account case
-      // If activeAccount is empty, "All Accounts", or there's only one account, don't filter
-      const userEmail = (activeAccount && activeAccount !== 'All Accounts' && sessionInfo?.accounts && sessionInfo.accounts.length > 1) ? activeAccount : undefined;
+      const userEmail = filterUserEmail();
       
       console.log('[CategoryView] Loading emails with:', {
         sessionId,
@@ -68,14 +73,17 @@ const CategoryView = ({ sessionId, sessionInfo }: CategoryViewProps) => {
         accountsCount: sessionInfo?.accounts?.length
       });
       
-      const data = await emailsAPI.getEmails(sessionId, categoryId, userEmail);
+      // First page only; further pages are fetched by loadMoreEmails
+      const page = await emailsAPI.getEmails(sessionId, categoryId, userEmail);
       
       console.log('[CategoryView] Loaded emails:', {
-        count: data.length,
-        emails: data.map(e => ({ id: e.id, subject: e.subject, user_email: e.user_email }))
+        count: page.emails.length,
+        more: Boolean(page.nextCursor),
+        emails: page.emails.map(e => ({ id: e.id, subject: e.subject, user_email: e.user_email }))
       });
       
-      setEmails(data);
+      setEmails(page.emails);
+      setNextCursor(page.nextCursor);
       // setToastMessage(`Loaded ${data.length} email(s) in this category.`); // Removed toast
       if (toastTimeout) clearTimeout(toastTimeout);
       const timeout = window.setTimeout(() => setToastMessage(null), 3000);
@@ -87,6 +95,21 @@ const CategoryView = ({ sessionId, sessionInfo }: CategoryViewProps) => {
     }
   };
 
+  const loadMoreEmails = async () => {
+    if (!categoryId || !nextCursor || isLoadingMore) return;
+
+    try {
+      setIsLoadingMore(true);
+      const page = await emailsAPI.getEmails(sessionId, categoryId, filterUserEmail(), nextCursor);
+      setEmails(prev => [...prev, ...page.emails]);
+      setNextCursor(page.nextCursor);
+    } catch (error) {
+      console.error('Failed to load more emails:', error);
+    } finally {
+      setIsLoadingMore(false);
+    }
+  };
+
   const handleSelectEmail = (emailId: string) => {
     const newSelected = new Set(selectedEmails);
     if (newSelected.has(emailId)) {
@@ -166,9 +189,16 @@ const CategoryView = ({ sessionId, sessionInfo }: CategoryViewProps) => {
     }
   };
 
-  const openEmailModal = (email: Email) => {
+  const openEmailModal = async (email: Email) => {
     setSelectedEmail(email);
     setShowEmailModal(true);
+    // The list leaves out bodies and headers; load the full email once it is opened
+    try {
+      const detail = await emailsAPI.getEmail(email.id, sessionId);
+      setSelectedEmail(current => (current && current.id === detail.id ? detail : current));
+    } catch (error) {
+      console.error('Failed to load email:', error);
+    }
   };
 
   const closeEmailModal = () => {
@@ -457,6 +487,17 @@ const CategoryView = ({ sessionId, sessionInfo }: CategoryViewProps) => {
                 </div>
               ))
             )}
+            {nextCursor && (
+              <div className="px-6 py-4 text-center">
+                <button
+                  onClick={loadMoreEmails}
+                  disabled={isLoadingMore}
+                  className="px-4 py-2 text-sm font-bold text-blue-700 bg-white border border-blue-300 rounded-lg shadow hover:bg-blue-100 focus:outline-none focus:ring-2 focus:ring-blue-400 disabled:opacity-50"
+                >
+                  {isLoadingMore ? 'Loading...' : 'Load more'}
+                </button>
+              </div>
+            )}
           </div>
         </div>
       </main>
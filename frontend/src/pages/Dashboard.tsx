@@ -129,8 +129,7 @@ const Dashboard: React.FC<DashboardProps> = ({
         // If there's only one account or "All Accounts" is selected, don't filter by user_email
         // Otherwise, use the selected account
         const userEmail = (sessionInfo?.accounts.length === 1 || activeAccount === 'All Accounts') ? undefined : activeAccount;
-        const emails = await emailsAPI.getEmails(sessionId, cat.id, userEmail);
-        counts[cat.id] = emails.length;
+        counts[cat.id] = await emailsAPI.getEmailCount(sessionId, cat.id, userEmail);
       }
       setEmailCounts(counts);
     } catch (error) {
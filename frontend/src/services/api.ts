@@ -1,5 +1,5 @@
 import axios from 'axios';
-import { Category, Email, UnsubscribeResult, SessionInfo } from '../types';
+import { Category, Email, EmailPage, UnsubscribeResult, SessionInfo } from '../types';
 
 const BASE_URL = "https://ai-email-sorter-1-1jhi.onrender.com";
 
@@ -49,7 +49,7 @@ export const categoriesAPI = {
 
 // Emails API
 export const emailsAPI = {
-  getEmails: async (sessionId: string, categoryId: string, userEmail?: string): Promise<Email[]> => {
+  getEmails: async (sessionId: string, categoryId: string, userEmail?: string, cursor?: string): Promise<EmailPage> => {
     const params = new URLSearchParams({ 
       session_id: sessionId, 
       category_id: categoryId
@@ -57,7 +57,23 @@ export const emailsAPI = {
     if (userEmail) {
       params.append('user_email', userEmail);
     }
+    if (cursor) {
+      params.append('cursor', cursor);
+    }
+    // One page per call; pass nextCursor back to get the following page
     const res = await api.get(`/emails/?${params}`);
+    return { emails: res.data, nextCursor: res.headers['x-next-cursor'] };
+  },
+  getEmailCount: async (sessionId: string, categoryId: string, userEmail?: string): Promise<number> => {
+    const params = new URLSearchParams({ session_id: sessionId, category_id: categoryId });
+    if (userEmail) {
+      params.append('user_email', userEmail);
+    }
+    const res = await api.get(`/emails/count?${params}`);
+    return res.data.count;
+  },
+  getEmail: async (emailId: string, sessionId: string): Promise<Email> => {
+    const res = await api.get(`/emails/${emailId}?session_id=${sessionId}`);
     return res.data;
   },
   getUnsubscribeLinks: async (emailIds: string[]): Promise<UnsubscribeResult[]> => {
@@ -11,10 +11,17 @@ export interface Email {
   from_email: string
   category_id: string
   summary: string
-  raw: string
+  raw?: string  // only on the detail route, not in the list
   user_email: string
   gmail_id: string
   headers?: Record<string, string>
+  created_at?: string
+}
+
+// One page of a category's emails; nextCursor is set when more follow
+export interface EmailPage {
+  emails: Email[]
+  nextCursor?: string
 }
 
 export interface UnsubscribeResult {
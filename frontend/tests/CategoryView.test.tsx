@@ -1,5 +1,5 @@
 import React from "react";
-import { render, screen, waitFor } from "@testing-library/react";
+import { fireEvent, render, screen, waitFor } from "@testing-library/react";
 import CategoryView from "../src/pages/CategoryView";
 import * as api from "../src/services/api"
 import { expect, jest, test } from "@jest/globals";
@@ -7,11 +7,29 @@ import { expect, jest, test } from "@jest/globals";
 jest.mock("../src/services/api");
 
 test("loads emails and displays them", async () => {
-  (api.emailsAPI.getEmails as jest.MockedFunction<typeof api.emailsAPI.getEmails>).mockResolvedValue([
-    { id: "1", subject: "Subj", from_email: "f", category_id: "1", summary: "s", raw: "r", user_email: "u", gmail_id: "g" }
-  ]);
+  (api.emailsAPI.getEmails as jest.MockedFunction<typeof api.emailsAPI.getEmails>).mockResolvedValue({
+    emails: [{ id: "1", subject: "Subj", from_email: "f", category_id: "1", summary: "s", raw: "r", user_email: "u", gmail_id: "g" }]
+  });
   render(<CategoryView sessionId="s" sessionInfo={null} userEmail="u" />);
   await waitFor(() => {
     expect(screen.getByText("Subj")).toBeTruthy();
   });
 });
+
+test("loads the next page on demand", async () => {
+  const getEmails = api.emailsAPI.getEmails as jest.MockedFunction<typeof api.emailsAPI.getEmails>;
+  getEmails
+    .mockResolvedValueOnce({
+      emails: [{ id: "1", subject: "First", from_email: "f", category_id: "1", summary: "s", user_email: "u", gmail_id: "g1" }],
+      nextCursor: "c1"
+    })
+    .mockResolvedValueOnce({
+      emails: [{ id: "2", subject: "Second", from_email: "f", category_id: "1", summary: "s", user_email: "u", gmail_id: "g2" }]
+    });
+  render(<CategoryView sessionId="s" sessionInfo={null} userEmail="u" />);
+  fireEvent.click(await screen.findByText("Load more"));
+  expect(await screen.findByText("Second")).toBeTruthy();
+  expect(screen.getByText("First")).toBeTruthy();
+  expect(getEmails.mock.calls[1][3]).toBe("c1");
+  expect(screen.queryByText("Load more")).toBeNull();
+});
@@ -5,8 +5,9 @@ import { expect, jest, test } from "@jest/globals";
 jest.mock("axios");
 const mockedAxios = axios as jest.Mocked<typeof axios>;
 
-test("emailsAPI.getEmails returns data", async () => {
-  mockedAxios.get.mockResolvedValue({ data: [{ id: 1 }] });
-  const data = await emailsAPI.getEmails("sid", 1);
-  expect(data[0].id).toBe(1);
+test("emailsAPI.getEmails returns one page and the next cursor", async () => {
+  mockedAxios.get.mockResolvedValue({ data: [{ id: 1 }], headers: { "x-next-cursor": "next" } });
+  const page = await emailsAPI.getEmails("sid", "1");
+  expect(page.emails[0].id).toBe(1);
+  expect(page.nextCursor).toBe("next");
 });
\ No newline at end of file